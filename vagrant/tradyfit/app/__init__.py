@@ -1,4 +1,5 @@
 from flask import Flask
+from werkzeug.local import LocalProxy
 from flask.ext.bootstrap import Bootstrap
 from flask_jsglue import JSGlue
 from flask.ext.sqlalchemy import SQLAlchemy
@@ -8,18 +9,41 @@ from flask_limiter import Limiter
 from flask.ext.mobility import Mobility
 from opbeat.contrib.flask import Opbeat
 from config import config
-import geonamescache
+from .cache import LRUCache, FragmentCache
+from .last_seen import LastSeenBuffer
 from geopy.geocoders import GoogleV3
 
 
 bootstrap = Bootstrap()
 db = SQLAlchemy()
 moment = Moment()
-gc = geonamescache.GeonamesCache()
 geolocator = GoogleV3()
 jsglue = JSGlue()
 limiter = Limiter()
 opbeat = Opbeat()
+search_cache = LRUCache()
+suggest_cache = LRUCache()
+tile_cache = LRUCache()
+user_cache = LRUCache()
+fragment_cache = FragmentCache()
+last_seen_buffer = LastSeenBuffer()
+
+#the uploads import the helpers, which need opbeat to be created first
+from .uploads import ImageUploader
+image_uploader = ImageUploader()
+
+_geonames = None
+
+def get_geonames():
+  '''geonamescache is imported and its data loaded on first use instead of
+  when the app is imported'''
+  global _geonames # pylint: disable=W0603
+  if _geonames is None:
+    import geonamescache
+    _geonames = geonamescache.GeonamesCache()
+  return _geonames
+
+gc = LocalProxy(get_geonames)
 
 login_manager = LoginManager()
 login_manager.login_view = 'main.index'
@@ -37,6 +61,22 @@ def create_app(config_name):
   limiter.init_app(app)
   Mobility(app)
   opbeat.init_app(app)
+  search_cache.configure(app.config['SEARCH_CACHE_SIZE'],
+                        app.config['SEARCH_CACHE_TIMEOUT'])
+  suggest_cache.configure(app.config['SUGGEST_CACHE_SIZE'],
+                          app.config['SUGGEST_CACHE_TIMEOUT'])
+  tile_cache.configure(app.config['TILE_CACHE_SIZE'],
+                      app.config['TILE_CACHE_TIMEOUT'])
+  user_cache.configure(app.config['USER_CACHE_SIZE'],
+                      app.config['USER_CACHE_TIMEOUT'])
+  fragment_cache.configure(app.config['FRAGMENT_CACHE_SIZE'],
+                          app.config['FRAGMENT_CACHE_TIMEOUT'],
+                          app.config['FRAGMENT_CACHE_BYTES'])
+  last_seen_buffer.init_app(app)
+  image_uploader.init_app(app)
+
+  from .fragments import item_box
+  app.add_template_global(item_box)
 
   from .admin import admin as admin_blueprint
   app.register_blueprint(admin_blueprint, url_prefix='/admin')
@@ -1,12 +1,17 @@
 from flask import redirect, url_for
 from functools import wraps
 from flask.ext.login import current_user
+from ..models import User
 
 
 def admin_required(f):
+  '''the admin flag is checked in the database, the logged in user can be
+  a cached snapshot taken before it was revoked by another process'''
   @wraps(f)
   def wrapped(*args, **kwargs):
-    if not (current_user.is_authenticated() and current_user.is_admin):
+    if not (current_user.is_authenticated() and current_user.is_admin and
+            User.query.filter_by(id=current_user.id, is_admin=True
+                                ).with_entities(User.id).first()):
       return redirect(url_for('main.index'))
     return f(*args, **kwargs)
   return wrapped
\ No newline at end of file
@@ -1,19 +1,48 @@
 # -*- coding: utf-8 -*-
-from flask import render_template
+from flask import render_template, request, current_app
 from . import admin
 from .decorators import admin_required
-from ..models import User, Item
+from ..models import User, Item, ITEM_UPDATED, seek_page, estimate_count
+from .. import search_cache, suggest_cache, tile_cache, user_cache, \
+fragment_cache
+from ..helpers import s3_stats
 
 
 @admin.route('/')
 @admin_required
 def index():
-  users = User.query.order_by(User.last_seen.desc()).all()
-  return render_template('admin/index.html', users=users)
+  '''users last seen first, a page at a time. The activity counts of the
+  page are computed in one query and the total is the planner estimate'''
+  pagination = seek_page(User.query, User.last_seen, 'last_seen',
+                        request.args.get('cursor'),
+                        current_app.config['ADMIN_PER_PAGE'])
+  counts = User.activity_counts([user.id for user in pagination.items])
+  return render_template('admin/index.html', users=pagination.items,
+                          counts=counts, pagination=pagination,
+                          total=estimate_count(User))
 
 
 @admin.route('/items')
 @admin_required
 def items():
-  items = Item.query.order_by(Item.modified.desc()).all()
-  return render_template('admin/items.html', items=items)
+  '''items last modified first, a page at a time, with the messages count
+  of the page in one query and the estimated total'''
+  pagination = seek_page(Item.query.listing(), ITEM_UPDATED, 'modified',
+                        request.args.get('cursor'),
+                        current_app.config['ADMIN_PER_PAGE'])
+  counts = Item.message_counts([item.id for item in pagination.items])
+  return render_template('admin/items.html', items=pagination.items,
+                          counts=counts, pagination=pagination,
+                          total=estimate_count(Item))
+
+
+@admin.route('/caches')
+@admin_required
+def caches():
+  '''hit rate and size of the in-process caches of this worker and the
+  timings of its S3 operations'''
+  stats = [(name, cache.stats) for name, cache in [('Users', user_cache),
+          ('Search results', search_cache), ('Suggestions', suggest_cache),
+          ('Map tiles', tile_cache), ('Item boxes', fragment_cache)]]
+  return render_template('admin/caches.html', stats=stats,
+                          storage=s3_stats.stats)
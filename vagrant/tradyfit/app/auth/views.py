@@ -5,8 +5,7 @@ from flask.ext.login import login_user, logout_user, current_user, \
 login_required
 from datetime import datetime, timedelta
 from app.models import User
-from app import helpers
-from .. import db, opbeat
+from .. import opbeat, image_uploader
 from . import auth
 
 
@@ -71,7 +70,8 @@ def facebook_authorized():
     return redirect(url_for('main.index'))
 
   session['fb_oauth'] = (resp['access_token'], '')
-  uinfo = facebook.get('/me')
+  #user info and avatar url in a single Graph API call
+  uinfo = facebook.get('/me?fields=id,name,email,gender,picture.type(large)')
 
   if "error" in uinfo.data.keys():
     flash('Something went wrong, please try to sign in later.')
@@ -79,26 +79,25 @@ def facebook_authorized():
   else:
     user = User.get_user(uinfo.data['email'])
     if not user:
-      #create unique username from email
-      username = User.create_username(uinfo.data['email'].split('@')[0])
-
-      #request facebook user avatar
-      uavatar = facebook.get('/me/picture?redirect=0&type=large')
-      #save image in s3
-      filename = helpers.save_avatar(uavatar.data['data']['url'])
-
       #check if gender is provided
       gender = 'unknown'
       if 'gender' in uinfo.data:
         gender = uinfo.data['gender']
 
-      #create user and add it to database
-      user = User(fb_id=uinfo.data['id'], gender=gender,
-                  email=uinfo.data['email'],
-                  name=uinfo.data['name'], username=username,
-                  avatar_url=filename)
-      db.session.add(user)
-      db.session.commit()
+      #facebook picture, if the user has one, imported in background
+      picture = uinfo.data.get('picture', {}).get('data', {})
+      source = None
+      if picture.get('url') and not picture.get('is_silhouette'):
+        source = picture['url']
+
+      #create user (with a unique username from email) and add it to database
+      #with the default avatar until the picture is imported
+      user = User.signup(uinfo.data['id'], uinfo.data['email'],
+                        uinfo.data['name'], gender,
+                        current_app.config['DEFAULT_AVATAR'],
+                        avatar_source=source)
+      if source and user.avatar_source == source:
+        image_uploader.enqueue_avatar(user.id, source)
 
     login_user(user)
     return redirect(url_for('main.index'))
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache(object):
+  '''thread safe in-process cache with least recently used eviction.
+  Entries can expire after timeout seconds, which bounds how stale a
+  cache can be in other worker processes that didn't see an invalidation.
+  hits and misses counters are kept for monitoring'''
+
+  def __init__(self, max_size=1000, timeout=None):
+    self.max_size = max_size
+    self.timeout = timeout
+    self.hits = 0
+    self.misses = 0
+    self._entries = OrderedDict()
+    self._lock = Lock()
+
+  def configure(self, max_size, timeout=None):
+    '''set up the cache limits from the app config'''
+    with self._lock:
+      self.max_size = max_size
+      self.timeout = timeout
+      self._evict()
+
+  def get(self, key, default=None):
+    with self._lock:
+      entry = self._entries.pop(key, None)
+      if entry is None or (entry[1] is not None and entry[1] < time.time()):
+        self.misses += 1
+        return default
+      self._entries[key] = entry #move it to the most recently used end
+      self.hits += 1
+      return entry[0]
+
+  def set(self, key, value):
+    expires = time.time() + self.timeout if self.timeout else None
+    with self._lock:
+      self._entries.pop(key, None)
+      self._entries[key] = (value, expires)
+      self._evict()
+
+  def delete(self, key):
+    with self._lock:
+      self._entries.pop(key, None)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+
+  def _evict(self):
+    '''remove least recently used entries until the size limit is met'''
+    while len(self._entries) > self.max_size:
+      self._entries.popitem(last=False)
+
+  def __len__(self):
+    return len(self._entries)
+
+  @property
+  def stats(self):
+    '''counters of the cache usage'''
+    total = self.hits + self.misses
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'hit_rate': float(self.hits) / total if total else 0.0,
+      'size': len(self)
+    }
+
+
+class FragmentCache(LRUCache):
+  '''cache of rendered html fragments. Each fragment is stored with the
+  version of the object it was rendered from and only served for that same
+  version. Besides the number of entries, the total length of the cached
+  html is bounded by max_bytes. The time spent rendering the misses is kept
+  to estimate the time saved by the hits'''
+
+  def __init__(self, max_size=1000, timeout=None, max_bytes=None):
+    super(FragmentCache, self).__init__(max_size, timeout)
+    self.max_bytes = max_bytes
+    self.bytes = 0
+    self.renders = 0
+    self.render_time = 0.0
+
+  def configure(self, max_size, timeout=None, max_bytes=None):
+    self.max_bytes = max_bytes
+    super(FragmentCache, self).configure(max_size, timeout)
+
+  def get_fragment(self, key, version):
+    '''html of key rendered for version or None'''
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None or entry[0][0] != version or \
+          (entry[1] is not None and entry[1] < time.time()):
+        self.misses += 1
+        return None
+      self._entries[key] = self._entries.pop(key)
+      self.hits += 1
+      return entry[0][1]
+
+  def set_fragment(self, key, version, html, render_time=0.0):
+    '''store the html of key for version, rendered in render_time seconds'''
+    expires = time.time() + self.timeout if self.timeout else None
+    with self._lock:
+      self._remove(key)
+      self._entries[key] = ((version, html), expires)
+      self.bytes += len(html)
+      self.renders += 1
+      self.render_time += render_time
+      self._evict()
+
+  def delete(self, key):
+    with self._lock:
+      self._remove(key)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self.bytes = 0
+
+  def _remove(self, key):
+    entry = self._entries.pop(key, None)
+    if entry is not None:
+      self.bytes -= len(entry[0][1])
+
+  def _evict(self):
+    while len(self._entries) > self.max_size or \
+        (self.max_bytes is not None and self.bytes > self.max_bytes):
+      _, entry = self._entries.popitem(last=False)
+      self.bytes -= len(entry[0][1])
+
+  @property
+  def stats(self):
+    '''counters of the cache usage, its memory and the render time saved
+    by the hits (average render time of the misses per hit)'''
+    stats = super(FragmentCache, self).stats
+    average = self.render_time / self.renders if self.renders else 0.0
+    stats.update({
+      'bytes': self.bytes,
+      'render_ms': average * 1000,
+      'saved_ms': self.hits * average * 1000
+    })
+    return stats
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+from threading import Lock
+from flask import g
+from flask.ext.sqlalchemy import event
+from .models import Category, Version, after_commit
+
+CategoryInfo = namedtuple('CategoryInfo', ['id', 'name'])
+
+
+class CategoryRegistry(object):
+  '''in-process copy of the categories, which almost never change, so
+  pages and forms don't query them on each request. The categories version
+  stamp in the db is checked once per request (app context) and the
+  registry reloads when another process has changed them'''
+
+  def __init__(self):
+    self.version = None
+    self._by_id = {}
+    self._by_name = {}
+    self._lock = Lock()
+
+  def invalidate(self):
+    self.version = None
+
+  def _refresh(self):
+    if self.version is not None and getattr(g, 'categories_checked', False):
+      return
+    version = Version.get('categories')
+    g.categories_checked = True
+    if version != self.version:
+      with self._lock:
+        categories = [CategoryInfo(c.id, c.name) for c in
+                      Category.query.order_by(Category.id).all()]
+        self._by_id = dict((c.id, c) for c in categories)
+        self._by_name = dict((c.name, c) for c in categories)
+        self.version = version
+
+  def get(self, id): # pylint: disable=W0622
+    '''CategoryInfo (id, name) of the category or None if it doesn't exist'''
+    self._refresh()
+    return self._by_id.get(id)
+
+  def get_by_name(self, name):
+    self._refresh()
+    return self._by_name.get(name)
+
+  def all(self):
+    '''all the categories ordered by id'''
+    self._refresh()
+    return sorted(self._by_id.values())
+
+  def choices(self):
+    '''list of tuples (category id, name) for the ItemForm category field'''
+    return [(c.id, c.name) for c in self.all()]
+
+
+category_registry = CategoryRegistry()
+
+
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def invalidate_registry(mapper, connection, target): # pylint: disable=W0613
+  '''changes made by this process are seen without waiting for the next
+  request, once committed (reloaded before, the registry could keep the
+  old categories under the new version)'''
+  after_commit(target, category_registry.invalidate)
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+import time
+from flask import current_app, Markup
+from . import fragment_cache
+
+
+def item_box_version(item):
+  '''everything shown in the item box that can change without a new item
+  id: the item itself (modified), its image upload state and renditions,
+  its category name and the user avatar and its renditions'''
+  return (item.modified or item.timestamp, item.image_url,
+          item.image_pending, item.image_renditions, item.category.name,
+          item.user.avatar_url, item.user.avatar_renditions)
+
+
+def item_box(item):
+  '''html of the item box of the list pages. It's rendered once per item
+  version and then served from the fragment cache'''
+  version = item_box_version(item)
+  html = fragment_cache.get_fragment(item.id, version)
+  if html is None:
+    start = time.time()
+    html = current_app.jinja_env.get_template(
+                          'main/_item_box.html').render(item=item)
+    fragment_cache.set_fragment(item.id, version, html, time.time() - start)
+  return Markup(html)
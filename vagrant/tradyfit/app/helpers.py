@@ -1,73 +1,209 @@
+import socket
+import time
 import requests
-from uuid import uuid4
+from contextlib import contextmanager
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from threading import Lock, local
 import boto
+from boto.exception import BotoClientError, BotoServerError, \
+NoAuthHandlerFound
+from requests.adapters import HTTPAdapter
 from flask import current_app
-from werkzeug import secure_filename
 from . import opbeat
+from .images import rendition_filenames
+
+
+#per thread HTTP session, its pool keeps the connections to the image hosts
+#alive between downloads
+_http = local()
+
+
+def get_http_session():
+  '''HTTP session of the current thread'''
+  if getattr(_http, 'session', None) is None:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=1)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    _http.session = session
+  return _http.session
 
 
 def make_image_request(url):
-  '''Request and download image content'''
+  '''Request and download image content in UPLOAD_CHUNK_SIZE chunks to a
+  temporary file (in memory up to UPLOAD_SPOOL_MEMORY bytes)
+  Output: file object at the start of the image, None if the request
+          failed (or got an error status) or the image is bigger than
+          MAX_CONTENT_LENGTH
+  '''
+  config = current_app.config
+  req = image = None
   try:
-    req = requests.get(url)
-    return req.content
-  except:
+    req = get_http_session().get(url, stream=True,
+                                  timeout=config["HTTP_TIMEOUT"])
+    req.raise_for_status()
+    if int(req.headers.get('content-length') or 0) > \
+        config["MAX_CONTENT_LENGTH"]:
+      req.close()
+      return None
+    image = SpooledTemporaryFile(max_size=config["UPLOAD_SPOOL_MEMORY"])
+    size = 0
+    for chunk in req.iter_content(config["UPLOAD_CHUNK_SIZE"]):
+      size += len(chunk)
+      if size > config["MAX_CONTENT_LENGTH"]:
+        req.close()
+        image.close()
+        return None
+      image.write(chunk)
+    if not size:
+      image.close()
+      return None
+    image.seek(0)
+    return image
+  except (requests.RequestException, IOError, OSError):
+    if req is not None:
+      req.close()
+    if image is not None:
+      image.close()
     return None
 
 
+class OperationStats(object):
+  '''calls, errors and time spent of each kind of operation, kept for
+  monitoring'''
+
+  def __init__(self):
+    self._operations = {}
+    self._lock = Lock()
+
+  @contextmanager
+  def timed(self, name):
+    '''time the block, an exception counts as an error'''
+    start = time.time()
+    failed = True
+    try:
+      yield
+      failed = False
+    finally:
+      self.record(name, time.time() - start, failed)
+
+  def record(self, name, elapsed, failed=False):
+    with self._lock:
+      operation = self._operations.setdefault(name,
+                    {'calls': 0, 'errors': 0, 'total': 0.0, 'max': 0.0})
+      operation['calls'] += 1
+      operation['errors'] += 1 if failed else 0
+      operation['total'] += elapsed
+      operation['max'] = max(operation['max'], elapsed)
+
+  def clear(self):
+    with self._lock:
+      self._operations.clear()
+
+  @property
+  def stats(self):
+    '''list of (operation, counters) with the times in milliseconds'''
+    with self._lock:
+      return [(name, {
+        'calls': op['calls'],
+        'errors': op['errors'],
+        'avg_ms': op['total'] * 1000 / op['calls'],
+        'max_ms': op['max'] * 1000
+      }) for name, op in sorted(self._operations.items())]
+
+
+#timings of the S3 operations of this process
+s3_stats = OperationStats()
+
+#errors of the S3 requests: rejected by S3, invalid on the client side
+#(e.g. no credentials) or network ones
+S3_ERRORS = (BotoServerError, BotoClientError, NoAuthHandlerFound,
+            socket.error)
+
+#S3 bucket handle of each thread, reused by the following operations
+_s3 = local()
+
+
 def get_s3_bucket():
-  '''connect to S3 and return the S3 bucket'''
-  try:
-    # Connect to S3
-    conn = boto.connect_s3(current_app.config["S3_KEY"],
-        current_app.config["S3_SECRET"])
-    return conn.get_bucket(current_app.config["S3_BUCKET"])
-  except:
-    if not current_app.testing:
-      opbeat.captureMessage('Error trying to connect to S3')
-    raise ReferenceError('connection refused')
+  '''return the S3 bucket, connecting on the first call of the thread.
+  The bucket existence is not validated (that costs a HEAD request), a
+  wrong bucket fails on the first operation'''
+  config = current_app.config
+  settings = (config["S3_KEY"], config["S3_SECRET"], config["S3_BUCKET"])
+  if getattr(_s3, 'bucket', None) is None or _s3.settings != settings:
+    try:
+      with s3_stats.timed('connect'):
+        conn = boto.connect_s3(config["S3_KEY"], config["S3_SECRET"])
+        _s3.bucket = conn.get_bucket(config["S3_BUCKET"], validate=False)
+        _s3.settings = settings
+    except S3_ERRORS:
+      if not current_app.testing:
+        opbeat.captureMessage('Error trying to connect to S3')
+      raise ReferenceError('connection refused')
+  return _s3.bucket
+
+
+def reset_s3_bucket():
+  '''drop the bucket handle of the thread, the next call reconnects'''
+  _s3.bucket = None
+
+
+def s3_operation(name, operation):
+  '''call operation(bucket) and time it. If it fails, the connection is
+  dropped and it's tried once more with a new one.
+  Return True if it succeeded'''
+  for _ in range(2):
+    try:
+      with s3_stats.timed(name):
+        operation(get_s3_bucket())
+      return True
+    except S3_ERRORS + (ReferenceError,):
+      reset_s3_bucket()
+  return False
 
 
 def upload_s3(s3_directory, filename, data):
-  '''upload file to s3'''
-  try:
-    b = get_s3_bucket()
+  '''upload file to s3 with public read permissions. data is a string or
+  a file object, which is streamed in chunks'''
+  config = current_app.config
+  if isinstance(data, basestring):
+    data = BytesIO(data)
 
-    # Upload the File
-    sml = b.new_key("/".join([current_app.config[s3_directory], filename]))
-    sml.set_contents_from_string(data)
+  def upload(bucket):
+    key = bucket.new_key("/".join([config[s3_directory], filename]))
+    key.set_contents_from_file(data, policy='public-read', rewind=True)
 
-    # Set the file's permissions
-    sml.set_acl('public-read')
+  if s3_operation('upload', upload):
     return True
-  except:
-    if not current_app.testing:
-      opbeat.captureMessage('Error trying to upload file to %s' %s3_directory)
-    return False
+  if not current_app.testing:
+    opbeat.captureMessage('Error trying to upload file to %s' %s3_directory)
+  return False
 
 
 def delete_s3(s3_directory, filename):
   '''delete a file from s3. Return True if deleted, False if there was a
   problem'''
-  try:
-    b = get_s3_bucket()
-    k = b.get_key("/".join([s3_directory, filename])) #file route key
-    k.delete() #delete the file
+  def delete(bucket):
+    bucket.delete_key("/".join([s3_directory, filename])) #file route key
+
+  if s3_operation('delete', delete):
     return True
-  except:
-    if not current_app.testing:
-      opbeat.captureMessage(
-          'Error trying to delete {} from {}'.format(filename, s3_directory))
-    return False
+  if not current_app.testing:
+    opbeat.captureMessage(
+        'Error trying to delete {} from {}'.format(filename, s3_directory))
+  return False
 
 
-def delete_filename(filename, default_filename, s3_directory):
-  '''call to delete_s3 method to delete filename from s3_directory
-  if it is not the default_filename
-  Output: Return True if it was deleted or was the default_filename
+def delete_filename(filename, default_filename, s3_directory, sizes=()):
+  '''call to delete_s3 method to delete filename and its renditions from
+  s3_directory if it is not the default_filename
+  Output: Return True if they were deleted or was the default_filename
   '''
   if filename != default_filename:
-    return delete_s3(s3_directory, filename)
+    names = [filename] + [name for name in rendition_filenames(filename, sizes)
+                          if name != filename]
+    return all([delete_s3(s3_directory, name) for name in names])
   else:
     return True
 
@@ -78,7 +214,8 @@ def delete_avatar(filename):
   False otherwise
   '''
   return delete_filename(filename, current_app.config["DEFAULT_AVATAR"],
-                        current_app.config["S3_UPLOAD_AVATAR_DIR"])
+                        current_app.config["S3_UPLOAD_AVATAR_DIR"],
+                        current_app.config["AVATAR_RENDITIONS"])
 
 
 def delete_item_image(filename):
@@ -87,46 +224,6 @@ def delete_item_image(filename):
   False otherwise
   '''
   return delete_filename(filename, current_app.config["DEFAULT_ITEM"],
-                        current_app.config["S3_UPLOAD_ITEM_DIR"])
-
-
-def save_avatar(avatar):
-  '''store user's profile picture and return the file name
-     Input: avatar: (str) avatar url
-     Output: filename or DEFAULT_AVATAR if something fails
-  '''
-  image = make_image_request(avatar)
-
-  if image:
-    #generate a unique random filename
-    filename = uuid4().hex + '.jpg'
-
-    if upload_s3("S3_UPLOAD_AVATAR_DIR", filename, image):
-      return filename
-    else:
-      return current_app.config["DEFAULT_AVATAR"]
-
-  else:
-    return current_app.config["DEFAULT_AVATAR"]
-
-
-def save_item_image(source_file):
-  '''store item image and return the file name
-     Input: source_file: (FileField)  File Storage object
-     Output: (str) filename, (str) DEFAULT_ITEM if not provided,
-              None if something fails
-  '''
-  if source_file:
-    source_filename = secure_filename(source_file.data.filename)
-    source_extension = source_filename.split('.', 1)[-1]
-
-    dest_filename = uuid4().hex + '.' + source_extension
-
-    if upload_s3("S3_UPLOAD_ITEM_DIR", dest_filename, source_file.data.read()):
-      return dest_filename
-    else:
-      return None
-
-  else:
-    return current_app.config["DEFAULT_ITEM"]
+                        current_app.config["S3_UPLOAD_ITEM_DIR"],
+                        current_app.config["IMAGE_RENDITIONS"])
 
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import os
+from io import BytesIO
+from PIL import Image
+
+#renditions stored for an image (see Item.image_renditions)
+RENDITIONS_NONE = 0 #only the uploaded file
+RENDITIONS_SIZES = 1 #one file per size
+RENDITIONS_WEBP = 2 #one file per size plus its WebP variant
+
+#Pillow format of the allowed extensions
+FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG', 'gif': 'GIF'}
+
+
+def rendition_filename(filename, name, webp=False):
+  '''storage filename of the name rendition of filename. The full size
+  keeps the uploaded filename, the others add the name (abc.jpg ->
+  abc_thumb.jpg). The WebP variants use the .webp extension'''
+  base, extension = os.path.splitext(filename)
+  if name != 'full':
+    base = base + '_' + name
+  return base + ('.webp' if webp else extension)
+
+
+def rendition_filenames(filename, sizes):
+  '''every filename the renditions of filename can be stored with'''
+  return [rendition_filename(filename, name, webp) for name, _ in sizes
+          for webp in (False, True)]
+
+
+def srcset(url, filename, sizes, renditions, webp=False):
+  '''srcset attribute value with the url of each size rendition or '' if
+  the image doesn't have them (in WebP if asked)
+  Input: url: function returning the public url of a filename
+         sizes: tuple of (name, width) renditions
+         renditions: RENDITIONS_* stored for the image
+  '''
+  if renditions < (RENDITIONS_WEBP if webp else RENDITIONS_SIZES):
+    return ''
+  return ', '.join('{0} {1}w'.format(url(rendition_filename(filename, name,
+                    webp)), width) for name, width in sizes)
+
+
+def resize(image, width):
+  '''copy of image scaled down to width keeping its aspect ratio'''
+  if image.mode not in ('RGB', 'RGBA'):
+    image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+  if image.size[0] <= width:
+    return image.copy()
+  height = max(1, image.size[1] * width // image.size[0])
+  return image.resize((width, height), Image.ANTIALIAS)
+
+
+def encode(image, image_format):
+  '''image encoded in image_format as an in memory file'''
+  output = BytesIO()
+  if image_format == 'JPEG':
+    image.convert('RGB').save(output, 'JPEG', quality=85, optimize=True,
+                              progressive=True)
+  elif image_format == 'WEBP':
+    image.save(output, 'WEBP', quality=80)
+  else:
+    image.save(output, image_format)
+  output.seek(0)
+  return output
+
+
+def webp_supported():
+  '''whether Pillow was built with WebP support'''
+  Image.init()
+  return 'WEBP' in Image.SAVE
+
+
+def encode_renditions(filename, image, sizes, webp):
+  '''(filename, file object) of each rendition, encoded one at a time'''
+  extension = os.path.splitext(filename)[1][1:].lower()
+  image_format = FORMATS.get(extension, image.format)
+  for name, width in sizes:
+    scaled = resize(image, width)
+    yield rendition_filename(filename, name), encode(scaled, image_format)
+    if webp:
+      yield rendition_filename(filename, name, True), encode(scaled, 'WEBP')
+
+
+def make_renditions(filename, source, sizes, webp=True, max_pixels=None):
+  '''decode the image in the source file object to scale it down to each
+  of the sizes, in the format of its extension and in WebP if Pillow
+  supports it. JPEGs are decoded at the smallest scale still bigger than
+  the largest size, so big photos don't take their full size in memory.
+  Output: iterator of (filename, file object) to store, each rendition
+          encoded when it's reached so only one is kept in memory, and the
+          RENDITIONS_* made. None if source can't be decoded or has more
+          than max_pixels (decompression bombs)
+  '''
+  try:
+    source.seek(0)
+    image = Image.open(source)
+    if max_pixels and image.size[0] * image.size[1] > max_pixels:
+      return None
+    width = max(size for _, size in sizes)
+    if image.size[0] > width:
+      image.draft(image.mode, (width, image.size[1] * width // image.size[0]))
+    image.load()
+  except Exception: # pylint: disable=W0703
+    #Pillow raises IOError, SyntaxError, struct.error, MemoryError...
+    return None
+
+  webp = webp and webp_supported()
+  return (encode_renditions(filename, image, sizes, webp),
+          RENDITIONS_WEBP if webp else RENDITIONS_SIZES)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import atexit
+import time
+from threading import Lock
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+
+class LastSeenBuffer(object):
+  '''write-behind buffer of the users last_seen timestamps. Pings are kept
+  in-process and written with a single bulk UPDATE when flush_size users
+  are pending or flush_interval seconds have passed since the last write
+  (checked on each ping), and when the process exits.
+  None disables a threshold, then only explicit flushes write'''
+
+  def __init__(self, flush_size=100, flush_interval=60):
+    self.flush_size = flush_size
+    self.flush_interval = flush_interval
+    self.app = None
+    self._pending = {}
+    self._last_flush = time.time()
+    self._lock = Lock()
+
+  def init_app(self, app):
+    '''set up the thresholds from the app config. The pending timestamps
+    are flushed on worker shutdown'''
+    if self.app is None:
+      atexit.register(self.flush)
+    self.app = app
+    self.flush_size = app.config['LAST_SEEN_FLUSH_SIZE']
+    self.flush_interval = app.config['LAST_SEEN_FLUSH_INTERVAL']
+
+  def add(self, user_id, last_seen):
+    with self._lock:
+      if self._pending.get(user_id, last_seen) <= last_seen:
+        self._pending[user_id] = last_seen
+      due = (self.flush_size is not None and
+              len(self._pending) >= self.flush_size) or \
+            (self.flush_interval is not None and
+              time.time() - self._last_flush >= self.flush_interval)
+    if due:
+      self.flush()
+
+  def flush(self):
+    '''write the pending timestamps with an UPDATE ... FROM (VALUES ...).
+    A timestamp never overwrites a newer one. With no app yet they are kept
+    until there is one. Return the number of users updated'''
+    from . import db
+    with self._lock:
+      if not self._pending or self.app is None:
+        return 0
+      pending, self._pending = self._pending, {}
+      self._last_flush = time.time()
+
+    values = []
+    params = {}
+    for i, (user_id, last_seen) in enumerate(pending.items()):
+      values.append('(:id{0}, CAST(:seen{0} AS timestamp))'.format(i))
+      params['id{0}'.format(i)] = user_id
+      params['seen{0}'.format(i)] = last_seen
+    update = text('UPDATE users SET last_seen = v.last_seen '
+                  'FROM (VALUES {0}) AS v (id, last_seen) '
+                  'WHERE users.id = v.id AND (users.last_seen IS NULL OR '
+                  'users.last_seen < v.last_seen)'.format(', '.join(values)))
+    try:
+      with db.get_engine(self.app).begin() as connection:
+        return connection.execute(update, **params).rowcount
+    except SQLAlchemyError:
+      #keep them for the next flush, newer pings win
+      with self._lock:
+        for user_id, last_seen in pending.items():
+          if self._pending.get(user_id, last_seen) <= last_seen:
+            self._pending[user_id] = last_seen
+      self.app.logger.exception('last_seen flush failed')
+      return 0
+
+  def clear(self):
+    '''discard the pending timestamps'''
+    with self._lock:
+      self._pending.clear()
+
+  def __len__(self):
+    return len(self._pending)
@@ -4,7 +4,8 @@ from wtforms import StringField, SelectField, SubmitField, \
 TextAreaField, DecimalField, ValidationError
 from flask_wtf.file import FileField, FileAllowed, FileRequired
 from wtforms.validators import Required, Length, NumberRange, Regexp
-from ..models import Category, User, Country, State
+from ..models import User, Country, State
+from ..categories import category_registry
 # pylint: disable=E1002
 
 class UserForm(Form):
@@ -31,7 +32,7 @@ class UserForm(Form):
   def __init__(self, user, *args, **kwargs):
     super(UserForm, self).__init__(*args, **kwargs)
     self.country.choices = Country.get_country_choices()
-    self.state.choices = [('NU', 'Not US')] + State.get_us_state_choices()
+    self.state.choices = State.get_state_field_choices()
     self.user = user
 
   def validate_username(self, field):
@@ -61,7 +62,7 @@ class ItemForm(Form):
 
   def __init__(self, *args, **kwargs):
     super(ItemForm, self).__init__(*args, **kwargs)
-    self.category.choices = Category.get_category_choices()
+    self.category.choices = category_registry.choices()
 
   def validate_image(self, field):
     '''make sure that if image field contains info it is a file'''
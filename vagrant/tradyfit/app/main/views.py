@@ -4,12 +4,21 @@ from flask import current_app, render_template, flash, redirect, url_for, \
 request, abort, session
 from flask.ext.login import current_user, login_required
 from . import main
-from .. import db
+from .. import db, image_uploader
 from .forms import UserForm, DeleteUserForm, ItemForm, DeleteItemForm, \
 SearchForm
-from ..models import Item, Category
-from ..helpers import save_item_image, delete_item_image
+from ..models import Item
+from ..categories import category_registry
 from ..geolocation import Geolocation
+from ..search import search_page, search_facets
+
+
+def get_radius():
+  '''radius_km request argument if it's one of the RADIUS_CHOICES'''
+  radius_km = request.args.get('radius_km', type=int)
+  if radius_km in current_app.config['RADIUS_CHOICES']:
+    return radius_km
+  return None
 
 
 @main.route('/shutdown')
@@ -31,13 +40,13 @@ def index():
   if search_form.validate_on_submit():
     session['query'] = search_form.search.data #store query on session cookie
     return redirect(url_for('main.search_results'))
-  items = Item.query.order_by(Item.timestamp.desc()).limit(4).all()
+  items = Item.query.listing().order_by(Item.timestamp.desc()).limit(4).all()
   #get categories for bottom images links
-  swim = Category.get_category('swimming')
-  tri = Category.get_category('triathlon')
-  soccer = Category.get_category('soccer')
-  basket = Category.get_category('basketball')
-  baseball = Category.get_category('baseball')
+  swim = category_registry.get_by_name('swimming')
+  tri = category_registry.get_by_name('triathlon')
+  soccer = category_registry.get_by_name('soccer')
+  basket = category_registry.get_by_name('basketball')
+  baseball = category_registry.get_by_name('baseball')
   return render_template('main/index.html', form=search_form, items=items,
     swim=swim.id, tri=tri.id, soccer=soccer.id, basket=basket.id,
     baseball=baseball.id)
@@ -48,13 +57,13 @@ def categories():
   '''Show all categories and 12 items. If user is logged in and has
   location, the items are the 12 nearest, if not, show last 12 created
   items'''
-  categories = Category.query.all()
+  categories = category_registry.all()
   if current_user.is_authenticated() and current_user.has_coordinates():
     user_loc = current_user.get_point_coordinates()
-    items = Item.query.order_by(
-                        Item.location.distance_box(user_loc)).limit(12).all()
+    items = Item.query.listing().nearest(user_loc).limit(12).all()
   else:
-    items = Item.query.order_by(Item.timestamp.desc()).limit(12).all()
+    items = Item.query.listing().order_by(
+                                  Item.timestamp.desc()).limit(12).all()
   return render_template('main/categories.html', items=items,
                           categories=categories)
 
@@ -62,24 +71,31 @@ def categories():
 @main.route('/items/category/<int:id>')
 def category(id): # pylint: disable=W0622
   city = None
-  category = Category.query.get_or_404(id)
-  categories = Category.query.all()
+  user_loc = None
+  radius_km = None
+  category = category_registry.get(id)
+  if category is None:
+    abort(404)
+  categories = category_registry.all()
   if current_user.is_authenticated() and current_user.has_coordinates():
     user_loc = current_user.get_point_coordinates()
-    items = Item.query.filter_by(category=category).order_by(
-                        Item.location.distance_box(user_loc)).limit(20).all()
     city = current_user.city
-  else:
-    items = Item.query.filter_by(category=category).order_by(
-                                        Item.timestamp.desc()).limit(20).all()
-  return render_template('main/category.html', items=items,
-                          categories=categories, category=category, city=city)
+    radius_km = get_radius()
+  pagination = Item.query.listing().filter_by(
+                    category_id=category.id).keyset_paginate(
+                    request.args.get('cursor'),
+                    current_app.config['ITEMS_PER_PAGE'], user_loc,
+                    radius_km=radius_km)
+  return render_template('main/category.html', items=pagination.items,
+                          pagination=pagination, categories=categories,
+                          category=category, city=city, radius_km=radius_km)
 
 
 @main.route('/profile', methods=['GET', 'POST'])
 @login_required
 def profile():
-  items = current_user.items.order_by(Item.timestamp.desc()).all()
+  items = Item.query.listing().filter_by(user_id=current_user.id).order_by(
+                                              Item.timestamp.desc()).all()
   form = UserForm(user=current_user)
 
   if form.validate_on_submit():
@@ -133,21 +149,25 @@ def create():
 
   if form.validate_on_submit():
     #if the filename attribute is empty, assign the default image
-    if not (hasattr(form.image.data, 'filename') and form.image.data.filename):
+    new_image = hasattr(form.image.data, 'filename') and \
+                form.image.data.filename
+    if not new_image:
       image = current_app.config["DEFAULT_ITEM"]
     else:
-      image = save_item_image(form.image)
+      image = image_uploader.spool(form.image) #uploaded after the commit
 
     if image:
-      category = Category.query.get(form.category.data)
       location = current_user.get_point_coordinates()
       item = Item(name=form.name.data, description=form.description.data,
-                  price=form.price.data, category=category, image_url=image,
+                  price=form.price.data, category_id=form.category.data,
+                  image_url=image, image_pending=bool(new_image),
                   user_id=current_user.id, location=location,
                   country=current_user.country, state=current_user.state,
                   city=current_user.city)
       db.session.add(item)
       db.session.commit()
+      if new_image:
+        image_uploader.enqueue(item.id, image)
       flash('Your item has been created.')
       return redirect(url_for('main.index'))
     else:
@@ -172,15 +192,19 @@ def edit(id): # pylint: disable=W0622
   form = ItemForm()
   if form.validate_on_submit():
     # included new image in form and is a file
-    if hasattr(form.image.data, 'filename') and form.image.data.filename:
-      image = save_item_image(form.image)  # save new image
-      if image is None:  # problem uploading new image
-        flash('Sorry, there was an error updating your item. Try again later.')
-        return redirect(url_for('main.item', id=item.id))
-      elif not delete_item_image(item.image_url):  # delete previous image
-        delete_item_image(image)  # delete the new image
+    new_image = hasattr(form.image.data, 'filename') and \
+                form.image.data.filename
+    if new_image:
+      image = image_uploader.spool(form.image)  # uploaded after the commit
+      if image is None:  # problem storing new image
         flash('Sorry, there was an error updating your item. Try again later.')
         return redirect(url_for('main.item', id=item.id))
+      # the previous image is deleted once the new one is uploaded. If an
+      # upload is still pending its previous image is kept instead
+      if not item.image_pending:
+        item.image_previous = item.image_url
+        item.image_previous_renditions = item.image_renditions
+      item.image_pending = True
     else:  # image not modified
       image = item.image_url
 
@@ -188,17 +212,19 @@ def edit(id): # pylint: disable=W0622
     item.description = form.description.data
     item.price = form.price.data
     item.image_url = image
-    item.category = Category.query.get(form.category.data)
+    item.category_id = form.category.data
     item.modified = datetime.utcnow()
     db.session.add(item)
     db.session.commit()
+    if new_image:
+      image_uploader.enqueue(item.id, image)
     flash('Your item has been updated.')
     return redirect(url_for('main.item', id=item.id))
 
   form.name.data = item.name
   form.description.data = item.description
   form.price.data = item.price
-  form.category.data = item.category.id
+  form.category.data = item.category_id
   return render_template('main/edit_item.html', form=form, id=item.id,
                           image=item.image())
 
@@ -224,19 +250,23 @@ def delete(id):  # pylint: disable=W0622
 
 @main.route('/search_results')
 def search_results():
-  query = session.get('query')
-  session.pop('query', None) #remove query from session cookie
+  #the query comes from the search form (session) or from a next page link
+  query = session.pop('query', None) or request.args.get('q')
   if query:
     city = None
+    user = None
+    radius_km = None
     if current_user.is_authenticated() and current_user.has_coordinates():
       city = current_user.city
-      user_loc = current_user.get_point_coordinates()
-      res = Item.query.search(query).order_by(
-                    Item.location.distance_box(user_loc)).limit(20).all()
-    else:
-      res = Item.query.search(query).order_by(
-                    Item.timestamp.desc()).limit(20).all()
-    return render_template('main/search_results.html', query=query, items=res,
-                          city=city)
+      user = current_user
+      radius_km = get_radius()
+    ranked = request.args.get('order') == 'relevance'
+    pagination = search_page(query, request.args.get('cursor'),
+                            current_app.config['ITEMS_PER_PAGE'], user,
+                            ranked, radius_km)
+    return render_template('main/search_results.html', query=query,
+                          items=pagination.items, pagination=pagination,
+                          facets=search_facets(query, user, radius_km),
+                          city=city,
+                          ranked=ranked, radius_km=radius_km)
   return redirect(url_for('main.index'))
-
@@ -1,10 +1,18 @@
 # -*- coding: utf-8 -*-
 import os
-from . import db, login_manager, gc
-from flask import current_app
+from . import db, login_manager, gc, search_cache, tile_cache, \
+last_seen_buffer, user_cache, fragment_cache
+from flask import current_app, abort
 from flask.ext.login import UserMixin
 from flask.ext.sqlalchemy import BaseQuery, event
-from sqlalchemy_searchable import SearchQueryMixin
+from sqlalchemy import func, tuple_, cast, extract, or_, and_, DDL, case, \
+select, union_all, literal_column, String
+from sqlalchemy.orm import aliased, mapper, joinedload, subqueryload, defer, \
+make_transient_to_detached, object_session, Session
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import get_history, set_committed_value
+from sqlalchemy_searchable import SearchQueryMixin, parse_search_query
 from sqlalchemy_utils.types import TSVectorType
 from sqlalchemy_searchable import make_searchable
 from geoalchemy2.types import Geometry
@@ -12,15 +20,97 @@ from geoalchemy2.elements import WKTElement
 from datetime import datetime
 from app.geolocation import Geolocation
 from app.helpers import delete_avatar, delete_item_image
+from app.images import rendition_filename, srcset, RENDITIONS_NONE
+from app.pagination import KeysetPagination, encode_cursor, decode_cursor
 
 make_searchable()
 
 
+def get_image_prefix(folder):
+  '''public url of the S3 folder, images urls start with it'''
+  config = current_app.config
+  return config['S3_LOCATION'] + "/" + config['S3_BUCKET'] + \
+    config[folder] + "/"
+
+
 def get_image(folder, url):
   '''get public url for S3 images'''
-  return current_app.config['S3_LOCATION'] + "/" + \
-    current_app.config['S3_BUCKET'] + \
-    current_app.config[folder] + "/" + url
+  return get_image_prefix(folder) + url
+
+
+def get_rendition(folder, filename, renditions, size, webp=False):
+  '''public url of the size rendition of an image. Images stored before
+  the renditions existed only have the full size'''
+  if renditions == RENDITIONS_NONE:
+    return get_image(folder, filename)
+  return get_image(folder, rendition_filename(filename, size, webp))
+
+
+def get_srcset(folder, filename, renditions, sizes, webp=False):
+  '''srcset attribute value with the renditions of an image, '' if it
+  doesn't have them'''
+  prefix = get_image_prefix(folder)
+  return srcset(lambda name: prefix + name, filename,
+                current_app.config[sizes], renditions, webp)
+
+
+def estimate_count(model):
+  '''approximate number of rows of the model table from the planner
+  statistics (pg_class.reltuples, updated by VACUUM and ANALYZE) instead
+  of scanning the whole table with COUNT(*). Below EXACT_COUNT_THRESHOLD
+  (e.g. a table never analyzed, estimated as 0 or -1) the rows are
+  counted, which is cheap at that size'''
+  estimate = db.session.execute(
+    'SELECT reltuples FROM pg_class WHERE oid = CAST(:table AS regclass)',
+    {'table': model.__tablename__}).scalar()
+  estimate = int(estimate or 0)
+  if estimate < current_app.config['EXACT_COUNT_THRESHOLD']:
+    return db.session.query(func.count(model.id)).scalar()
+  return estimate
+
+
+def read_cursor(cursor, mode, error_out=True):
+  '''return (cursor, key, last_id) with the sort key and id of the last row
+  of the previous page stored in cursor, all None for the first page.
+  If cursor is not valid and error_out is True a 404 error is raised,
+  otherwise it's read as the first page'''
+  if cursor:
+    try:
+      key, last_id = decode_cursor(cursor, mode)
+      return cursor, key, last_id
+    except ValueError:
+      if error_out:
+        abort(404)
+  return None, None, None
+
+
+def fetch_page(query, sort_key, mode, cursor=None, per_page=20):
+  '''return a KeysetPagination with the first per_page rows of query,
+  already filtered after cursor and ordered by (sort_key, id). The cursor
+  of the next page is made from the last row'''
+  #fetch one extra row to know if there is a next page
+  rows = query.add_columns(sort_key).limit(per_page + 1).all()
+  next_cursor = None
+  if len(rows) > per_page:
+    last, last_key = rows[per_page - 1]
+    next_cursor = encode_cursor(mode, last_key, last.id)
+  return KeysetPagination([row[0] for row in rows[:per_page]], per_page,
+                          cursor, next_cursor)
+
+
+def seek_page(query, sort_key, mode, cursor=None, per_page=20,
+              error_out=True):
+  '''return a KeysetPagination with the per_page rows of query following
+  cursor, ordered by (sort_key, id) descending. The entity of the query
+  must have an id column and sort_key can't be null.
+  If cursor is not valid and error_out is True a 404 error is raised,
+  otherwise the first page is returned'''
+  id_column = query.column_descriptions[0]['entity'].id
+  cursor, key, last_id = read_cursor(cursor, mode, error_out)
+  if cursor:
+    query = query.filter(tuple_(sort_key, id_column) < tuple_(key, last_id))
+  return fetch_page(query.order_by(sort_key.desc(), id_column.desc()),
+                    sort_key, mode, cursor, per_page)
 
 
 class User(UserMixin, db.Model):
@@ -31,6 +121,11 @@ class User(UserMixin, db.Model):
   username = db.Column(db.String(64), unique=True, nullable=False, index=True)
   name = db.Column(db.String(64), unique=False, nullable=False)
   avatar_url = db.Column(db.String(), nullable=False)
+  #RENDITIONS_* stored for the avatar
+  avatar_renditions = db.Column(db.SmallInteger, default=RENDITIONS_NONE,
+                                server_default='0', nullable=False)
+  #url of the facebook picture while it's being imported as avatar
+  avatar_source = db.Column(db.Text)
   gender = db.Column(db.String(30))
   country = db.Column(db.String(2), default='')
   state =  db.Column(db.String(2), default='')
@@ -40,6 +135,9 @@ class User(UserMixin, db.Model):
   member_since = db.Column(db.DateTime(), default=datetime.utcnow)
   last_seen = db.Column(db.DateTime(), default=datetime.utcnow)
   is_admin = db.Column(db.Boolean, default=False)
+  #number of unread messages received, kept by the Message events
+  unread_count = db.Column(db.Integer, default=0, server_default='0',
+                            nullable=False)
   items = db.relationship('Item', backref='user', lazy='dynamic',
                           cascade='all, delete-orphan')
   #message relationships
@@ -54,10 +152,11 @@ class User(UserMixin, db.Model):
 
 
   def ping(self):
-    '''update last_seen field with current time'''
-    self.last_seen = datetime.utcnow()
-    db.session.add(self)
-    db.session.commit()
+    '''update last_seen field with current time. It's written to the db
+    later, in a batch with other users pings (see LastSeenBuffer)'''
+    now = datetime.utcnow()
+    set_committed_value(self, 'last_seen', now)
+    last_seen_buffer.add(self.id, now)
 
 
   def location(self, ip):
@@ -122,16 +221,146 @@ class User(UserMixin, db.Model):
 
   @staticmethod
   def create_username(username):
-    '''verify username is not already in the db, if it exists,
-    add the next uid number to the name'''
-    if User.query.filter_by(username = username).first():
-      uid = User.query.count() + 1
-      return username + str(uid)
-    else:
-      return username
+    '''return a free username: username itself the first time it's asked
+    for, then username followed by the next number of its counter (2, 3...).
+    Each number is given only once, so concurrent signups get different
+    usernames. Numbers taken by other means (e.g. profile changes) are
+    skipped'''
+    while True:
+      n = next_username_number(username)
+      candidate = username if n == 1 else username + str(n)
+      if not User.get_user_by_username(candidate):
+        return candidate
+
+  @staticmethod
+  def signup(fb_id, email, name, gender, avatar_url,
+              avatar_renditions=RENDITIONS_NONE, avatar_source=None,
+              retries=3):
+    '''create a user with a username allocated from the email. If a
+    concurrent signup of the same user was committed first, that user is
+    returned. If the username was taken meanwhile another one is tried'''
+    base = email.split('@')[0][:MAX_USERNAME_BASE]
+    for attempt in range(retries):
+      user = User(fb_id=fb_id, email=email, name=name, gender=gender,
+                  avatar_url=avatar_url, avatar_renditions=avatar_renditions,
+                  avatar_source=avatar_source,
+                  username=User.create_username(base))
+      db.session.add(user)
+      try:
+        db.session.commit()
+        return user
+      except IntegrityError:
+        db.session.rollback()
+        user = User.get_user(email)
+        if user is not None:
+          return user
+        if attempt == retries - 1:
+          raise
+
+  def avatar(self, size='full'):
+    '''public url of the avatar rendition of the given size'''
+    return get_rendition('S3_UPLOAD_AVATAR_DIR', self.avatar_url,
+                        self.avatar_renditions, size)
+
+  def avatar_srcset(self, webp=False):
+    return get_srcset('S3_UPLOAD_AVATAR_DIR', self.avatar_url,
+                      self.avatar_renditions, 'AVATAR_RENDITIONS', webp)
+
+  def snapshot(self):
+    '''detached copy with only the column values of the user, to be cached
+    and merged into a session without querying'''
+    snapshot = User(**dict((attr.key, getattr(self, attr.key))
+                            for attr in User.__mapper__.column_attrs))
+    make_transient_to_detached(snapshot)
+    return snapshot
+
+  def message_counts(self):
+    '''number of unread, sent and received messages of the user. The sent
+    and received ones are counted in a single aggregate query (conditional
+    counts, PostgreSQL 9.3 has no FILTER clause). The unread ones are the
+    unread_count counter, the same number shown in the navbar'''
+    received = Message.receiver_id == self.id
+    sent = Message.sender_id == self.id
+    n_sent, n_received = db.session.query(
+      func.count(case([(sent, 1)])),
+      func.count(case([(received, 1)]))).filter(or_(received, sent)).one()
+    return {'unread': self.unread_count, 'sent': n_sent,
+            'received': n_received}
+
+  @staticmethod
+  def activity_counts(ids):
+    '''number of items, sent and received messages of the users with the
+    given ids in a single query, each count grouped only over those users.
+    Return a dict {user id: (items, sent, received)}'''
+    if not ids:
+      return {}
+    items = db.session.query(Item.user_id.label('user_id'),
+                  func.count(Item.id).label('n')).filter(
+                  Item.user_id.in_(ids)).group_by(Item.user_id).subquery()
+    sent = db.session.query(Message.sender_id.label('user_id'),
+                  func.count(Message.id).label('n')).filter(
+                  Message.sender_id.in_(ids)).group_by(
+                  Message.sender_id).subquery()
+    received = db.session.query(Message.receiver_id.label('user_id'),
+                  func.count(Message.id).label('n')).filter(
+                  Message.receiver_id.in_(ids)).group_by(
+                  Message.receiver_id).subquery()
+    rows = db.session.query(User.id, func.coalesce(items.c.n, 0),
+                  func.coalesce(sent.c.n, 0), func.coalesce(received.c.n, 0)
+                  ).outerjoin(items, items.c.user_id == User.id
+                  ).outerjoin(sent, sent.c.user_id == User.id
+                  ).outerjoin(received, received.c.user_id == User.id
+                  ).filter(User.id.in_(ids))
+    return dict((row[0], row[1:]) for row in rows)
+
+  @staticmethod
+  def repair_unread_counts():
+    '''recompute the unread messages counter of every user from the
+    messages table. Return the number of users whose counter was wrong'''
+    users = User.__table__
+    messages = Message.__table__
+    unread = select([func.count(messages.c.id)]).where(and_(
+                    messages.c.receiver_id == users.c.id,
+                    messages.c.unread == True)).as_scalar() # pylint: disable=C0121
+    result = db.session.execute(users.update().where(
+                    users.c.unread_count != unread).values(unread_count=unread))
+    db.session.commit()
+    if result.rowcount:
+      user_cache.clear()
+    return result.rowcount
+
+
+#index for seeking the pages of the admin users list
+db.Index('ix_users_last_seen_id', User.last_seen, User.id)
 
-  def avatar(self):
-    return get_image('S3_UPLOAD_AVATAR_DIR', self.avatar_url)
+
+#the username number suffix must fit in the username column
+MAX_USERNAME_BASE = 56
+
+
+class UsernameCounter(db.Model):
+  '''last number given to each base username (see User.create_username)'''
+  __tablename__ = 'username_counters'
+  base = db.Column(db.String(64), primary_key=True)
+  last = db.Column(db.Integer, nullable=False, default=0)
+
+
+def next_username_number(base):
+  '''increase and return the counter of base (1 the first time) in its own
+  short transaction, so the row is not locked during the signup'''
+  counters = UsernameCounter.__table__
+  increase = counters.update().where(counters.c.base == base).values(
+                  last=counters.c.last + 1).returning(counters.c.last)
+  while True:
+    with db.engine.begin() as connection:
+      n = connection.execute(increase).scalar()
+    if n is not None:
+      return n
+    try:
+      with db.engine.begin() as connection:
+        connection.execute(counters.insert().values(base=base, last=0))
+    except IntegrityError:
+      pass #created by a concurrent signup
 
 
 @event.listens_for(User, 'before_delete')
@@ -141,9 +370,40 @@ def remove_avatar_before_delete(mapper, connection, target): # pylint: disable=W
     raise ValueError('Avatar not deleted')
 
 
+def invalidate_cached_user(target, user_id):
+  '''drop the cached snapshot of the user once the transaction of target
+  commits'''
+  after_commit(target, lambda: user_cache.delete(user_id))
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_user_snapshot(mapper, connection, target): # pylint: disable=W0613
+  '''profile, admin flag or account changes'''
+  invalidate_cached_user(target, target.id)
+
+
 @login_manager.user_loader
 def load_user(user_id):
-  return User.query.get(int(user_id))
+  '''with USER_CACHE_ENABLED, the logged in user is loaded from a per
+  process cache of user snapshots, merged into the session without
+  querying the users table. The changes of this process drop the snapshot
+  of the user once committed. The other processes serve theirs until it
+  expires (USER_CACHE_TIMEOUT)'''
+  user_id = int(user_id)
+  if not current_app.config['USER_CACHE_ENABLED']:
+    return User.query.get(user_id)
+  user = db.session.identity_map.get(identity_key(User, user_id))
+  if user is not None:
+    return user
+  snapshot = user_cache.get(user_id)
+  if snapshot is None:
+    user = User.query.get(user_id)
+    if user is None:
+      return None
+    snapshot = user.snapshot()
+    user_cache.set(user_id, snapshot)
+  return db.session.merge(snapshot, load=False)
 
 
 class Category(db.Model):
@@ -177,8 +437,326 @@ class Category(db.Model):
     return Category.query.filter_by(name=name).one()
 
 
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def bump_categories_version(mapper, connection, target): # pylint: disable=W0613
+  '''let the category registries of every process know they must reload'''
+  bump_version(connection, 'categories')
+
+
+#version stamps, their rows are created with the table (and by the
+#migrations), so a bump is a single update
+VERSION_NAMES = ('categories',)
+
+
+class Version(db.Model):
+  '''version stamps of rarely changing tables, increased on each change so
+  the in-process copies of their rows know when to reload'''
+  __tablename__ = 'versions'
+  name = db.Column(db.String(32), primary_key=True)
+  value = db.Column(db.Integer, nullable=False, default=0)
+
+  @staticmethod
+  def get(name):
+    row = db.session.query(Version.value).filter_by(name=name).first()
+    return row.value if row else 0
+
+
+@event.listens_for(Version.__table__, 'after_create')
+def insert_versions(target, connection, **kw): # pylint: disable=W0613
+  connection.execute(target.insert(), [{'name': name, 'value': 1}
+                                        for name in VERSION_NAMES])
+
+
+def bump_version(connection, name):
+  '''increase the version stamp in the same transaction than the change'''
+  versions = Version.__table__
+  connection.execute(versions.update().where(
+              versions.c.name == name).values(value=versions.c.value + 1))
+
+
+def after_commit(target, callback):
+  '''run callback once the transaction of the session target is flushed in
+  commits. In-process caches are invalidated then: cleared at flush time,
+  a concurrent request could cache again the rows being replaced before
+  the change is visible, and keep them until the entry expires'''
+  session = object_session(target)
+  if session is None:
+    callback()
+  else:
+    session.info.setdefault('after_commit', []).append(callback)
+
+
+@event.listens_for(Session, 'after_commit')
+def run_after_commit(session):
+  for callback in session.info.pop('after_commit', []):
+    callback()
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_after_commit(session):
+  '''nothing changed'''
+  session.info.pop('after_commit', None)
+
+
+def geography(geometry):
+  '''cast a geometry to geography, to work with distances in meters.
+  The items table has a GiST index on geography(location)'''
+  return func.geography(geometry)
+
+
+def price_bucket_label(bucket, limits):
+  '''name of the price range of the bucket e.g. "25-50" or "500+"'''
+  if bucket == len(limits):
+    return '{0}+'.format(limits[-1])
+  return '{0}-{1}'.format(limits[bucket - 1] if bucket else 0, limits[bucket])
+
+
+#text search configuration used by the search_vector trigger
+SEARCH_REGCONFIG = 'pg_catalog.english'
+
+
 class ItemQuery(BaseQuery, SearchQueryMixin):
-  pass
+
+  def listing(self, strategy=None):
+    '''load the items with the category and user shown in the item boxes
+    of the list pages, so a page costs a bounded number of queries instead
+    of two lazy loads per item. The columns not shown are deferred.
+    strategy is "joined" (same query) or "subquery" (one extra query per
+    relationship), LISTING_LOAD_STRATEGY by default'''
+    strategy = strategy or current_app.config['LISTING_LOAD_STRATEGY']
+    load = subqueryload if strategy == 'subquery' else joinedload
+    return self.options(load(Item.category), load(Item.user),
+                        defer(Item.search_vector), defer(Item.location))
+
+  def nearest(self, user_loc):
+    '''order by distance to user_loc with the KNN operator (<->), so with
+    a limit the GiST index on location returns the nearest items without
+    sorting the whole table'''
+    return self.order_by(Item.location.distance_centroid(user_loc))
+
+  def within(self, user_loc, radius_km):
+    '''filter the items located at less than radius_km from user_loc
+    (ST_DWithin over the geography index)'''
+    return self.filter(func.ST_DWithin(geography(Item.location),
+                                      geography(user_loc), radius_km * 1000))
+
+  def keyset_paginate(self, cursor=None, per_page=20, user_loc=None,
+                      error_out=True, radius_km=None):
+    '''return a KeysetPagination with the per_page items following cursor.
+    Items are ordered by distance to user_loc if provided (only the ones at
+    less than radius_km if given), if not, by newest first. The (sort key,
+    id) of the last row is used to seek the next page, so every page costs
+    the same as the first one.
+    If cursor is not valid and error_out is True a 404 error is raised,
+    otherwise the first page is returned'''
+    if user_loc is None:
+      return seek_page(self, Item.timestamp, 'timestamp', cursor, per_page,
+                      error_out)
+    cursor, key, last_id = read_cursor(cursor, 'distance', error_out)
+    #plain <-> so the GiST index on location serves the order (KNN scan).
+    #Items without location have a NULL distance, sorted last
+    sort_key = Item.location.distance_centroid(user_loc)
+    no_location = Item.location.is_(None)
+    query = self
+    if radius_km:
+      query = query.within(user_loc, radius_km)
+    if cursor and key is None:
+      #the last row had no location, only those are left
+      query = query.filter(no_location, Item.id > last_id)
+    elif cursor:
+      #recompute the last row distance in the db to avoid float rounding
+      #issues, the value stored in the cursor is used if it was deleted
+      last = aliased(Item)
+      last_key = db.session.query(last.location.distance_centroid(
+                        user_loc)).filter(last.id == last_id).as_scalar()
+      query = query.filter(or_(tuple_(sort_key, Item.id) >
+                          tuple_(func.coalesce(last_key, key), last_id),
+                          no_location))
+    return fetch_page(query.order_by(sort_key, Item.id), sort_key,
+                      'distance', cursor, per_page)
+
+  def rank_search(self, search_query, user_loc=None, limit=20,
+                  radius_km=None):
+    '''return the limit best items for search_query in a single query.
+    The score blends the text relevance (ts_rank_cd, with the item name
+    weighted above the description), the recency and, if user_loc is
+    provided, the proximity to the user (only items at less than radius_km
+    if given). Only a bounded candidate set (the SEARCH_RANK_CANDIDATES
+    newest or nearest matches) is scored, so the cost does not grow with
+    the number of matches'''
+    if not parse_search_query(search_query):
+      return []
+    config = current_app.config
+    weights = config['SEARCH_RANK_WEIGHTS']
+
+    candidates = self.search(search_query)
+    if user_loc is not None:
+      candidates_order = Item.location.distance_centroid(user_loc)
+      if radius_km:
+        candidates = candidates.within(user_loc, radius_km)
+    else:
+      candidates_order = Item.timestamp.desc()
+    candidates = candidates.with_entities(Item.id).order_by(
+            candidates_order).limit(config['SEARCH_RANK_CANDIDATES']).subquery()
+
+    #items are matched by prefix but ranked on the exact query words.
+    #ts_rank_cd normalization 32 scales the rank to the range [0, 1)
+    tsquery = func.plainto_tsquery(SEARCH_REGCONFIG, search_query)
+    relevance = func.ts_rank_cd(Item.search_vector, tsquery, 32)
+    age_days = extract('epoch', func.timezone('utc', func.now()) -
+                        Item.timestamp) / 86400.0
+    recency = 1.0 / (1.0 + age_days / config['SEARCH_RANK_RECENCY_DAYS'])
+    score = weights['relevance'] * relevance + weights['recency'] * recency
+    if user_loc is not None:
+      distance_km = func.ST_Distance(geography(Item.location),
+                                      geography(user_loc)) / 1000.0
+      proximity = 1.0 / (1.0 + distance_km /
+                          config['SEARCH_RANK_PROXIMITY_KM'])
+      score = score + weights['proximity'] * func.coalesce(proximity, 0)
+
+    return Item.query.listing().join(candidates,
+                          Item.id == candidates.c.id).order_by(
+                          score.desc(), Item.id.desc()).limit(limit).all()
+
+  def serialized(self, extra=None):
+    '''serialize the items of the query in the Item.serialize format
+    selecting only the needed columns, joined with the category name, so no
+    entities are built or lazy loaded. The images url prefix is computed
+    once. extra is a dict key: column of other values to add to each item.
+    Return a generator of dicts'''
+    prefix = get_image_prefix('S3_UPLOAD_ITEM_DIR')
+    default_image = current_app.config['DEFAULT_ITEM']
+    extra = extra or {}
+    columns = [Item.id, Item.name, Item.description, Item.price,
+              Item.image_url, Item.image_pending, Category.name, Item.city,
+              Item.state, Item.country, Item.timestamp]
+    rows = self.join(Category, Item.category_id == Category.id).with_entities(
+                *(columns + extra.values()))
+    for row in rows:
+      (id, name, description, price, image_url, pending, category, city, # pylint: disable=W0622
+        state, country, timestamp) = row[:len(columns)]
+      if pending:
+        image_url = default_image
+      item = {
+        'id': id,
+        'name': name,
+        'description': description,
+        'price': str(price),
+        'image_url': prefix + image_url,
+        'category': category,
+        'city': city,
+        'state': state if country == 'US' else '',
+        'country': country,
+        'timestamp': timestamp
+      }
+      item.update(zip(extra.keys(), row[len(columns):]))
+      yield item
+
+  def batch_search(self, queries, limit=20, serialized=False):
+    '''run several searches in a single database round trip: the newest
+    limit matches of each query are selected with a UNION ALL of limited
+    subqueries and loaded with their category, or with serialized, as the
+    dicts of ItemQuery.serialized.
+    Return a dict query: [items]'''
+    matches = []
+    for position, query in enumerate(queries):
+      sub = self.search(query).with_entities(
+                  literal_column(str(position)).label('position'),
+                  Item.id.label('id')).order_by(Item.timestamp.desc(),
+                  Item.id.desc()).limit(limit).subquery()
+      matches.append(select([sub.c.position, sub.c.id]))
+    matches = union_all(*matches).alias('matches')
+    query = self.join(matches, Item.id == matches.c.id).order_by(
+                matches.c.position, Item.timestamp.desc(), Item.id.desc())
+    if serialized:
+      rows = [(item, item.pop('position')) for item in
+              query.serialized({'position': matches.c.position})]
+    else:
+      rows = query.options(joinedload(Item.category)).add_columns(
+                matches.c.position).all()
+
+    results = dict((query, []) for query in queries)
+    for item, position in rows:
+      results[queries[position]].append(item)
+    return results
+
+  def facets(self, user_loc=None, radius_km=None):
+    '''count the items of the query by category, country, US state and
+    price bucket (PRICE_BUCKETS) with a single grouped query over the
+    matches (only the ones at less than radius_km from user_loc if given).
+    Return a dict facet: [{'value', 'count'}] with the most common values
+    first (price buckets in ascending price order)'''
+    query = self
+    if user_loc is not None and radius_km:
+      query = query.within(user_loc, radius_km)
+    limits = current_app.config['PRICE_BUCKETS']
+    bucket = case([(Item.price == None, None)] + # pylint: disable=C0121
+                  [(Item.price < limit, i) for i, limit in enumerate(limits)],
+                  else_=len(limits))
+    matches = query.with_entities(Item.category_id, Item.country, Item.state,
+                    bucket.label('bucket')).order_by(None).cte('matches')
+    m = matches.c
+    categories = Category.__table__
+
+    def facet(name, key):
+      return select([literal_column("'%s'" % name).label('facet'),
+                     cast(key, String).label('value'),
+                     func.count().label('count')])
+    rows = db.session.execute(union_all(
+      facet('category', categories.c.name).where(
+          categories.c.id == m.category_id).group_by(categories.c.name),
+      facet('country', m.country).group_by(m.country),
+      facet('state', m.state).where(m.country == 'US').group_by(m.state),
+      facet('price', m.bucket).group_by(m.bucket))).fetchall()
+
+    facets = dict((name, []) for name in ('category', 'country', 'state',
+                                          'price'))
+    for name, value, n in rows:
+      if value:
+        facets[name].append({'value': value, 'count': n})
+    for name in ('category', 'country', 'state'):
+      facets[name].sort(key=lambda f: (-f['count'], f['value']))
+    facets['price'] = [{'value': price_bucket_label(int(f['value']), limits),
+                        'count': f['count']} for f in
+                        sorted(facets['price'], key=lambda f: int(f['value']))]
+    return facets
+
+  def clusters(self, bounds, cell_size):
+    '''group the items located inside bounds (west, south, east, north) in
+    a grid of cell_size degrees starting at the south west corner. Bounds
+    are half open (west <= x < east, south <= y < north), so an item on the
+    edge between two tiles is counted in one of them. Return a list of
+    dicts with the count of items and the centroid of each non empty cell'''
+    west, south, east, north = bounds
+    envelope = func.ST_MakeEnvelope(west, south, east, north, 4326)
+    x, y = func.ST_X(Item.location), func.ST_Y(Item.location)
+    centroid = func.ST_Centroid(func.ST_Collect(Item.location))
+    #the bounding box test (&&) uses the GiST index, the comparisons drop
+    #the east and north edges it includes
+    rows = self.filter(Item.location.intersects(envelope), x >= west,
+                      x < east, y >= south, y < north).with_entities(
+                func.count(Item.id), func.ST_Y(centroid), func.ST_X(centroid)
+                ).group_by(func.floor((x - west) / cell_size),
+                          func.floor((y - south) / cell_size)
+                ).order_by(None).all()
+    return [{'count': n, 'latitude': round(lat, 6),
+              'longitude': round(lon, 6)} for n, lat, lon in rows]
+
+  def suggest_names(self, prefix, limit=8):
+    '''return up to limit distinct item names starting with prefix or
+    similar to it, tolerating typos (pg_trgm similarity). Names starting
+    with prefix go first, then the most similar ones'''
+    like = prefix.replace('%', '\\%').replace('_', '\\_') + '%'
+    starts = Item.name.ilike(like)
+    #"%%" is the pg_trgm similarity operator "%" escaped for psycopg2
+    rows = self.with_entities(Item.name).filter(
+                or_(starts, Item.name.op('%%')(prefix))).group_by(
+                Item.name).order_by(starts.desc(),
+                func.similarity(Item.name, prefix).desc(),
+                Item.name).limit(limit).all()
+    return [row.name for row in rows]
 
 
 class Item(db.Model):
@@ -190,20 +768,53 @@ class Item(db.Model):
   description = db.Column(db.Text)
   price = db.Column(db.Numeric(precision=10, scale=2))
   image_url = db.Column(db.String())
+  #the image is still being uploaded (see ImageUploader)
+  image_pending = db.Column(db.Boolean, default=False, server_default='false',
+                            nullable=False)
+  #RENDITIONS_* stored for the image
+  image_renditions = db.Column(db.SmallInteger, default=RENDITIONS_NONE,
+                                server_default='0', nullable=False)
+  #image replaced by the pending one (and its RENDITIONS_*), deleted once
+  #the upload ends or restored if it fails
+  image_previous = db.Column(db.String())
+  image_previous_renditions = db.Column(db.SmallInteger,
+                                        default=RENDITIONS_NONE,
+                                        server_default='0', nullable=False)
   country = db.Column(db.String(2), default='')
   state =  db.Column(db.String(2), default='')
   city =  db.Column(db.String(60), default='')
   location = db.Column(Geometry(geometry_type='POINT', srid=4326),
                         nullable=True)
-  timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+  timestamp = db.Column(db.DateTime, default=datetime.utcnow)
   modified = db.Column(db.DateTime, index=True)
   category_id = db.Column(db.Integer, db.ForeignKey('categories.id'))
   search_vector = db.Column(TSVectorType('name', 'description'))
   user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
   messages = db.relationship('Message', backref='item', lazy='dynamic')
 
-  def image(self):
-    return get_image('S3_UPLOAD_ITEM_DIR', self.image_url)
+  def image(self, size='full'):
+    '''public url of the image rendition of the given size, the default
+    image until it's uploaded'''
+    if self.image_pending:
+      return get_image('S3_UPLOAD_ITEM_DIR',
+                        current_app.config['DEFAULT_ITEM'])
+    return get_rendition('S3_UPLOAD_ITEM_DIR', self.image_url,
+                        self.image_renditions, size)
+
+  def image_srcset(self, webp=False):
+    if self.image_pending:
+      return ''
+    return get_srcset('S3_UPLOAD_ITEM_DIR', self.image_url,
+                      self.image_renditions, 'IMAGE_RENDITIONS', webp)
+
+  @staticmethod
+  def message_counts(ids):
+    '''number of messages of the items with the given ids in a single
+    grouped query. Return a dict {item id: messages}'''
+    if not ids:
+      return {}
+    return dict(db.session.query(Message.item_id, func.count(Message.id)
+                ).filter(Message.item_id.in_(ids)).group_by(Message.item_id))
 
   @property
   def serialize(self):
@@ -230,13 +841,103 @@ class Item(db.Model):
       return ', '.join([self.city, self.country])
 
 
+#spatial index for the radius (ST_DWithin) queries in meters. The GiST
+#index on location used by KNN ordering is created by geoalchemy2
+db.Index('ix_items_location_geography', geography(Item.location),
+          postgresql_using='gist')
+
+#last change of the item, its creation if it was never modified
+ITEM_UPDATED = func.coalesce(Item.modified, Item.timestamp)
+
+#index for seeking the newest first pages (keyset_paginate), read
+#backwards. It also serves the queries ordered by timestamp alone
+db.Index('ix_items_timestamp_id', Item.timestamp, Item.id)
+
+#indexes for seeking the pages of the admin items list and counting the
+#items of each user
+db.Index('ix_items_updated_id', ITEM_UPDATED, Item.id)
+db.Index('ix_items_user_id', Item.user_id)
+
+#trigram index for the typo tolerant name suggestions
+db.Index('ix_items_name_trgm', Item.name, postgresql_using='gin',
+          postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+#search trigger function weighting the item name (A) above its
+#description (B). Keep in sync with migration 3a9e5b2c7f10
+WEIGHTED_SEARCH_FUNCTION = DDL('''
+CREATE OR REPLACE FUNCTION items_search_vector_update() RETURNS TRIGGER AS $$
+BEGIN
+  NEW.search_vector =
+    setweight(to_tsvector('pg_catalog.english', regexp_replace(
+      coalesce(NEW.name, ''), '[-@.]', ' ', 'g')), 'A') ||
+    setweight(to_tsvector('pg_catalog.english', regexp_replace(
+      coalesce(NEW.description, ''), '[-@.]', ' ', 'g')), 'B');
+  RETURN NEW;
+END
+$$ LANGUAGE 'plpgsql';
+''')
+
+
+@event.listens_for(mapper, 'after_configured')
+def weight_search_vector():
+  '''replace the unweighted search function that sqlalchemy-searchable
+  creates with the items table. It is attached once the mappers are
+  configured so it runs after the library DDL'''
+  if not event.contains(Item.__table__, 'after_create',
+                        WEIGHTED_SEARCH_FUNCTION):
+    event.listen(Item.__table__, 'after_create', WEIGHTED_SEARCH_FUNCTION)
+
+
 @event.listens_for(Item, 'before_delete')
 def remove_image_before_delete(mapper, connection, target): # pylint: disable=W0613
-  '''before delete item, delete the image from S3'''
-  if not current_app.testing and not delete_item_image(target.image_url):
+  '''before delete item, delete the image from S3. A pending image is
+  deleted by the uploader once it finds the item is gone, but not the one
+  it was replacing (image_previous)'''
+  image = target.image_previous if target.image_pending else target.image_url
+  if not current_app.testing and image and not delete_item_image(image):
     raise ValueError('Image not deleted')
 
 
+#columns the search results (matches, order and facets) depend on
+SEARCH_COLUMNS = ('name', 'description', 'price', 'category_id', 'country',
+                  'state', 'location', 'timestamp')
+
+
+def changed(target, columns):
+  '''True if any of the columns of target has changes to be flushed'''
+  return any(get_history(target, column).has_changes() for column in columns)
+
+
+def invalidate_item_caches(target, search=True, tiles=True):
+  '''after the commit, drop the item box rendered for the item and, if
+  the change can modify them, clear the search results and the map'''
+  item_id = target.id
+
+  def invalidate():
+    if search:
+      search_cache.clear()
+    if tiles:
+      tile_cache.clear()
+    fragment_cache.delete(item_id)
+  after_commit(target, invalidate)
+
+
+@event.listens_for(Item, 'after_update')
+def invalidate_updated_item(mapper, connection, target): # pylint: disable=W0613
+  '''the search results and the map are only cleared when a column they
+  depend on changes, not on image uploads or other updates, as the cached
+  ids load the current items anyway. New items aren't invalidated either:
+  they show up once the entries expire (see SEARCH_CACHE_TIMEOUT)'''
+  invalidate_item_caches(target, changed(target, SEARCH_COLUMNS),
+                          changed(target, ('location',)))
+
+
+@event.listens_for(Item, 'after_delete')
+def invalidate_deleted_item(mapper, connection, target): # pylint: disable=W0613
+  invalidate_item_caches(target)
+
+
 class Message(db.Model):
   __tablename__ = 'messages'
   id    = db.Column(db.Integer, primary_key=True)
@@ -262,7 +963,49 @@ class Message(db.Model):
     }
 
 
+#indexes for the notifications lists and counters of each user
+db.Index('ix_messages_receiver_unread_timestamp', Message.receiver_id,
+          Message.unread, Message.timestamp)
+db.Index('ix_messages_sender_timestamp', Message.sender_id, Message.timestamp)
+db.Index('ix_messages_item_id', Message.item_id)
+
+
+def update_unread_count(connection, user_id, delta):
+  '''add delta to the unread counter of the user in the same transaction
+  than the message change'''
+  users = User.__table__
+  connection.execute(users.update().where(users.c.id == user_id).values(
+                    unread_count=users.c.unread_count + delta))
+
+
+@event.listens_for(Message, 'after_insert')
+def count_unread_on_insert(mapper, connection, target): # pylint: disable=W0613
+  if target.unread and target.receiver_id:
+    update_unread_count(connection, target.receiver_id, 1)
+    invalidate_cached_user(target, target.receiver_id)
+
+
+@event.listens_for(Message, 'after_update')
+def count_unread_on_update(mapper, connection, target): # pylint: disable=W0613
+  '''the message was marked as read (or unread)'''
+  history = get_history(target, 'unread')
+  if history.deleted and bool(history.deleted[0]) != bool(target.unread) \
+      and target.receiver_id:
+    update_unread_count(connection, target.receiver_id,
+                        1 if target.unread else -1)
+    invalidate_cached_user(target, target.receiver_id)
+
+
+@event.listens_for(Message, 'after_delete')
+def count_unread_on_delete(mapper, connection, target): # pylint: disable=W0613
+  if target.unread and target.receiver_id:
+    update_unread_count(connection, target.receiver_id, -1)
+    invalidate_cached_user(target, target.receiver_id)
+
+
 class Country(object):
+  #(country_code, name) choices, computed on first use
+  _choices = None
 
   @staticmethod
   def get_countries():
@@ -274,11 +1017,13 @@ class Country(object):
 
   @staticmethod
   def get_country_choices():
-    '''return a list with tuples (country_code, name) with all the
-    countries sorted by country name'''
-    countries = Country.get_countries_by_names()
-    return [(value['iso'], name) for name, value in
-        sorted(countries.items())]
+    '''return a tuple with tuples (country_code, name) with all the
+    countries sorted by country name. It's computed once'''
+    if Country._choices is None:
+      countries = Country.get_countries_by_names()
+      Country._choices = tuple((value['iso'], name) for name, value in
+                                sorted(countries.items()))
+    return Country._choices
 
   @staticmethod
   def get_name(code):
@@ -286,6 +1031,10 @@ class Country(object):
 
 
 class State(object):
+  #(state_code, name) choices, computed on first use
+  _choices = None
+  #state field choices: Not US followed by the US states
+  _field_choices = None
 
   @staticmethod
   def get_us_states_by_names():
@@ -293,13 +1042,22 @@ class State(object):
 
   @staticmethod
   def get_us_state_choices():
-    '''return a list with tuples (state_code, name) with all the
-    US states sorted by state name'''
-    states = State.get_us_states_by_names()
-    return [(value['code'], name) for name, value in
-        sorted(states.items())]
+    '''return a tuple with tuples (state_code, name) with all the
+    US states sorted by state name. It's computed once'''
+    if State._choices is None:
+      states = State.get_us_states_by_names()
+      State._choices = tuple((value['code'], name) for name, value in
+                              sorted(states.items()))
+    return State._choices
+
+  @staticmethod
+  def get_state_field_choices():
+    '''return get_us_state_choices() preceded by ('NU', 'Not US'), the
+    choices of the UserForm state field. It's computed once'''
+    if State._field_choices is None:
+      State._field_choices = (('NU', 'Not US'),) + State.get_us_state_choices()
+    return State._field_choices
 
   @staticmethod
   def get_us_name(code):
     return gc.get_us_states()[code]['name']
-
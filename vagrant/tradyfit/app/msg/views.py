@@ -29,9 +29,10 @@ def create(id): # pylint: disable=W0622
 @login_required
 def notifications():
   #number of messages of each type
-  num_unread = len(current_user.msgs_unread)
-  num_sent = current_user.msgs_sent.count()
-  num_received = current_user.msgs_received.count()
+  counts = current_user.message_counts()
+  num_unread = counts['unread']
+  num_sent = counts['sent']
+  num_received = counts['received']
 
   if request.method == 'POST':
     if request.form.get('type') == 'unread':
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+from flask import current_app
+from itsdangerous import URLSafeSerializer, BadData
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+#orderings whose sort key is a datetime
+DATETIME_MODES = ('timestamp', 'last_seen', 'modified')
+
+
+def get_serializer():
+  '''signed serializer used to make cursors opaque and tamper proof'''
+  return URLSafeSerializer(current_app.config['SECRET_KEY'],
+                            salt='keyset-cursor')
+
+
+def encode_cursor(mode, key, last_id):
+  '''generate the opaque token pointing after the row (key, last_id)
+  Input: mode: (str) ordering the cursor belongs to
+         key: sort key of the last row (datetime or float)
+         last_id: (int) id of the last row
+  Output: (str) url safe token
+  '''
+  if isinstance(key, datetime):
+    key = key.strftime(TIMESTAMP_FORMAT)
+  return get_serializer().dumps([mode, key, last_id])
+
+
+def decode_cursor(token, mode):
+  '''return (key, last_id) stored in the token.
+  A ValueError is raised if the token is not valid or it was generated
+  for a different ordering'''
+  try:
+    cursor_mode, key, last_id = get_serializer().loads(token)
+    if cursor_mode != mode:
+      raise ValueError('cursor mode mismatch')
+    if mode in DATETIME_MODES:
+      key = datetime.strptime(key, TIMESTAMP_FORMAT)
+    return key, int(last_id)
+  except (BadData, TypeError):
+    raise ValueError('invalid cursor')
+
+
+class KeysetPagination(object):
+  '''one page of results from ItemQuery.keyset_paginate or seek_page.
+  Unlike offset pagination, only a "next" cursor is exposed: each page
+  seeks directly after the last row of the previous one'''
+
+  def __init__(self, items, per_page, cursor=None, next_cursor=None):
+    self.items = items
+    self.per_page = per_page
+    self.cursor = cursor
+    self.next_cursor = next_cursor
+
+  @property
+  def has_next(self):
+    return self.next_cursor is not None
+
+  @property
+  def is_first(self):
+    return self.cursor is None
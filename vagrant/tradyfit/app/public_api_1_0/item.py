@@ -1,13 +1,22 @@
 # -*- coding: utf-8 -*-
 import re
-from flask import jsonify, request
-from ..models import Category, Item
+from flask import jsonify, request, json, Response, stream_with_context, \
+current_app, abort
+from ..models import Item
+from ..categories import category_registry
 from . import public_api
 from .errors import bad_request
 from .. import limiter
+from ..search import search_item_ids, get_serialized, search_facets, \
+suggest_names
+from ..tiles import valid_tile, bbox_tiles, get_tile
 
 MIN_QUERY = 3
 MAX_QUERY = 80
+MIN_PREFIX = 2
+NDJSON = 'application/x-ndjson'
+#rows fetched per round trip from the server side cursor when streaming
+STREAM_BATCH = 100
 
 
 @limiter.request_filter
@@ -23,27 +32,139 @@ def valid_query(query):
           bool(re.match("^[A-Za-z0-9][.\- \w]+$", query))
 
 
+def valid_prefix(prefix):
+  '''same rules than valid_query but from MIN_PREFIX characters'''
+  return MIN_PREFIX <= len(prefix) < MAX_QUERY and \
+          bool(re.match("^[A-Za-z0-9][.\- \w]*$", prefix))
+
+
+def wants_stream():
+  '''True if the client asked for a NDJSON stream, with the Accept header
+  or the stream=1 query parameter'''
+  return request.args.get('stream') == '1' or \
+    request.accept_mimetypes.best_match(['application/json', NDJSON]) == NDJSON
+
+
+def stream_items(query):
+  '''return a response that emits one serialized item per line (NDJSON)
+  as they are read in batches from a server side cursor, so the whole result
+  is never loaded in memory'''
+  query = query.execution_options(stream_results=True).yield_per(
+                                                              STREAM_BATCH)
+
+  def generate():
+    for item in query.serialized():
+      yield json.dumps(item) + '\n'
+  return Response(stream_with_context(generate()), mimetype=NDJSON)
+
+
+def items_response(query):
+  '''send the items of query as a JSON list or as a NDJSON stream'''
+  if wants_stream():
+    return stream_items(query)
+  return jsonify(items=list(query.serialized()))
+
+
 @public_api.route('/items/category/<category>')
 @limiter.limit("10/minute;2/second")
 def get_items_category(category):
-  category = Category.query.filter_by(name=category).first_or_404()
+  category = category_registry.get_by_name(category)
+  if category is None:
+    abort(404)
   items = Item.query.filter_by(category_id = category.id).order_by(
-                  Item.timestamp.desc()).all()
-  return jsonify(items=[item.serialize for item in items])
+                  Item.timestamp.desc())
+  return items_response(items)
 
 
 @public_api.route('/items/search/<query>')
 @limiter.limit("10/minute;2/second")
 def get_items_search(query):
-  '''return items containing the query text on name or description'''
+  '''return items containing the query text on name or description, newest
+  first or, with order=relevance, the best ranked ones'''
   if valid_query(query):
-    items = Item.query.search(query).order_by(
-                    Item.timestamp.desc()).all()
-    return jsonify(items=[item.serialize for item in items])
+    if request.args.get('order') == 'relevance':
+      ids = search_item_ids(query, ranked=True,
+                          limit=current_app.config['SEARCH_RANK_CANDIDATES'])
+    elif wants_stream():
+      return stream_items(Item.query.search(query).order_by(
+                          Item.timestamp.desc()))
+    else:
+      ids = search_item_ids(query)
+    return jsonify(items=get_serialized(ids), facets=search_facets(query))
   else:
     return bad_request('Not a valid search')
 
 
+@public_api.route('/items/search', methods=['POST'])
+@limiter.limit("10/minute;2/second")
+def get_items_search_batch():
+  '''run up to SEARCH_BATCH_MAX_QUERIES searches sent as a JSON list
+  ({"queries": [...]}) with a single database query. Return the newest
+  SEARCH_BATCH_LIMIT items of each one keyed by query'''
+  data = request.get_json(silent=True) or {}
+  queries = data.get('queries') if isinstance(data, dict) else None
+  if not isinstance(queries, list) or not queries or \
+      len(queries) > current_app.config['SEARCH_BATCH_MAX_QUERIES']:
+    return bad_request('Not a valid list of searches')
+  for query in queries:
+    if not isinstance(query, basestring) or not valid_query(query):
+      return bad_request('Not a valid search')
+  results = Item.query.batch_search(list(set(queries)),
+                                  current_app.config['SEARCH_BATCH_LIMIT'],
+                                  serialized=True)
+  return jsonify(results=results)
+
+
+@public_api.route('/items/suggest/<prefix>')
+@limiter.limit("60/minute;5/second")
+def get_items_suggest(prefix):
+  '''return item names to autocomplete the search prefix'''
+  if valid_prefix(prefix):
+    names = suggest_names(prefix, current_app.config['SUGGEST_LIMIT'])
+    return jsonify(suggestions=names)
+  else:
+    return bad_request('Not a valid prefix')
+
+
+def parse_bbox(bbox):
+  '''return (west, south, east, north) from the "west,south,east,north"
+  string or None if it is not a valid bounding box'''
+  try:
+    west, south, east, north = [float(v) for v in bbox.split(',')]
+  except (AttributeError, ValueError):
+    return None
+  if -180 <= west <= east <= 180 and -90 <= south <= north <= 90:
+    return west, south, east, north
+
+
+@public_api.route('/items/tiles/<int:z>/<int:x>/<int:y>')
+@limiter.limit("120/minute;10/second")
+def get_items_tile(z, x, y):
+  '''return the item clusters (count and centroid) of the map tile z/x/y'''
+  if valid_tile(z, x, y):
+    return jsonify(z=z, x=x, y=y, clusters=get_tile(z, x, y))
+  else:
+    return bad_request('Not a valid tile')
+
+
+@public_api.route('/items/clusters')
+@limiter.limit("60/minute;5/second")
+def get_items_clusters():
+  '''return the item clusters of the tiles covering the bounding box
+  (bbox=west,south,east,north) at the given zoom level'''
+  bbox = parse_bbox(request.args.get('bbox'))
+  z = request.args.get('zoom', type=int)
+  if bbox is None or z is None or not valid_tile(z, 0, 0):
+    return bad_request('Not a valid bounding box or zoom')
+  tiles = bbox_tiles(bbox, z, current_app.config['TILE_MAX_TILES'])
+  if tiles is None:
+    return bad_request('Too many tiles, zoom in')
+  clusters = []
+  for x, y in tiles:
+    clusters.extend(get_tile(z, x, y))
+  return jsonify(zoom=z, clusters=clusters)
+
+
 @public_api.route('/items/<int:id>')
 @limiter.limit("10/minute;2/second")
 def get_item(id): # pylint: disable=W0622
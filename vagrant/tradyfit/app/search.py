@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+from flask import current_app
+from geoalchemy2.elements import WKTElement
+from . import search_cache, suggest_cache
+from .models import Item
+from .pagination import KeysetPagination
+
+#size in degrees of the location cells (~1km) used to share cached
+#nearby searches between users close to each other
+CELL_SIZE = 0.01
+
+
+def normalize_query(query):
+  '''lower case the query and collapse whitespaces so equivalent searches
+  share the same cache entry'''
+  return ' '.join(query.lower().split())
+
+
+def location_cell(user):
+  '''return the (row, column) cell containing the user location or None if
+  the user has no coordinates'''
+  if user is None or not user.has_coordinates():
+    return None
+  return (int(float(user.latitude) // CELL_SIZE),
+          int(float(user.longitude) // CELL_SIZE))
+
+
+def cell_point(cell):
+  '''WKT point in the center of the cell'''
+  latitude = (cell[0] + 0.5) * CELL_SIZE
+  longitude = (cell[1] + 0.5) * CELL_SIZE
+  return WKTElement('POINT({0} {1})'.format(longitude, latitude), srid=4326)
+
+
+def get_items(ids):
+  '''load the items with the given ids keeping the order of the list.
+  Items deleted after the ids were cached are skipped'''
+  if not ids:
+    return []
+  items = dict((item.id, item) for item in
+                Item.query.listing().filter(Item.id.in_(ids)).all())
+  return [items[i] for i in ids if i in items]
+
+
+def get_serialized(ids):
+  '''serialize the items with the given ids (see ItemQuery.serialized)
+  keeping the order of the list, without building the entities'''
+  if not ids:
+    return []
+  items = dict((item['id'], item) for item in
+                Item.query.filter(Item.id.in_(ids)).serialized())
+  return [items[i] for i in ids if i in items]
+
+
+def search_page(query, cursor=None, per_page=20, user=None, ranked=False,
+                radius_km=None):
+  '''return a KeysetPagination with the items matching query. If the user
+  has a location they are ordered by distance to the center of its location
+  cell (only the ones at less than radius_km if given), if not, by newest
+  first. With ranked, only one page with the best
+  per_page items is returned (see ItemQuery.rank_search).
+  The ids of each page are cached'''
+  query = normalize_query(query)
+  cell = location_cell(user)
+  if cell is None:
+    radius_km = None
+  if ranked:
+    mode = 'relevance'
+    cursor = None
+  else:
+    mode = 'timestamp' if cell is None else 'distance'
+  key = ('page', query, mode, cell, radius_km, cursor, per_page)
+  cached = search_cache.get(key)
+  if cached is not None:
+    ids, next_cursor = cached
+    return KeysetPagination(get_items(ids), per_page, cursor, next_cursor)
+
+  user_loc = cell_point(cell) if cell else None
+  if ranked:
+    page = KeysetPagination(Item.query.rank_search(query, user_loc, per_page,
+                                                    radius_km), per_page)
+  else:
+    page = Item.query.listing().search(query).keyset_paginate(cursor,
+                                      per_page, user_loc, radius_km=radius_km)
+  search_cache.set(key, ([item.id for item in page.items], page.next_cursor))
+  return page
+
+
+def search_item_ids(query, ranked=False, limit=None):
+  '''return the ids of the newest items matching query, or of the best
+  ranked ones, at most limit (SEARCH_MAX_RESULTS by default) so the cached
+  lists and the IN queries loading them stay bounded. They are cached'''
+  query = normalize_query(query)
+  limit = min(limit or current_app.config['SEARCH_MAX_RESULTS'],
+              current_app.config['SEARCH_MAX_RESULTS'])
+  key = ('all', query, 'relevance' if ranked else 'timestamp', limit)
+  ids = search_cache.get(key)
+  if ids is None:
+    if ranked:
+      ids = [item.id for item in Item.query.rank_search(query, limit=limit)]
+    else:
+      ids = [row.id for row in Item.query.search(query).order_by(
+                Item.timestamp.desc()).with_entities(Item.id).limit(limit)]
+    search_cache.set(key, ids)
+  return ids
+
+
+def search_items(query, ranked=False, limit=None):
+  '''return the items of search_item_ids'''
+  return get_items(search_item_ids(query, ranked, limit))
+
+
+def search_facets(query, user=None, radius_km=None):
+  '''return the facet counts (see ItemQuery.facets) of the items matching
+  query, only the ones at less than radius_km from the center of the user
+  location cell if given, like search_page. They are cached with the
+  search results'''
+  query = normalize_query(query)
+  cell = location_cell(user) if radius_km else None
+  if cell is None:
+    radius_km = None
+  key = ('facets', query, cell, radius_km)
+  facets = search_cache.get(key)
+  if facets is None:
+    user_loc = cell_point(cell) if cell else None
+    facets = Item.query.search(query).facets(user_loc, radius_km)
+    search_cache.set(key, facets)
+  return facets
+
+
+def suggest_names(prefix, limit=8):
+  '''return item names for autocompleting prefix. Popular prefixes are
+  served from the suggestions cache until its entries expire'''
+  prefix = normalize_query(prefix)
+  key = (prefix, limit)
+  names = suggest_cache.get(key)
+  if names is None:
+    names = Item.query.suggest_names(prefix, limit)
+    suggest_cache.set(key, names)
+  return names
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import errno
+import os
+import shutil
+from flask import current_app
+from .helpers import upload_s3, delete_s3
+
+
+class S3Storage(object):
+  '''files in the S3 bucket. Directories are config keys
+  (e.g. S3_UPLOAD_ITEM_DIR)'''
+
+  def save(self, directory, filename, data):
+    '''store data (string or file object), return True if it was stored'''
+    return upload_s3(directory, filename, data)
+
+  def delete(self, directory, filename):
+    '''remove the file, return True if it was removed'''
+    return delete_s3(current_app.config[directory], filename)
+
+
+class LocalStorage(object):
+  '''stand-in for S3 storing the files under root, so the uploads can run
+  offline and in tests'''
+
+  def __init__(self, root):
+    self.root = root
+
+  def path(self, directory, filename):
+    return os.path.join(self.root, current_app.config[directory].strip('/'),
+                        filename)
+
+  def save(self, directory, filename, data):
+    path = self.path(directory, filename)
+    try:
+      if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+      with open(path, 'wb') as f:
+        if isinstance(data, basestring):
+          f.write(data)
+        else:
+          data.seek(0)
+          shutil.copyfileobj(data, f, current_app.config['UPLOAD_CHUNK_SIZE'])
+      return True
+    except (IOError, OSError):
+      return False
+
+  def delete(self, directory, filename):
+    try:
+      os.remove(self.path(directory, filename))
+      return True
+    except OSError as e:
+      return e.errno == errno.ENOENT
+
+
+def get_storage():
+  '''storage backend selected by IMAGE_STORAGE: "s3" or "local" (files
+  under IMAGE_STORAGE_DIR)'''
+  config = current_app.config
+  if config['IMAGE_STORAGE'] == 'local':
+    return LocalStorage(config['IMAGE_STORAGE_DIR'])
+  return S3Storage()
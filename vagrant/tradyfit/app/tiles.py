@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import math
+from flask import current_app
+from . import tile_cache
+from .models import Item
+
+
+def tile_bounds(z, x, y):
+  '''(west, south, east, north) in degrees of the web map tile z/x/y'''
+  n = 2.0 ** z
+
+  def latitude(row):
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+  return (x / n * 360.0 - 180, latitude(y + 1), (x + 1) / n * 360.0 - 180,
+          latitude(y))
+
+
+def tile_index(z, longitude, latitude):
+  '''(x, y) of the tile of zoom z containing the point'''
+  n = 2 ** z
+  latitude = max(min(latitude, 85.0511), -85.0511) #web mercator limits
+  lat = math.radians(latitude)
+  x = int((longitude + 180) / 360.0 * n)
+  y = int((1 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi) / 2 * n)
+  return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def valid_tile(z, x, y):
+  n = 2 ** z
+  return 0 <= z <= current_app.config['TILE_MAX_ZOOM'] and \
+          0 <= x < n and 0 <= y < n
+
+
+def bbox_tiles(bbox, z, limit=None):
+  '''list of (x, y) tiles of zoom z covering bbox (west, south, east, north)
+  or None if they are more than limit'''
+  west, south, east, north = bbox
+  x0, y0 = tile_index(z, west, north)
+  x1, y1 = tile_index(z, east, south)
+  if limit is not None and (x1 - x0 + 1) * (y1 - y0 + 1) > limit:
+    return None
+  return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def get_tile(z, x, y):
+  '''return the item clusters of the tile z/x/y (see ItemQuery.clusters).
+  The tile is divided in TILE_GRID x TILE_GRID cells. Tiles are cached by
+  z/x/y so panning over the map again doesn't hit the database'''
+  key = (z, x, y)
+  clusters = tile_cache.get(key)
+  if clusters is None:
+    cell_size = 360.0 / 2 ** z / current_app.config['TILE_GRID']
+    clusters = Item.query.clusters(tile_bounds(z, x, y), cell_size)
+    tile_cache.set(key, clusters)
+  return clusters
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+import errno
+import os
+import threading
+import time
+from glob import glob
+from Queue import Queue
+from uuid import uuid4
+from sqlalchemy import and_, select, func
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug import secure_filename
+from .helpers import make_image_request
+from .images import make_renditions, rendition_filenames, RENDITIONS_NONE
+from .storage import get_storage
+
+#first key of the advisory locks claiming the avatar imports, the second
+#one is the user id
+AVATAR_LOCK = 1
+
+
+class ImageUploader(object):
+  '''background stage of the item images uploads. The request writes the
+  image to a local spool directory and creates the item with image_pending,
+  then a pool of worker threads uploads the renditions of the spooled
+  files to the storage, retrying with increasing delays, and flips
+  image_pending. The same pool imports the Facebook avatars of new users.
+  With no workers the jobs run in the request (tests). A job claims its
+  spooled file by renaming it with the pid of the process, so a job queued
+  twice (e.g. by resume() while it's still running) is uploaded once.
+  resume() is only run by the resume_uploads command, not by each worker
+  process'''
+
+  def __init__(self):
+    self.app = None
+    self.workers = 0
+    self.retries = 3
+    self.retry_delay = 1
+    self.spool_dir = None
+    self._queue = Queue()
+    self._threads = []
+    self._pid = None
+    self._lock = threading.Lock()
+
+  def init_app(self, app):
+    '''set up the pool size, retries and spool directory from the app
+    config'''
+    self.app = app
+    self.workers = app.config['UPLOAD_WORKERS']
+    self.retries = app.config['UPLOAD_RETRIES']
+    self.retry_delay = app.config['UPLOAD_RETRY_DELAY']
+    self.spool_dir = app.config['UPLOAD_SPOOL_DIR']
+    try:
+      os.makedirs(self.spool_dir)
+    except OSError:
+      if not os.path.isdir(self.spool_dir):
+        raise
+
+  def spool(self, source_file):
+    '''write the uploaded image to the spool directory
+       Input: source_file: (FileField) File Storage object
+       Output: (str) filename the image will have in the storage, None if
+               it couldn't be written
+    '''
+    source_filename = secure_filename(source_file.data.filename)
+    filename = uuid4().hex + '.' + source_filename.split('.', 1)[-1]
+    try:
+      source_file.data.save(self.spool_path(filename),
+                            self.app.config['UPLOAD_CHUNK_SIZE'])
+      return filename
+    except (IOError, OSError):
+      self.app.logger.exception('image not spooled')
+      return None
+
+  def spool_path(self, filename):
+    return os.path.join(self.spool_dir, filename)
+
+  def enqueue(self, item_id, filename):
+    '''upload the spooled image filename of the item'''
+    return self._run(self.process, item_id, filename)
+
+  def enqueue_avatar(self, user_id, url):
+    '''import the avatar at url (Facebook picture) for the user'''
+    return self._run(self.import_avatar, user_id, url)
+
+  def _run(self, job, *args):
+    if not self.workers:
+      return job(*args)
+    self._start()
+    self._queue.put((job, args))
+
+  def join(self):
+    '''wait until the queued uploads are done'''
+    self._queue.join()
+
+  def _start(self):
+    '''start the worker threads in this process (gunicorn forks the workers
+    after the app is created, threads don't survive the fork)'''
+    with self._lock:
+      if self._pid == os.getpid():
+        return
+      self._pid = os.getpid()
+      self._threads = []
+      for _ in range(self.workers):
+        thread = threading.Thread(target=self._work)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+  def _work(self):
+    while True:
+      job, args = self._queue.get()
+      try:
+        with self.app.app_context():
+          job(*args)
+      except Exception: # pylint: disable=W0703
+        self.app.logger.exception('image job failed')
+      finally:
+        self._queue.task_done()
+
+  def claim(self, filename):
+    '''rename the spooled image filename for this process, unless another
+    live process has claimed it. Return the new path, None if there's
+    nothing to claim'''
+    path = self.spool_path(filename)
+    claimed = '{0}.{1}'.format(path, os.getpid())
+    for candidate in [path] + glob(path + '.*'):
+      if candidate != path and self._claimed_by_live(candidate):
+        continue
+      try:
+        os.rename(candidate, claimed)
+        return claimed
+      except OSError:
+        pass #claimed by another job meanwhile
+    return None
+
+  def _claimed_by_live(self, path):
+    '''whether the process whose pid ends the spooled path is running'''
+    try:
+      os.kill(int(path.rsplit('.', 1)[1]), 0)
+    except ValueError:
+      return True #not a claimed file
+    except OSError as e:
+      return e.errno != errno.ESRCH
+    return True
+
+  def process(self, item_id, filename):
+    '''upload the renditions of the spooled image and update the item. If
+    every attempt fails the item goes back to its previous image (the
+    default one for new items). Return True if it was uploaded'''
+    path = self.claim(filename)
+    if path is None:
+      return False #already uploaded or being uploaded by another job
+    storage = get_storage()
+    uploaded = False
+    try:
+      with open(path, 'rb') as f:
+        made = make_renditions(filename, f,
+                                self.app.config['IMAGE_RENDITIONS'],
+                                self.app.config['IMAGE_WEBP'],
+                                self.app.config['IMAGE_MAX_PIXELS'])
+        if made is None:
+          self.app.logger.warning('spooled image %s not decoded', filename)
+        else:
+          files, renditions = made
+          uploaded = all(self.save(storage, name, content)
+                          for name, content in files)
+    except IOError:
+      self.app.logger.exception('spooled image not found')
+    except Exception: # pylint: disable=W0703
+      #the item must not stay pending
+      self.app.logger.exception('image renditions not made')
+
+    if not uploaded:
+      self.delete(storage, filename)
+    updated, previous = self.finish(item_id, filename,
+                                    renditions if uploaded else None)
+    if updated is None:
+      #keep the spooled image to resume it later
+      os.rename(path, self.spool_path(filename))
+      return uploaded
+    if uploaded and not updated:
+      #the item was deleted or its image replaced meanwhile
+      self.delete(storage, filename)
+    elif uploaded and previous != self.app.config['DEFAULT_ITEM']:
+      self.delete(storage, previous)
+    try:
+      os.remove(path)
+    except OSError:
+      pass
+    return uploaded
+
+  def import_avatar(self, user_id, url):
+    '''download the avatar, upload its renditions and set it to the user if
+    it still has the default one. The user keeps url as avatar_source until
+    the import ends, so resume() queues it again if the download or the
+    upload failed, or the process exited before. The import is claimed with
+    an advisory lock on the user id, released when the database connection
+    closes if the process exits, so a job queued twice imports it once.
+    Return True if it was set'''
+    from . import db
+    from .models import User
+    users = User.__table__
+    lock = (AVATAR_LOCK, user_id)
+    with db.get_engine(self.app).connect() as connection:
+      if not connection.scalar(select([func.pg_try_advisory_lock(*lock)])):
+        return False #being imported by another job
+      try:
+        #skip it if it was already imported by another job or replaced
+        pending = connection.execute(select([users.c.id]).where(and_(
+                    users.c.id == user_id, users.c.avatar_source == url,
+                    users.c.avatar_url == self.app.config['DEFAULT_AVATAR'])
+                    )).first()
+        return pending is not None and self._import_avatar(user_id, url)
+      finally:
+        connection.execute(select([func.pg_advisory_unlock(*lock)]))
+
+  def _import_avatar(self, user_id, url):
+    config = self.app.config
+    storage = get_storage()
+    filename = uuid4().hex + '.jpg'
+    image = make_image_request(url)
+    if image is None:
+      return False #still pending, resume() retries it
+    try:
+      made = make_renditions(filename, image, config['AVATAR_RENDITIONS'],
+                            config['IMAGE_WEBP'], config['IMAGE_MAX_PIXELS'])
+    finally:
+      image.close()
+    if made is None:
+      #not an image, give up: the user keeps the default avatar
+      self.finish_avatar(user_id, url)
+      return False
+    files, renditions = made
+    if all(self.save(storage, name, content, 'S3_UPLOAD_AVATAR_DIR')
+            for name, content in files) and \
+        self.finish_avatar(user_id, url, filename, renditions):
+      return True
+    #still pending if not uploaded, not set if it was replaced meanwhile
+    self.delete(storage, filename, 'S3_UPLOAD_AVATAR_DIR', 'AVATAR_RENDITIONS')
+    return False
+
+  def save(self, storage, filename, data, directory='S3_UPLOAD_ITEM_DIR'):
+    '''store a file retrying with increasing delays'''
+    for attempt in range(self.retries):
+      if attempt:
+        time.sleep(self.retry_delay * 2 ** (attempt - 1))
+      if storage.save(directory, filename, data):
+        return True
+    return False
+
+  def delete(self, storage, filename, directory='S3_UPLOAD_ITEM_DIR',
+              sizes='IMAGE_RENDITIONS'):
+    '''remove the image and its renditions from the storage'''
+    for name in set([filename] + rendition_filenames(filename,
+                                                    self.app.config[sizes])):
+      storage.delete(directory, name)
+
+  def finish(self, item_id, filename, renditions=None):
+    '''flip image_pending of the item if its image is still filename and
+    set its renditions. With no renditions (the upload failed) the item
+    goes back to its previous image, the default one if it had none.
+    Return (True, previous image) if updated, (False, None) if not and
+    (None, None) if the database couldn't be reached'''
+    from . import db
+    from .models import Item
+    items = Item.__table__
+    current = and_(items.c.id == item_id, items.c.image_url == filename)
+    try:
+      with db.get_engine(self.app).begin() as connection:
+        row = connection.execute(select([items.c.image_previous,
+                                        items.c.image_previous_renditions]
+                                        ).where(current).with_for_update()
+                                ).first()
+        if row is None:
+          return False, None
+        previous = row.image_previous or self.app.config['DEFAULT_ITEM']
+        values = {'image_pending': False, 'image_previous': None,
+                  'image_previous_renditions': RENDITIONS_NONE}
+        if renditions is None:
+          values.update(image_url=previous,
+                        image_renditions=row.image_previous_renditions)
+        else:
+          values['image_renditions'] = renditions
+        connection.execute(items.update().where(current).values(**values))
+        return True, previous
+    except SQLAlchemyError:
+      self.app.logger.exception('item image state not updated')
+      return None, None
+
+  def finish_avatar(self, user_id, url, filename=None,
+                    renditions=RENDITIONS_NONE):
+    '''end the import of the avatar at url: clear avatar_source of the user
+    and set filename as its avatar if given. Only if the user still has the
+    default avatar and url to import (it wasn't deleted or imported by a
+    concurrent login). Return True if updated, False if not and None if the
+    database couldn't be reached'''
+    from . import db, user_cache
+    from .models import User
+    users = User.__table__
+    values = {'avatar_source': None}
+    if filename:
+      values.update(avatar_url=filename, avatar_renditions=renditions)
+    try:
+      with db.get_engine(self.app).begin() as connection:
+        updated = connection.execute(users.update().where(and_(
+                    users.c.id == user_id, users.c.avatar_source == url,
+                    users.c.avatar_url == self.app.config['DEFAULT_AVATAR'])
+                    ).values(**values)).rowcount == 1
+    except SQLAlchemyError:
+      self.app.logger.exception('user avatar not updated')
+      return None
+    if updated:
+      user_cache.delete(user_id)
+    return updated
+
+  def resume(self):
+    '''queue again the pending items whose spooled image is still here
+    and the avatars not imported yet (e.g. the process exited before).
+    Return their number'''
+    from .models import Item, User
+    pending = [(item.id, item.image_url) for item in
+                Item.query.filter_by(image_pending=True).with_entities(
+                                                  Item.id, Item.image_url)
+                if self._resumable(item.image_url)]
+    for item_id, filename in pending:
+      self.enqueue(item_id, filename)
+    avatars = User.query.filter(User.avatar_source.isnot(None)).with_entities(
+                                        User.id, User.avatar_source).all()
+    for user_id, url in avatars:
+      self.enqueue_avatar(user_id, url)
+    return len(pending) + len(avatars)
+
+  def _resumable(self, filename):
+    '''whether the spooled image is still here and not claimed by a live
+    process'''
+    path = self.spool_path(filename)
+    return os.path.exists(path) or any(not self._claimed_by_live(claimed)
+                                        for claimed in glob(path + '.*'))
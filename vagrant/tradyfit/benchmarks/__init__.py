@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+import time
+
+
+def timeit(function, repeat=5):
+  '''best time in seconds of calling function repeat times'''
+  best = None
+  for _ in range(repeat):
+    start = time.time()
+    function()
+    elapsed = time.time() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+'''item boxes of a list page: rendering the _item_box.html fragment of each
+item versus item_box() served from the fragment cache'''
+from flask import current_app, render_template_string
+from app import db, fragment_cache
+from app.models import Category, Item, User
+from . import timeit
+
+INCLUDE = '''{% for item in items %}
+{% include "main/_item_box.html" %}{% endfor %}'''
+CACHED = '''{% for item in items %}{{ item_box(item) }}{% endfor %}'''
+
+
+def run():
+  per_page = current_app.config['ITEMS_PER_PAGE']
+  #sample items are created inside a transaction rolled back at the end
+  user = User(fb_id='benchmark', email='benchmark@example.com',
+              name='Benchmark', username='benchmark', avatar_url='avatar.jpg')
+  db.session.add(user)
+  db.session.flush()
+  category = Category.query.first()
+  db.session.add_all([Item(name='benchmark item {0}'.format(i),
+              description='benchmark description ' * 8, price=10 + i,
+              image_url='item.jpg', city='Madrid', country='ES',
+              category_id=category.id, user_id=user.id)
+              for i in range(per_page)])
+  db.session.flush()
+  items = Item.query.listing().filter_by(user_id=user.id).all()
+
+  try:
+    with current_app.test_request_context('/'):
+      fragment_cache.clear()
+      cold = timeit(lambda: render_template_string(CACHED, items=items),
+                    repeat=1)
+      for name, elapsed in [
+          ('include', timeit(lambda: render_template_string(INCLUDE,
+                                                            items=items))),
+          ('item_box (cold cache)', cold),
+          ('item_box (warm cache)', timeit(lambda: render_template_string(
+                                                    CACHED, items=items)))]:
+        print('{0:22} {1:8.3f} ms/page'.format(name, elapsed * 1000))
+      stats = fragment_cache.stats
+      print('{0:22} {1:8.3f} ms/box, {2} bytes cached'.format('render',
+                                      stats['render_ms'], stats['bytes']))
+  finally:
+    db.session.rollback()
+    fragment_cache.clear()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+'''notifications counters of a user with a large inbox: three queries
+(unread, sent and received) versus User.message_counts()'''
+from datetime import datetime, timedelta
+from app import db
+from app.models import Message, User
+from . import timeit
+
+
+def run(received=20000, sent=5000):
+  #sample messages are created inside a transaction rolled back at the end
+  user = User(fb_id='benchmark', email='benchmark@example.com',
+              name='Benchmark', username='benchmark', avatar_url='avatar.jpg')
+  other = User(fb_id='benchmark1', email='benchmark1@example.com',
+              name='Benchmark', username='benchmark1', avatar_url='avatar.jpg')
+  db.session.add_all([user, other])
+  db.session.flush()
+  now = datetime.utcnow()
+  messages = [{'subject': 'benchmark', 'sender_id': other.id,
+              'receiver_id': user.id, 'unread': i % 3 == 0,
+              'timestamp': now - timedelta(minutes=i)} for i in range(received)]
+  messages += [{'subject': 'benchmark', 'sender_id': user.id,
+              'receiver_id': other.id, 'unread': False,
+              'timestamp': now - timedelta(minutes=i)} for i in range(sent)]
+  #the core insert skips the mapper events keeping the counter, so it's
+  #set as they would
+  db.session.execute(Message.__table__.insert(), messages)
+  user.unread_count = sum(1 for message in messages if message['unread'] and
+                          message['receiver_id'] == user.id)
+  db.session.flush()
+  db.session.execute('ANALYZE messages')
+
+  def three_queries():
+    db.session.expire(user, ['msgs_unread'])
+    return (len(user.msgs_unread), user.msgs_sent.count(),
+            user.msgs_received.count())
+
+  def message_counts():
+    counts = user.message_counts()
+    return counts['unread'], counts['sent'], counts['received']
+
+  try:
+    #both variants have to count the same before comparing their times
+    assert three_queries() == message_counts(), \
+        (three_queries(), message_counts())
+    for name, function in [('three queries', three_queries),
+                          ('User.message_counts', message_counts)]:
+      print('{0:22} {1:8.2f} ms'.format(name, timeit(function) * 1000))
+  finally:
+    db.session.rollback()
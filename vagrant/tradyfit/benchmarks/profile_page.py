@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+'''profile page: app startup time and the cost per request of building
+the UserForm with its country/state choices sorted on each request versus
+computed once'''
+import os
+import subprocess
+import sys
+import time
+from flask import current_app
+from app.main.forms import UserForm
+from app.models import Country, State
+from . import timeit
+
+#run in a new interpreter, config name as argument
+STARTUP = '''
+import sys, time
+start = time.time()
+from app import create_app
+create_app(sys.argv[1])
+print('%.1f ms, geonamescache imported: %s' % ((time.time() - start) * 1000,
+      'geonamescache' in sys.modules))
+'''
+
+
+def run(requests=1000):
+  root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+  config = os.getenv('FLASK_CONFIG') or 'default'
+  print('startup: ' + subprocess.check_output([sys.executable, '-c',
+                                    STARTUP, config], cwd=root).strip())
+
+  def uncached_form():
+    #drop the computed choices, so they are sorted again for this form
+    Country._choices = State._choices = State._field_choices = None
+    return UserForm(user=None)
+
+  def form():
+    return UserForm(user=None)
+
+  with current_app.test_request_context('/profile'):
+    start = time.time()
+    form()
+    print('first form: {0:.2f} ms'.format((time.time() - start) * 1000))
+    for name, function in [('sorted per request', uncached_form),
+                          ('choices computed once', form)]:
+      elapsed = timeit(lambda: [function() for _ in range(requests)])
+      print('{0:22} {1:8.3f} ms/request'.format(name,
+                                              elapsed * 1000 / requests))
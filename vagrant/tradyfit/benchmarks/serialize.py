@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+'''items/sec serialized by the public API: Item.serialize on ORM entities
+(with the category lazy loaded per item) versus ItemQuery.serialized()'''
+from app import db
+from app.models import Category, Item, User
+from . import timeit
+
+
+def run(items=2000):
+  #sample items are created inside a transaction rolled back at the end
+  user = User(fb_id='benchmark', email='benchmark@example.com',
+              name='Benchmark', username='benchmark', avatar_url='avatar.jpg')
+  db.session.add(user)
+  categories = Category.query.all()
+  for i in range(items):
+    db.session.add(Item(name='item {0}'.format(i), description='benchmark',
+                  price=i, image_url='item.jpg', user=user, country='US',
+                  state='CA', city='San Francisco',
+                  category=categories[i % len(categories)]))
+  db.session.flush()
+  query = Item.query.filter_by(user_id=user.id).order_by(Item.timestamp.desc())
+
+  def entities():
+    db.session.expire_all()
+    return [item.serialize for item in query.all()]
+
+  def columns():
+    return list(query.serialized())
+
+  try:
+    for name, function in [('Item.serialize', entities),
+                          ('ItemQuery.serialized', columns)]:
+      print('{0:22} {1:10.0f} items/sec'.format(name,
+                                              items / timeit(function)))
+  finally:
+    db.session.rollback()
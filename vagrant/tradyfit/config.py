@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import os
+import tempfile
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 
@@ -34,7 +35,106 @@ class Config(object):
   DEFAULT_ITEM = 'default_item.jpg'
   DEFAULT_AVATAR = 'default_avatar.jpg'
 
-  #MAX IMAGE SIZE ALLOWED 3MB
+  #items shown per page on search results and category pages
+  ITEMS_PER_PAGE = 20
+
+  #rows shown per page on the admin users and items lists
+  ADMIN_PER_PAGE = 50
+  #tables estimated below this number of rows are counted exactly
+  EXACT_COUNT_THRESHOLD = 10000
+
+  #eager loading of the item boxes relationships on list pages:
+  #"joined" or "subquery" (see ItemQuery.listing)
+  LISTING_LOAD_STRATEGY = 'joined'
+
+  #distances (km) users can limit the nearby results to
+  RADIUS_CHOICES = (10, 50, 200)
+
+  #search results cache: max number of entries and seconds before expiring
+  SEARCH_CACHE_SIZE = 500
+  SEARCH_CACHE_TIMEOUT = 60
+  #max number of items returned (and ids cached) by the unpaginated search
+  SEARCH_MAX_RESULTS = 500
+
+  #ranked search: matches scored per query and weight of each signal.
+  #Recency and proximity decay to half after the given days and km
+  SEARCH_RANK_CANDIDATES = 200
+  SEARCH_RANK_WEIGHTS = {'relevance': 1.0, 'recency': 0.3, 'proximity': 0.5}
+  SEARCH_RANK_RECENCY_DAYS = 30
+  SEARCH_RANK_PROXIMITY_KM = 50
+
+  #batch search API: max queries per request and items per query
+  SEARCH_BATCH_MAX_QUERIES = 10
+  SEARCH_BATCH_LIMIT = 20
+
+  #upper limits of the price ranges counted on the search facets
+  PRICE_BUCKETS = (25, 50, 100, 250, 500)
+
+  #name suggestions: max results and cache of popular prefixes, refreshed
+  #when the entries expire
+  SUGGEST_LIMIT = 8
+  SUGGEST_CACHE_SIZE = 1000
+  SUGGEST_CACHE_TIMEOUT = 300
+
+  #map tiles: max zoom, grid cells per tile side, max tiles per bbox request
+  #and cache of the clusters by z/x/y
+  TILE_MAX_ZOOM = 18
+  TILE_GRID = 8
+  TILE_MAX_TILES = 32
+  TILE_CACHE_SIZE = 5000
+  TILE_CACHE_TIMEOUT = 300
+
+  #logged in users snapshots cache (see load_user): switch, max number of
+  #users and seconds before expiring, which is how long the other worker
+  #processes can serve a changed user
+  USER_CACHE_ENABLED = True
+  USER_CACHE_SIZE = 10000
+  USER_CACHE_TIMEOUT = 30
+
+  #rendered item boxes cache: max number of items, seconds before expiring
+  #and max total size of the html
+  FRAGMENT_CACHE_SIZE = 5000
+  FRAGMENT_CACHE_TIMEOUT = 600
+  FRAGMENT_CACHE_BYTES = 8 * 1024 * 1024
+
+  #users last_seen pings are written in batches of up to this size or
+  #after this number of seconds
+  LAST_SEEN_FLUSH_SIZE = 100
+  LAST_SEEN_FLUSH_INTERVAL = 60
+
+  #item images are written to the spool directory by the request and
+  #uploaded by this number of background threads per worker process, with
+  #retries after 1, 2, 4... RETRY_DELAY seconds
+  UPLOAD_WORKERS = 2
+  UPLOAD_RETRIES = 3
+  UPLOAD_RETRY_DELAY = 1
+  UPLOAD_SPOOL_DIR = os.environ.get('UPLOAD_SPOOL_DIR') or \
+      os.path.join(tempfile.gettempdir(), 'tradyfit-uploads')
+
+  #images are copied between the request, the spool, the avatar downloads
+  #and the storage in chunks of this size (bytes). Downloads are kept in
+  #memory up to UPLOAD_SPOOL_MEMORY, in a temporary file past it
+  UPLOAD_CHUNK_SIZE = 64 * 1024
+  UPLOAD_SPOOL_MEMORY = 512 * 1024
+
+  #seconds to wait for an image host (e.g. Facebook avatars) to connect or
+  #send data
+  HTTP_TIMEOUT = 10
+
+  #widths (px) of the renditions stored for each uploaded image, the full
+  #one keeps the uploaded filename. With IMAGE_WEBP a WebP variant of each
+  #one is stored too (if Pillow supports it)
+  IMAGE_RENDITIONS = (('thumb', 320), ('medium', 640), ('full', 1280))
+  AVATAR_RENDITIONS = (('thumb', 64), ('medium', 128), ('full', 256))
+  IMAGE_WEBP = True
+  #images with more pixels are rejected before decoding them
+  IMAGE_MAX_PIXELS = 6000 * 6000
+
+  #images storage: "s3" or "local" (files under IMAGE_STORAGE_DIR)
+  IMAGE_STORAGE = 's3'
+  IMAGE_STORAGE_DIR = None
+
+  #MAX IMAGE SIZE ALLOWED 3MB (uploads and downloaded avatars)
   MAX_CONTENT_LENGTH = 3 * 1024 * 1024
 
 
@@ -65,6 +165,19 @@ class TestingConfig(Config):
   #AWS S3
   S3_BUCKET = 'tradyfitbucket.test'
 
+  #max database queries a list page can run (see assert_max_queries)
+  PAGE_QUERY_BUDGET = 10
+
+  #last_seen pings are only written by explicit flushes
+  LAST_SEEN_FLUSH_SIZE = None
+  LAST_SEEN_FLUSH_INTERVAL = None
+
+  #item images are uploaded in the request to a local directory
+  UPLOAD_WORKERS = 0
+  UPLOAD_RETRY_DELAY = 0
+  IMAGE_STORAGE = 'local'
+  IMAGE_STORAGE_DIR = os.path.join(tempfile.gettempdir(), 'tradyfit-images')
+
   #FB Test users credentials
   FB_TEST_ID = os.environ.get('FB_TEST_ID')
   FB_TEST_EMAIL = os.environ.get('FB_TEST_EMAIL')
@@ -7,7 +7,7 @@ if os.environ.get('FLASK_COVERAGE'):
   COV = coverage.coverage(branch=True, include='app/*')
   COV.start()
 
-from app import create_app, db
+from app import create_app, db, image_uploader
 from app.models import Category, Item, User, Message
 from flask.ext.script import Manager, Shell
 from flask.ext.migrate import Migrate, MigrateCommand
@@ -61,6 +61,26 @@ def acceptance_test():
   unittest.TextTestRunner(verbosity=2).run(tests)
 
 
+@manager.command
+def benchmark(name):
+  """Run a benchmark from the benchmarks package against the database."""
+  import importlib
+  importlib.import_module('benchmarks.' + name).run()
+
+
+@manager.command
+def repair_unread_counts():
+  """Recompute the users unread messages counters."""
+  print('Users repaired: {0}'.format(User.repair_unread_counts()))
+
+
+@manager.command
+def resume_uploads():
+  """Upload the spooled images and import the avatars still pending."""
+  print('Uploads resumed: {0}'.format(image_uploader.resume()))
+  image_uploader.join()
+
+
 @manager.command
 def deploy():
   """Run deployment tasks."""
@@ -0,0 +1,27 @@
+"""added composite indexes to messages
+
+Revision ID: 1f6a9c3e8b42
+Revises: 4b8e2d6f1a57
+Create Date: 2026-10-18 13:31:09.204817
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1f6a9c3e8b42'
+down_revision = '4b8e2d6f1a57'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_messages_receiver_unread_timestamp', 'messages',
+                    ['receiver_id', 'unread', 'timestamp'], unique=False)
+    op.create_index('ix_messages_sender_timestamp', 'messages',
+                    ['sender_id', 'timestamp'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_messages_sender_timestamp', table_name='messages')
+    op.drop_index('ix_messages_receiver_unread_timestamp',
+                  table_name='messages')
@@ -0,0 +1,27 @@
+"""added image_previous to items
+
+Revision ID: 2b7d9e4f6a31
+Revises: 5e8b2d7c4a19
+Create Date: 2026-10-18 18:12:37.104528
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2b7d9e4f6a31'
+down_revision = '5e8b2d7c4a19'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('items', sa.Column('image_previous', sa.String(),
+                                     nullable=True))
+    op.add_column('items', sa.Column('image_previous_renditions',
+                                     sa.SmallInteger(), server_default='0',
+                                     nullable=False))
+
+
+def downgrade():
+    op.drop_column('items', 'image_previous_renditions')
+    op.drop_column('items', 'image_previous')
@@ -0,0 +1,23 @@
+"""added image_pending to items
+
+Revision ID: 2b9d4e7a6c31
+Revises: 8a3f6c1d2e47
+Create Date: 2026-10-18 17:14:52.306718
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2b9d4e7a6c31'
+down_revision = '8a3f6c1d2e47'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('items', sa.Column('image_pending', sa.Boolean(),
+                                     server_default='false', nullable=False))
+
+
+def downgrade():
+    op.drop_column('items', 'image_pending')
@@ -0,0 +1,25 @@
+"""added trigram index to item names for suggestions
+
+Revision ID: 2f4c8d1e6a93
+Revises: 3a9e5b2c7f10
+Create Date: 2026-10-18 11:02:17.530118
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2f4c8d1e6a93'
+down_revision = '3a9e5b2c7f10'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_items_name_trgm', 'items', ['name'], unique=False,
+                    postgresql_using='gin',
+                    postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_items_name_trgm', table_name='items')
@@ -0,0 +1,40 @@
+"""weighted search vector trigger: item name above description
+
+Revision ID: 3a9e5b2c7f10
+Revises: 2496c486b030
+Create Date: 2026-10-18 10:12:41.215342
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3a9e5b2c7f10'
+down_revision = '2496c486b030'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy_searchable import sync_trigger
+
+
+def upgrade():
+    conn = op.get_bind()
+    # replace the function created by sqlalchemy-searchable, the trigger
+    # items_search_vector_trigger keeps calling it by name
+    op.execute("""
+    CREATE OR REPLACE FUNCTION items_search_vector_update() RETURNS TRIGGER AS $$
+    BEGIN
+      NEW.search_vector =
+        setweight(to_tsvector('pg_catalog.english', regexp_replace(
+          coalesce(NEW.name, ''), '[-@.]', ' ', 'g')), 'A') ||
+        setweight(to_tsvector('pg_catalog.english', regexp_replace(
+          coalesce(NEW.description, ''), '[-@.]', ' ', 'g')), 'B');
+      RETURN NEW;
+    END
+    $$ LANGUAGE 'plpgsql';
+    """)
+    # rebuild the search vector of the existing items
+    conn.execute(sa.text('UPDATE items SET name = name'))
+
+
+def downgrade():
+    conn = op.get_bind()
+    sync_trigger(conn, 'items', 'search_vector', ['name', 'description'])
@@ -0,0 +1,26 @@
+"""added username_counters table
+
+Revision ID: 3e7d1b9c5a28
+Revises: 6c2e8a4d9f15
+Create Date: 2026-10-18 15:12:37.048215
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3e7d1b9c5a28'
+down_revision = '6c2e8a4d9f15'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('username_counters',
+    sa.Column('base', sa.String(length=64), nullable=False),
+    sa.Column('last', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('base')
+    )
+
+
+def downgrade():
+    op.drop_table('username_counters')
@@ -0,0 +1,27 @@
+"""added unread_count to users
+
+Revision ID: 4b8e2d6f1a57
+Revises: 5d7b1f3a9c24
+Create Date: 2026-10-18 13:02:41.517390
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4b8e2d6f1a57'
+down_revision = '5d7b1f3a9c24'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('users', sa.Column('unread_count', sa.Integer(),
+                  server_default='0', nullable=False))
+    # initial values, afterwards they are kept by the Message events
+    op.execute('UPDATE users SET unread_count = (SELECT count(*) '
+               'FROM messages WHERE messages.receiver_id = users.id '
+               'AND messages.unread)')
+
+
+def downgrade():
+    op.drop_column('users', 'unread_count')
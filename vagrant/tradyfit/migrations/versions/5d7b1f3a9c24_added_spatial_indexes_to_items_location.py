@@ -0,0 +1,29 @@
+"""added spatial indexes to items location
+
+Revision ID: 5d7b1f3a9c24
+Revises: 2f4c8d1e6a93
+Create Date: 2026-10-18 12:20:05.881472
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5d7b1f3a9c24'
+down_revision = '2f4c8d1e6a93'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # GiST index used by KNN (<->) ordering, same name geoalchemy2 gives
+    # to the index it creates with the table
+    op.create_index('idx_items_location', 'items', ['location'],
+                    unique=False, postgresql_using='gist')
+    # GiST index for radius queries (ST_DWithin) on geography
+    op.execute('CREATE INDEX ix_items_location_geography ON items '
+               'USING gist (geography(location))')
+
+
+def downgrade():
+    op.drop_index('ix_items_location_geography', table_name='items')
+    op.drop_index('idx_items_location', table_name='items')
@@ -0,0 +1,23 @@
+"""added avatar_source to users
+
+Revision ID: 5e8b2d7c4a19
+Revises: 9c4f1a7e3b52
+Create Date: 2026-10-18 17:41:09.772316
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5e8b2d7c4a19'
+down_revision = '9c4f1a7e3b52'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('users', sa.Column('avatar_source', sa.Text(),
+                                     nullable=True))
+
+
+def downgrade():
+    op.drop_column('users', 'avatar_source')
@@ -0,0 +1,27 @@
+"""added versions table
+
+Revision ID: 6c2e8a4d9f15
+Revises: 1f6a9c3e8b42
+Create Date: 2026-10-18 14:05:52.330128
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6c2e8a4d9f15'
+down_revision = '1f6a9c3e8b42'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('versions',
+    sa.Column('name', sa.String(length=32), nullable=False),
+    sa.Column('value', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.execute("INSERT INTO versions (name, value) VALUES ('categories', 1)")
+
+
+def downgrade():
+    op.drop_table('versions')
@@ -0,0 +1,27 @@
+"""added composite timestamp, id index to items
+
+Revision ID: 6d1e8a3f5b27
+Revises: 2b7d9e4f6a31
+Create Date: 2026-10-18 18:47:15.392810
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6d1e8a3f5b27'
+down_revision = '2b7d9e4f6a31'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    #replaces the timestamp index, (timestamp, id) serves the same queries
+    op.create_index('ix_items_timestamp_id', 'items', ['timestamp', 'id'],
+                    unique=False)
+    op.drop_index('ix_items_timestamp', table_name='items')
+
+
+def downgrade():
+    op.create_index('ix_items_timestamp', 'items', ['timestamp'],
+                    unique=False)
+    op.drop_index('ix_items_timestamp_id', table_name='items')
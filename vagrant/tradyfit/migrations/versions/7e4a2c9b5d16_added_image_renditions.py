@@ -0,0 +1,26 @@
+"""added image and avatar renditions
+
+Revision ID: 7e4a2c9b5d16
+Revises: 2b9d4e7a6c31
+Create Date: 2026-10-18 18:26:07.914352
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7e4a2c9b5d16'
+down_revision = '2b9d4e7a6c31'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('items', sa.Column('image_renditions', sa.SmallInteger(),
+                                     server_default='0', nullable=False))
+    op.add_column('users', sa.Column('avatar_renditions', sa.SmallInteger(),
+                                     server_default='0', nullable=False))
+
+
+def downgrade():
+    op.drop_column('users', 'avatar_renditions')
+    op.drop_column('items', 'image_renditions')
@@ -0,0 +1,31 @@
+"""added indexes for the admin lists
+
+Revision ID: 8a3f6c1d2e47
+Revises: 3e7d1b9c5a28
+Create Date: 2026-10-18 16:02:41.583106
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8a3f6c1d2e47'
+down_revision = '3e7d1b9c5a28'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_users_last_seen_id', 'users', ['last_seen', 'id'],
+                    unique=False)
+    op.execute('CREATE INDEX ix_items_updated_id ON items '
+               '(coalesce(modified, timestamp), id)')
+    op.create_index('ix_items_user_id', 'items', ['user_id'], unique=False)
+    op.create_index('ix_messages_item_id', 'messages', ['item_id'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_messages_item_id', table_name='messages')
+    op.drop_index('ix_items_user_id', table_name='items')
+    op.drop_index('ix_items_updated_id', table_name='items')
+    op.drop_index('ix_users_last_seen_id', table_name='users')
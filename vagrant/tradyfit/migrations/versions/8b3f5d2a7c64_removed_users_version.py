@@ -0,0 +1,23 @@
+"""removed users version
+
+Revision ID: 8b3f5d2a7c64
+Revises: 6d1e8a3f5b27
+Create Date: 2026-10-18 19:21:06.448917
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8b3f5d2a7c64'
+down_revision = '6d1e8a3f5b27'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    #the cached users are invalidated per user, not with a global stamp
+    op.execute("DELETE FROM versions WHERE name = 'users'")
+
+
+def downgrade():
+    op.execute("INSERT INTO versions (name, value) VALUES ('users', 1)")
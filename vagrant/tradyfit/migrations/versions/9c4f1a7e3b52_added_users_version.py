@@ -0,0 +1,22 @@
+"""added users version
+
+Revision ID: 9c4f1a7e3b52
+Revises: 7e4a2c9b5d16
+Create Date: 2026-10-18 17:02:41.518203
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9c4f1a7e3b52'
+down_revision = '7e4a2c9b5d16'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.execute("INSERT INTO versions (name, value) VALUES ('users', 1)")
+
+
+def downgrade():
+    op.execute("DELETE FROM versions WHERE name = 'users'")
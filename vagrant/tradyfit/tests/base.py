@@ -1,9 +1,22 @@
 # -*- coding: utf-8 -*-
+import os
 import unittest
+from contextlib import contextmanager
 from flask import url_for
-from app import create_app, db
+from flask.ext.sqlalchemy import get_debug_queries
+from app import create_app, db, search_cache, suggest_cache, tile_cache, \
+user_cache, fragment_cache, last_seen_buffer
 from app.models import Category, User, Item, Message
 
+#a jpg image to upload in the forms
+TEST_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'unit',
+                          'test_avatar.jpg')
+
+
+def image_data():
+  with open(TEST_IMAGE, 'rb') as f:
+    return f.read()
+
 
 class BasicTestCase(unittest.TestCase):
 
@@ -22,6 +35,13 @@ class UnitTestCase(BasicTestCase):
     super(UnitTestCase, self).setUp()
     db.create_all()
     Category.insert_categories()
+    #in-process caches could keep results from previous tests
+    search_cache.clear()
+    suggest_cache.clear()
+    tile_cache.clear()
+    user_cache.clear()
+    fragment_cache.clear()
+    last_seen_buffer.clear()
 
   def tearDown(self):
     db.session.remove()
@@ -103,6 +123,19 @@ class ClientTestCase(UnitTestCase):
         sess['_fresh'] = True
       return c.get(url_for(url), follow_redirects=True)
 
+  @contextmanager
+  def assert_max_queries(self, budget=None):
+    '''fail if the requests made inside the block run more database queries
+    than budget (PAGE_QUERY_BUDGET by default). Flask-SQLAlchemy records
+    the queries of the app context when testing'''
+    budget = budget or self.app.config['PAGE_QUERY_BUDGET']
+    start = len(get_debug_queries())
+    yield
+    queries = get_debug_queries()[start:]
+    self.assertTrue(len(queries) <= budget,
+                    '{0} queries, the budget is {1}:\n{2}'.format(len(queries),
+                    budget, '\n'.join(q.statement for q in queries)))
+
   def make_get_localhost_request(self, url, headers):
     '''make a get request with localhost address to avoid API rate limit'''
     return self.client.get(url, headers=headers,
@@ -3,12 +3,42 @@ import re
 from bs4 import BeautifulSoup
 from flask import url_for
 from base import ClientTestCase
+from app import db
 from app.models import Category
 import app.main.views
 
 
 class CategoriesIntegrationTestCase(ClientTestCase):
 
+  def create_items_many_users(self, n=12):
+    '''create n cycling items, each one from a different user'''
+    for i in range(n):
+      u = self.create_user_location(str(i + 10), 'u{0}@example.com'.format(i),
+                                    'user{0}'.format(i))
+      self.create_item_location(u, 'bike {0}'.format(i))
+    #forget the loaded objects as a new request would do
+    db.session.expire_all()
+
+
+  def test_categories_query_budget(self):
+    '''verify the categories page doesn't lazy load the category and user
+    of each item'''
+    self.create_items_many_users()
+    with self.assert_max_queries():
+      response = self.client.get(url_for('main.categories'))
+    self.assertTrue(len(re.findall('id="item-', response.data)) == 12)
+
+
+  def test_category_query_budget(self):
+    '''verify the category page doesn't lazy load the category and user
+    of each item'''
+    self.create_items_many_users()
+    category = Category.get_category('cycling')
+    with self.assert_max_queries():
+      response = self.client.get(url_for('main.category', id=category.id))
+    self.assertTrue(len(re.findall('id="item-', response.data)) == 12)
+
+
   def test_categories_nologin(self):
     '''verify that items are shown ordered by time creation if
     user is not logged in
@@ -120,3 +150,30 @@ class CategoryIntegrationTestCase(ClientTestCase):
       self.assertTrue("item-"+str(item_berlin.id) in str(items[1]))
 
 
+
+
+  def test_category_next_page(self):
+    '''verify that items not shown in the first page of a category are
+    reachable with the next page link
+    1. Create ITEMS_PER_PAGE + 1 soccer items
+    2. Go to the soccer's category page and follow the next page link
+    3. Check the oldest item is the only one on the second page
+    '''
+    u = self.create_user()
+    category = Category.get_category('soccer')
+    first = self.create_item(u.id)
+    for _ in range(self.app.config['ITEMS_PER_PAGE']):
+      self.create_item(u.id)
+
+    response = self.client.get(url_for('main.category', id=category.id))
+    soup = BeautifulSoup(response.get_data(as_text=True))
+    items = soup.find_all("div", id=re.compile("^item-"))
+    self.assertTrue(len(items) == self.app.config['ITEMS_PER_PAGE'])
+    next_url = soup.find("a", id="next-page")['href']
+
+    response = self.client.get(next_url)
+    soup = BeautifulSoup(response.get_data(as_text=True))
+    items = soup.find_all("div", id=re.compile("^item-"))
+    self.assertTrue(len(items) == 1)
+    self.assertTrue("item-"+str(first.id) in str(items[0]))
+    self.assertTrue(soup.find("a", id="next-page") is None)
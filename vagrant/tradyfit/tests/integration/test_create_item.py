@@ -2,8 +2,8 @@
 from StringIO import StringIO
 from mock import patch
 from flask import current_app, url_for
-from base import ClientTestCase
-from app import db
+from base import ClientTestCase, image_data
+from app import db, image_uploader
 from app.models import Item, Category
 import app.main.views
 
@@ -12,7 +12,7 @@ class CreateItemIntegrationTestCase(ClientTestCase):
 
   def post_req_item_create(self, user, image=None):
     if image:
-      image = (StringIO('contents'), image)
+      image = (StringIO(image_data()), image)
 
     with self.client as c:
       with c.session_transaction() as sess:
@@ -28,20 +28,23 @@ class CreateItemIntegrationTestCase(ClientTestCase):
                                   'image': image
                               }, follow_redirects=True)
 
-  @patch('app.main.views.save_item_image', return_value='image.jpg')
-  def test_create_item(self, mock):
+  def test_create_item(self):
     '''verify an item can be correctly created
     1. Go to the create an item's page
     2. Field in the form with a happy case
     3. Verify you are redirected to home page and the item is present
+    4. Verify the image was uploaded after the item was created
     '''
     u = self.create_user()
     resp = self.post_req_item_create(u, 'image.jpg')
     self.assertTrue('Your item has been created' in resp.data)
     self.assertTrue('plain ball' in resp.data)
+    item = Item.query.filter_by(name='soccer ball').one()
+    self.assertFalse(item.image_pending)
+    self.assertTrue(item.image_url in resp.data)
 
 
-  @patch('app.main.views.save_item_image', return_value=None)
+  @patch.object(image_uploader, 'spool', return_value=None)
   def test_create_item_image_problem(self, mock):
     '''verify an item will not be created if fails uploading the image
     1. Go to the create an item's page
@@ -3,6 +3,8 @@ import re
 from bs4 import BeautifulSoup
 from flask import url_for
 from base import ClientTestCase
+from app import db, fragment_cache
+from app.images import RENDITIONS_WEBP
 import app.main.views
 
 
@@ -96,3 +98,29 @@ class IndexIntegrationTestCase(ClientTestCase):
     items = soup.find_all("div", id=re.compile("^item-"))
     self.assertTrue(not items)
 
+
+
+  def test_item_box_cache(self):
+    '''verify the item boxes are rendered once and an updated item is
+    rendered again'''
+    u = self.create_user()
+    item = self.create_item(u.id, 'tri suit', 'black and blue')
+    self.client.get(url_for('main.index'))
+    self.client.get(url_for('main.index'))
+    self.assertEqual(fragment_cache.stats['hits'], 1)
+    item.name = 'wetsuit'
+    db.session.commit()
+    resp = self.client.get(url_for('main.index')).get_data(as_text=True)
+    self.assertTrue('Wetsuit' in resp)
+    self.assertFalse('Tri suit' in resp)
+
+  def test_item_box_cache_renditions(self):
+    '''verify the item box is rendered again once the renditions of the
+    user avatar are stored'''
+    u = self.create_user()
+    self.create_item(u.id, 'tri suit', 'black and blue')
+    self.client.get(url_for('main.index'))
+    u.avatar_renditions = RENDITIONS_WEBP
+    db.session.commit()
+    self.client.get(url_for('main.index'))
+    self.assertEqual(fragment_cache.stats['hits'], 0)
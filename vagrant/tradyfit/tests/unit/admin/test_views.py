@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
+import re
 from flask import url_for
 from base import ClientTestCase
+from app import db
+from app.models import User
 import app.admin.views
 
 
@@ -32,6 +35,72 @@ class IndexViewTestCase(ClientTestCase):
     self.assertTrue('id="users"' in r)
 
 
+  def test_index_admin_revoked(self):
+    '''verify a revoked admin flag is enforced even if the logged in user
+    is a cached snapshot (e.g. revoked by another process)'''
+    user = self.create_user()
+    user.is_admin = True
+    db.session.commit()
+    response = self.make_get_request(user, 'admin.index')
+    self.assertTrue('Admin Panel' in response.get_data(as_text=True))
+    users = User.__table__
+    with db.engine.begin() as connection:
+      connection.execute(users.update().where(users.c.id == user.id).values(
+                        is_admin=False))
+    response = self.make_get_request(user, 'admin.index')
+    self.assertFalse('Admin Panel' in response.get_data(as_text=True))
+
+  def test_index_counts(self):
+    '''verify the items and messages counts of each user are shown and
+    they are not queried per user: the page has more users than the query
+    budget'''
+    user = self.create_user()
+    user.is_admin = True
+    other = self.create_user_no_location()
+    item = self.create_item(other.id)
+    self.create_message(user.id, other.id, item.id)
+    self.create_message(user.id, other.id, item.id)
+    for i in range(self.app.config['PAGE_QUERY_BUDGET']):
+      extra = self.create_user_no_location('extra{0}'.format(i),
+                'extra{0}@example.com'.format(i), 'extra{0}'.format(i))
+      self.create_item(extra.id)
+    with self.assert_max_queries():
+      response = self.make_get_request(user, 'admin.index')
+    r = response.get_data(as_text=True)
+    lisa = r[r.index('id="user-{0}"'.format(user.id)):]
+    john = r[r.index('id="user-{0}"'.format(other.id)):]
+    self.assertTrue('Items: 0' in lisa and 'Send messages: 2' in lisa)
+    self.assertTrue('Items: 1' in john and 'Received messages: 2' in john)
+    self.assertEqual(r.count('Items: 1'),
+                    self.app.config['PAGE_QUERY_BUDGET'] + 1)
+
+  def test_index_total_small_table(self):
+    '''verify the total of a table too small to be estimated (never
+    analyzed) is counted'''
+    user = self.create_user()
+    user.is_admin = True
+    self.create_user_no_location()
+    response = self.make_get_request(user, 'admin.index')
+    self.assertTrue('~2<' in response.get_data(as_text=True))
+
+
+  def test_index_pagination(self):
+    '''verify the users are paginated last seen first'''
+    self.app.config['ADMIN_PER_PAGE'] = 1
+    user = self.create_user()
+    user.is_admin = True
+    other = self.create_user_no_location()
+    response = self.make_get_request(user, 'admin.index')
+    r = response.get_data(as_text=True)
+    self.assertTrue('id="user-{0}"'.format(other.id) in r)
+    self.assertFalse('id="user-{0}"'.format(user.id) in r)
+    next_page = re.search('id="next-page" href="([^"]+)"', r).group(1)
+    response = self.client.get(next_page.replace('&amp;', '&'))
+    r = response.get_data(as_text=True)
+    self.assertTrue('id="user-{0}"'.format(user.id) in r)
+    self.assertFalse('id="next-page"' in r)
+
+
 class ItemsViewTestCase(ClientTestCase):
   '''Testing: @admin.route('/items')'''
 
@@ -60,4 +129,34 @@ class ItemsViewTestCase(ClientTestCase):
     self.assertTrue('id="items"' in r)
 
 
+  def test_items_pagination(self):
+    '''verify the items are paginated last modified first with their
+    messages count'''
+    self.app.config['ADMIN_PER_PAGE'] = 1
+    user = self.create_user()
+    user.is_admin = True
+    old = self.create_item(user.id, item_name='bike')
+    new = self.create_item(user.id)
+    self.create_message(user.id, user.id, old.id)
+    response = self.make_get_request(user, 'admin.items')
+    r = response.get_data(as_text=True)
+    self.assertTrue('id="item-{0}"'.format(new.id) in r)
+    self.assertTrue('Messages: 0' in r)
+    next_page = re.search('id="next-page" href="([^"]+)"', r).group(1)
+    response = self.client.get(next_page.replace('&amp;', '&'))
+    r = response.get_data(as_text=True)
+    self.assertTrue('id="item-{0}"'.format(old.id) in r)
+    self.assertTrue('Messages: 1' in r)
+
+
+class CachesViewTestCase(ClientTestCase):
+  '''Testing: @admin.route('/caches')'''
 
+  def test_caches_admin_user(self):
+    '''verify the admin user can see the caches hit rates'''
+    user = self.create_user()
+    user.is_admin = True
+    response = self.make_get_request(user, 'admin.caches')
+    r = response.get_data(as_text=True)
+    self.assertTrue('Admin Panel - Caches' in r)
+    self.assertTrue('Hit rate' in r)
@@ -1,11 +1,12 @@
 # -*- coding: utf-8 -*-
+import threading
 from mock import Mock, PropertyMock, patch
 from flask import url_for, session
 from flask_oauthlib.client import OAuthException
 from app.models import User
 from base import ClientTestCase
 from app.auth.views import facebook
-from app import helpers
+from app import image_uploader
 from datetime import datetime, timedelta
 
 
@@ -52,8 +53,9 @@ class FBLoginTestCase(ClientTestCase):
                                               'email': 'john@testing.com',
                                               'name': 'John Doe',
                                               'gender': 'male',
-                                              'data': {
-                                                'url': 'http://test-image.png' }
+                                              'picture': {'data': {
+                                                'url': 'http://test-image.png',
+                                                'is_silhouette': False}}
                                             })
     return mock_fb_info
 
@@ -71,23 +73,102 @@ class FBLoginTestCase(ClientTestCase):
     1. Create mock objects
     2. Verfiy user does not exist in the DB
     3. Call the login method
-    4. Verify the user has been created and it is redirected to index'''
+    4. Verify the user has been created with the default avatar, its
+    avatar import queued and it is redirected to index'''
 
     mock_fb_resp = FBLoginTestCase.mock_facebook_auth()
     mock_fb_info = FBLoginTestCase.mock_facebook_info()
 
-    mock_save_avatar = Mock(name='save_avatar')
-    mock_save_avatar.return_value = 'testimage.jpg'
+    mock_enqueue_avatar = Mock(name='enqueue_avatar')
 
     self.assertTrue(User.get_user('john@testing.com') is None)
 
     with patch.object(facebook, 'authorized_response', mock_fb_resp):
       with patch.object(facebook, 'get', mock_fb_info):
-        with patch.object(helpers, 'save_avatar', mock_save_avatar):
+        with patch.object(image_uploader, 'enqueue_avatar',
+                          mock_enqueue_avatar):
           resp = self.client.get(url_for('auth.facebook_authorized'),
                                   follow_redirects=True)
-          self.assertTrue(isinstance(User.get_user('john@testing.com'), User))
+          user = User.get_user('john@testing.com')
+          self.assertTrue(isinstance(user, User))
           self.assertTrue('john' in resp.get_data(as_text=True))
+    self.assertEqual(user.avatar_url, self.app.config['DEFAULT_AVATAR'])
+    self.assertEqual(user.avatar_source, 'http://test-image.png')
+    mock_enqueue_avatar.assert_called_once_with(user.id,
+                                                'http://test-image.png')
+    #a single Graph API call
+    self.assertEqual(mock_fb_info.call_count, 1)
+
+  def test_login_user_fb_silhouette(self):
+    '''verify the avatar isn't imported if the user has no facebook
+    picture'''
+    mock_fb_info = Mock(return_value=Mock(data={'id': '12908098',
+                    'email': 'john@testing.com', 'name': 'John Doe',
+                    'picture': {'data': {'url': 'http://silhouette.png',
+                                          'is_silhouette': True}}}))
+    mock_enqueue_avatar = Mock(name='enqueue_avatar')
+    with patch.object(facebook, 'authorized_response',
+                      FBLoginTestCase.mock_facebook_auth()):
+      with patch.object(facebook, 'get', mock_fb_info):
+        with patch.object(image_uploader, 'enqueue_avatar',
+                          mock_enqueue_avatar):
+          self.client.get(url_for('auth.facebook_authorized'))
+    user = User.get_user('john@testing.com')
+    self.assertTrue(user is not None)
+    self.assertTrue(user.avatar_source is None)
+    self.assertFalse(mock_enqueue_avatar.called)
+
+  def signup_in_parallel(self, n, mock_fb_info):
+    '''request the facebook_authorized view from n threads at the same time,
+    each one with its own client, app context and db session'''
+    url = url_for('auth.facebook_authorized')
+    start = threading.Event()
+    responses = []
+
+    def signup():
+      client = self.app.test_client()
+      start.wait()
+      responses.append(client.get(url).status_code)
+
+    mock_enqueue_avatar = Mock(name='enqueue_avatar')
+    with patch.object(facebook, 'authorized_response',
+                      FBLoginTestCase.mock_facebook_auth()):
+      with patch.object(facebook, 'get', mock_fb_info):
+        with patch.object(image_uploader, 'enqueue_avatar',
+                          mock_enqueue_avatar):
+          threads = [threading.Thread(target=signup, name='signup-%d' % i)
+                      for i in range(n)]
+          for t in threads:
+            t.start()
+          start.set()
+          for t in threads:
+            t.join()
+    return responses
+
+  def test_concurrent_signups(self):
+    '''verify parallel signups of different users with the same email name
+    get different usernames'''
+
+    def fb_info(url): # pylint: disable=W0613
+      i = threading.current_thread().name.split('-')[1]
+      return Mock(data={'id': '1290' + i, 'email': 'john@testing%s.com' % i,
+                        'name': 'John Doe', 'gender': 'male',
+                        'picture': {'data': {'url': 'http://test-image.png'}}})
+
+    responses = self.signup_in_parallel(6, Mock(side_effect=fb_info))
+    self.assertEqual(responses, [302] * 6)
+    usernames = [u.username for u in User.query.all()]
+    self.assertEqual(len(usernames), 6)
+    self.assertEqual(set(usernames),
+                    set(['john'] + ['john%d' % i for i in range(2, 7)]))
+
+  def test_concurrent_signups_same_user(self):
+    '''verify parallel logins of a new user create it only once'''
+    responses = self.signup_in_parallel(4,
+                                        FBLoginTestCase.mock_facebook_info())
+    self.assertEqual(responses, [302] * 4)
+    self.assertEqual(User.query.filter_by(email='john@testing.com').count(),
+                    1)
 
   def test_already_login_user_fb_auth(self):
     '''if user is already authenticated verify it is redirected
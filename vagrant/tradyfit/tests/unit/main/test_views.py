@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
+import os
 from bs4 import BeautifulSoup
 from StringIO import StringIO
 from mock import patch
 from flask import url_for
+from app import image_uploader
 from app.models import Category, Item
-from base import ClientTestCase
+from app.storage import get_storage
+from base import ClientTestCase, image_data
 import app.main.views
 
 
@@ -212,7 +215,7 @@ class ItemViewTestCase(ClientTestCase):
 
 def form_data(item, image=None):
   if image:
-    image = (StringIO('contents'), image)
+    image = (StringIO(image_data()), image)
   return {
           'name': item.name,
           'description': item.description,
@@ -278,11 +281,9 @@ class EditItemViewTestCase(ClientTestCase):
       self.assertTrue(b'Your item has been updated.' in resp.data)
       self.assertTrue(item.description in resp.data)
 
-  @patch('app.main.views.save_item_image', return_value='new_s3_img.jpg')
-  @patch('app.main.views.delete_item_image', return_value=True)
-  def test_edit_form_image_change(self, mock_save_image, mock_delete_image):
+  def test_edit_form_image_change(self):
     '''verify that an item can be edit and it's updated correctly
-    with new image'''
+    with new image, uploaded after the item is saved'''
 
     u = self.create_user()
     item = self.create_item(u.id)
@@ -296,12 +297,41 @@ class EditItemViewTestCase(ClientTestCase):
                                 follow_redirects=True)
       self.assertTrue(b'Your item has been updated.' in resp.data)
       self.assertTrue(item.description in resp.data)
-      self.assertTrue(mock_delete_image.called_with('image.jpg'))
+    item = Item.query.get(item.id)
+    self.assertFalse(item.image_pending)
+    self.assertTrue(item.image_url.endswith('.jpg'))
+    self.assertTrue(item.image_url in resp.data)
+    storage = get_storage()
+    self.assertTrue(os.path.exists(storage.path('S3_UPLOAD_ITEM_DIR',
+                                                item.image_url)))
+
+  def test_edit_form_image_change_pending(self):
+    '''verify that an item edited again while its new image is still
+    pending keeps the image it had before both edits as previous one'''
 
-  @patch('app.main.views.save_item_image', return_value=None)
-  def test_edit_form_image_change_fail(self, mock_save_image):
+    u = self.create_user()
+    item = self.create_item(u.id)
+
+    with self.client as c:
+      with c.session_transaction() as sess:
+        sess['user_id'] = u.id
+        sess['_fresh'] = True
+      with patch.object(image_uploader, 'enqueue'):
+        self.client.post(url_for('main.edit', id=item.id),
+                        data=form_data(item, 'new_image.jpg'))
+      self.assertEqual(Item.query.get(item.id).image_previous, 'ball.jpg')
+      with patch.object(image_uploader, 'enqueue') as mock_enqueue:
+        self.client.post(url_for('main.edit', id=item.id),
+                        data=form_data(item, 'other_image.jpg'))
+    item = Item.query.get(item.id)
+    self.assertTrue(item.image_pending)
+    self.assertEqual(item.image_previous, 'ball.jpg')
+    mock_enqueue.assert_called_once_with(item.id, item.image_url)
+
+  @patch.object(image_uploader, 'spool', return_value=None)
+  def test_edit_form_image_change_fail(self, mock_spool):
     '''verify that an item can be edit and it is not updated if there
-    is a problem uploading the new image'''
+    is a problem storing the new image'''
 
     u = self.create_user()
     item = self.create_item(u.id)
@@ -317,11 +347,10 @@ class EditItemViewTestCase(ClientTestCase):
                       in resp.data)
       self.assertTrue(item.image_url in resp.data) #old image still in item
 
-  @patch('app.main.views.save_item_image', return_value='new_s3_img.jpg')
-  @patch('app.main.views.delete_item_image', return_value=False)
-  def test_edit_form_image_delete_fail(self, mock_save_item, mock_delete_image):
-    '''verify that an item can be edit and it's not updated if
-    there is an error deleting the images'''
+  @patch('app.storage.LocalStorage.save', return_value=False)
+  def test_edit_form_image_upload_fail(self, mock_save):
+    '''verify that the item keeps its previous image if the new one can't
+    be uploaded after the retries'''
 
     u = self.create_user()
     item = self.create_item(u.id)
@@ -333,9 +362,11 @@ class EditItemViewTestCase(ClientTestCase):
       resp = self.client.post(url_for('main.edit', id=item.id),
                               data=form_data(item, 'new_image.jpg'),
                               follow_redirects=True)
-      self.assertTrue(b'Sorry, there was an error updating your item.' in
-                      resp.data)
-      self.assertTrue(item.image_url in resp.data) #old image still in item
+      self.assertTrue(b'Your item has been updated.' in resp.data)
+    self.assertEqual(mock_save.call_count, self.app.config['UPLOAD_RETRIES'])
+    item = Item.query.get(item.id)
+    self.assertEqual(item.image_url, 'ball.jpg') #old image still in item
+    self.assertFalse(item.image_pending)
 
 
 class DeleteItemViewTestCase(ClientTestCase):
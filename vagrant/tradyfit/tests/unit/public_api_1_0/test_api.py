@@ -87,6 +87,179 @@ class APITestCase(ClientTestCase):
     json_response = json.loads(response.data.decode('utf-8'))
     self.assertTrue(len(json_response['items']) == 2)
     self.assertTrue(json_response['items'][0]['name'] == item3.name)
+    self.assertTrue(json_response['facets']['category'] ==
+                    [{'value': 'cycling', 'count': 2}])
+
+
+  def test_get_items_ranked_search(self):
+    '''testing @public_api.route('/items/search/<search>?order=relevance')
+    Verify the item matching the query on its name comes first'''
+
+    user = self.create_user_location()
+    item1 = self.create_item(user.id, 'blue bike', 'red')
+    item2 = self.create_item(user.id, 'tri bike', 'blue print', 'cycling')
+    response = self.make_get_localhost_request(
+                'public-api/v1.0/items/search/blue bike?order=relevance',
+                self.get_api_headers())
+    self.assertTrue(response.status_code == 200)
+    json_response = json.loads(response.data.decode('utf-8'))
+    self.assertTrue(len(json_response['items']) == 2)
+    self.assertTrue(json_response['items'][0]['name'] == item1.name)
+
+
+  def test_get_items_search_batch(self):
+    '''testing @public_api.route('/items/search', methods=['POST'])
+    1. Create 3 items
+    2. Send two searches in the same request
+    3. Verify the items of each search are returned keyed by query'''
+
+    user = self.create_user_location()
+    self.create_item(user.id)
+    item1 = self.create_item(user.id, 'bike', 'blue and red', 'cycling')
+    item2 = self.create_item(user.id, 'tri bike', 'blue print', 'cycling')
+    response = self.client.post('public-api/v1.0/items/search',
+                data=json.dumps({'queries': ['blue bike', 'tri bike']}),
+                headers=self.get_api_headers(),
+                environ_base={'REMOTE_ADDR': '127.0.0.1'})
+    self.assertTrue(response.status_code == 200)
+    results = json.loads(response.data.decode('utf-8'))['results']
+    self.assertTrue([i['id'] for i in results['blue bike']] ==
+                    [item2.id, item1.id])
+    self.assertTrue([i['id'] for i in results['tri bike']] == [item2.id])
+
+
+  def test_get_items_invalid_search_batch(self):
+    '''Verify you get a 400 response when any of the searches is not valid
+    or there are too many of them'''
+    for queries in [['blue bike', '<script>'], [], 'blue bike',
+                    ['blue bike'] * 11]:
+      response = self.client.post('public-api/v1.0/items/search',
+                  data=json.dumps({'queries': queries}),
+                  headers=self.get_api_headers(),
+                  environ_base={'REMOTE_ADDR': '127.0.0.1'})
+      self.assertTrue(response.status_code == 400)
+
+
+  def test_get_items_suggest(self):
+    '''testing @public_api.route('/items/suggest/<prefix>')
+    1. Create 3 items, two of them bikes
+    2. Request suggestions for a prefix and for a misspelled name
+    3. Verify the bike names are suggested'''
+
+    user = self.create_user_location()
+    self.create_item(user.id)
+    self.create_item(user.id, 'bike', 'blue and red', 'cycling')
+    self.create_item(user.id, 'bike helmet', 'blue print', 'cycling')
+    response = self.make_get_localhost_request(
+                'public-api/v1.0/items/suggest/bik', self.get_api_headers())
+    self.assertTrue(response.status_code == 200)
+    json_response = json.loads(response.data.decode('utf-8'))
+    self.assertTrue(json_response['suggestions'] == ['bike', 'bike helmet'])
+
+    response = self.make_get_localhost_request(
+                'public-api/v1.0/items/suggest/bikr helmet',
+                self.get_api_headers())
+    json_response = json.loads(response.data.decode('utf-8'))
+    self.assertTrue('bike helmet' in json_response['suggestions'])
+
+
+  def test_get_items_invalid_suggest(self):
+    '''Verify you get a 400 response when the prefix is not valid'''
+    response = self.make_get_localhost_request(
+                'public-api/v1.0/items/suggest/b', self.get_api_headers())
+    self.assertTrue(response.status_code == 400)
+
+
+  def test_get_items_category_stream(self):
+    '''testing @public_api.route('/items/category/<category>') as NDJSON
+    1. Create 2 items from cycling category
+    2. Request the items with the NDJSON Accept header and with ?stream=1
+    3. Verify one JSON item per line is returned ordered by desc timestamp'''
+
+    user = self.create_user_location()
+    item1 = self.create_item(user.id, 'bike', 'blue and red', 'cycling')
+    item2 = self.create_item(user.id, 'tri bike', 'blue print', 'cycling')
+    headers = {'Accept': 'application/x-ndjson'}
+    for url, h in [('public-api/v1.0/items/category/cycling', headers),
+      ('public-api/v1.0/items/category/cycling?stream=1',
+      self.get_api_headers())]:
+      response = self.make_get_localhost_request(url, h)
+      self.assertTrue(response.status_code == 200)
+      self.assertTrue(response.mimetype == 'application/x-ndjson')
+      lines = response.get_data(as_text=True).splitlines()
+      self.assertTrue(len(lines) == 2)
+      self.assertTrue(json.loads(lines[0])['name'] == item2.name)
+      self.assertTrue(json.loads(lines[1])['name'] == item1.name)
+
+
+  def test_get_items_search_stream(self):
+    '''testing @public_api.route('/items/search/<search>') as NDJSON
+    Verify only the items matching the query are streamed'''
+
+    user = self.create_user_location()
+    self.create_item(user.id)
+    item = self.create_item(user.id, 'bike', 'blue and red', 'cycling')
+    response = self.make_get_localhost_request(
+                'public-api/v1.0/items/search/blue bike?stream=1',
+                self.get_api_headers())
+    self.assertTrue(response.status_code == 200)
+    lines = response.get_data(as_text=True).splitlines()
+    self.assertTrue(len(lines) == 1)
+    self.assertTrue(json.loads(lines[0])['id'] == item.id)
+
+
+  def test_get_items_tile(self):
+    '''testing @public_api.route('/items/tiles/<int:z>/<int:x>/<int:y>')
+    1. Create 2 items in Madrid and 1 in Berlin
+    2. Request the world tile and a zoom 6 tile containing Madrid
+    3. Verify the clusters counts'''
+
+    user_madrid = self.create_user()
+    user_berlin = self.create_user_location()
+    self.create_item_location(user_madrid)
+    self.create_item_location(user_madrid, 'ball')
+    self.create_item_location(user_berlin)
+    response = self.make_get_localhost_request(
+                'public-api/v1.0/items/tiles/0/0/0', self.get_api_headers())
+    self.assertTrue(response.status_code == 200)
+    json_response = json.loads(response.data.decode('utf-8'))
+    self.assertTrue(sum(c['count'] for c in json_response['clusters']) == 3)
+
+    response = self.make_get_localhost_request(
+                'public-api/v1.0/items/tiles/6/31/24', self.get_api_headers())
+    json_response = json.loads(response.data.decode('utf-8'))
+    self.assertTrue(len(json_response['clusters']) == 1)
+    self.assertTrue(json_response['clusters'][0]['count'] == 2)
+
+
+  def test_get_items_invalid_tile(self):
+    '''Verify you get a 400 response when the tile doesn't exist'''
+    response = self.make_get_localhost_request(
+                'public-api/v1.0/items/tiles/1/2/0', self.get_api_headers())
+    self.assertTrue(response.status_code == 400)
+
+
+  def test_get_items_clusters(self):
+    '''testing @public_api.route('/items/clusters')
+    Verify the clusters of the items inside the bounding box are returned
+    and too big bounding boxes are rejected'''
+
+    user_madrid = self.create_user()
+    user_berlin = self.create_user_location()
+    self.create_item_location(user_madrid)
+    self.create_item_location(user_berlin)
+    response = self.make_get_localhost_request(
+                'public-api/v1.0/items/clusters?bbox=-10,35,5,45&zoom=5',
+                self.get_api_headers())
+    self.assertTrue(response.status_code == 200)
+    json_response = json.loads(response.data.decode('utf-8'))
+    self.assertTrue(len(json_response['clusters']) == 1)
+    self.assertTrue(json_response['clusters'][0]['count'] == 1)
+
+    response = self.make_get_localhost_request(
+                'public-api/v1.0/items/clusters?bbox=-10,35,15,55&zoom=12',
+                self.get_api_headers())
+    self.assertTrue(response.status_code == 400)
 
 
   def test_get_item_no_exist(self):
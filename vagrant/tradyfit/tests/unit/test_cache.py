@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import time
+from base import BasicTestCase
+from app.cache import LRUCache, FragmentCache
+
+
+class LRUCacheTestCase(BasicTestCase):
+
+  def test_get_set(self):
+    cache = LRUCache()
+    self.assertTrue(cache.get('key') is None)
+    cache.set('key', [1, 2])
+    self.assertEqual(cache.get('key'), [1, 2])
+    self.assertEqual(cache.stats['hits'], 1)
+    self.assertEqual(cache.stats['misses'], 1)
+
+  def test_lru_eviction(self):
+    '''verify the least recently used entry is evicted when the cache
+    is full'''
+    cache = LRUCache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    self.assertTrue(cache.get('b') is None)
+    self.assertEqual(cache.get('a'), 1)
+    self.assertEqual(len(cache), 2)
+
+  def test_timeout(self):
+    cache = LRUCache(timeout=1)
+    cache.set('a', 1)
+    time.sleep(1.1)
+    self.assertTrue(cache.get('a') is None)
+
+  def test_clear(self):
+    cache = LRUCache()
+    cache.set('a', 1)
+    cache.clear()
+    self.assertTrue(cache.get('a') is None)
+
+
+class FragmentCacheTestCase(BasicTestCase):
+
+  def test_version(self):
+    '''verify a fragment is only served for the version it was rendered
+    from'''
+    cache = FragmentCache()
+    cache.set_fragment(1, 'v1', '<p>ball</p>', 0.002)
+    self.assertEqual(cache.get_fragment(1, 'v1'), '<p>ball</p>')
+    self.assertTrue(cache.get_fragment(1, 'v2') is None)
+    self.assertEqual(cache.stats['hits'], 1)
+    self.assertEqual(cache.stats['misses'], 1)
+    self.assertAlmostEqual(cache.stats['saved_ms'], 2)
+
+  def test_max_bytes(self):
+    '''verify the least recently used fragments are evicted when the html
+    size limit is exceeded'''
+    cache = FragmentCache(max_bytes=10)
+    cache.set_fragment(1, 'v1', 'a' * 4)
+    cache.set_fragment(2, 'v1', 'b' * 4)
+    cache.get_fragment(1, 'v1')
+    cache.set_fragment(3, 'v1', 'c' * 4)
+    self.assertTrue(cache.get_fragment(2, 'v1') is None)
+    self.assertEqual(cache.get_fragment(1, 'v1'), 'a' * 4)
+    self.assertEqual(cache.stats['bytes'], 8)
+    cache.delete(1)
+    self.assertEqual(cache.stats['bytes'], 4)
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from base import UnitTestCase
+from app import db
+from app.models import Category
+from app.categories import category_registry
+
+
+class CategoryRegistryTestCase(UnitTestCase):
+
+  def test_get(self):
+    c = Category.get_category('soccer')
+    self.assertEqual(category_registry.get(c.id), (c.id, 'soccer'))
+    self.assertEqual(category_registry.get_by_name('soccer').id, c.id)
+    self.assertTrue(category_registry.get(999) is None)
+    self.assertTrue(category_registry.get_by_name('chess') is None)
+
+  def test_choices(self):
+    choices = [(c.id, c.name) for c in
+                Category.query.order_by(Category.id).all()]
+    self.assertEqual(category_registry.choices(), choices)
+
+  def test_reload_on_insert(self):
+    '''verify categories created in the process are seen right away'''
+    category_registry.all()
+    db.session.add(Category(name='chess'))
+    db.session.commit()
+    self.assertTrue(category_registry.get_by_name('chess') is not None)
+
+  def test_reload_after_commit(self):
+    '''verify the registry isn't reloaded with an uncommitted change'''
+    category_registry.all()
+    version = category_registry.version
+    db.session.add(Category(name='chess'))
+    db.session.flush()
+    self.assertEqual(category_registry.version, version)
+    db.session.rollback()
+    self.assertTrue(category_registry.get_by_name('chess') is None)
+
+  def test_reload_on_version_change(self):
+    '''verify changes made by other processes are seen on the next request
+    after the version stamp changes'''
+    c = Category.get_category('soccer')
+    category_registry.all()
+    db.session.execute("UPDATE categories SET name = 'football' "
+                        "WHERE name = 'soccer'")
+    db.session.execute("UPDATE versions SET value = value + 1 "
+                        "WHERE name = 'categories'")
+    db.session.commit()
+    self.assertEqual(category_registry.get(c.id).name, 'soccer')
+    with self.app.app_context():
+      self.assertEqual(category_registry.get(c.id).name, 'football')
@@ -1,16 +1,25 @@
 # -*- coding: utf-8 -*-
 import requests
 import os
+import socket
 import boto
+from boto.exception import S3ResponseError
+from io import BytesIO
 from mock import Mock, patch
 from base import BasicTestCase
 from app import helpers
 
 class HelperTestCase(BasicTestCase):
 
+  def setUp(self):
+    super(HelperTestCase, self).setUp()
+    #the S3 bucket handle is kept between calls
+    helpers.reset_s3_bucket()
+    helpers.s3_stats.clear()
+
   @staticmethod
   def local_get(url):
-    '''mock requests.get: get local path to a file'''
+    '''mock the download: get local path to a file'''
     path = os.path.dirname(os.path.abspath(__file__))
     image_path = os.path.join(path,url)
     return image_path
@@ -38,12 +47,36 @@ class CommonHelperTestCase(HelperTestCase):
 
   def test_get_s3_bucket_exception(self):
     '''if the connection with s3 fails, an exception is returned'''
-    mock_boto_conn = Mock(side_effect=Exception('boom!'))
+    mock_boto_conn = Mock(side_effect=socket.error('boom!'))
     with patch.object(boto, 'connect_s3', mock_boto_conn):
-      with self.assertRaises(Exception) as context:
+      with self.assertRaises(ReferenceError) as context:
         helpers.get_s3_bucket()
         self.assertTrue('connection refused' in context.exception)
 
+  def test_get_s3_bucket_reused(self):
+    '''verify the connection is made once and the bucket isn't validated'''
+    mock_boto_conn = Mock()
+    with patch.object(boto, 'connect_s3', mock_boto_conn):
+      bucket = helpers.get_s3_bucket()
+      self.assertTrue(helpers.get_s3_bucket() is bucket)
+    self.assertEqual(mock_boto_conn.call_count, 1)
+    mock_boto_conn.return_value.get_bucket.assert_called_once_with(
+                          self.app.config["S3_BUCKET"], validate=False)
+
+  def test_s3_reconnect(self):
+    '''verify a failed operation drops the connection and it's tried again
+    with a new one'''
+    mock_boto_conn = Mock()
+    bucket = mock_boto_conn.return_value.get_bucket.return_value
+    bucket.delete_key.side_effect = [socket.error('boom!'), None]
+    with patch.object(boto, 'connect_s3', mock_boto_conn):
+      self.assertTrue(helpers.delete_s3("S3_UPLOAD_ITEM_DIR", 'file'))
+    self.assertEqual(mock_boto_conn.call_count, 2)
+    stats = dict(helpers.s3_stats.stats)
+    self.assertEqual(stats['delete']['calls'], 2)
+    self.assertEqual(stats['delete']['errors'], 1)
+    self.assertEqual(stats['connect']['calls'], 2)
+
   def test_upload_s3(self):
     '''verify True is returned if an image can be correctly uploaded
     when s3 connection works'''
@@ -51,11 +84,30 @@ class CommonHelperTestCase(HelperTestCase):
     with patch.object(helpers, 'get_s3_bucket', mock_get_s3_bucket):
       self.assertTrue(helpers.upload_s3("S3_UPLOAD_AVATAR_DIR", 'file', 'data'))
 
+  def test_upload_s3_file(self):
+    '''verify a file object is streamed to the key from its start'''
+    mock_get_s3_bucket = Mock()
+    key = mock_get_s3_bucket.return_value.new_key.return_value
+    data = BytesIO('0123456789ab')
+    with patch.object(helpers, 'get_s3_bucket', mock_get_s3_bucket):
+      self.assertTrue(helpers.upload_s3("S3_UPLOAD_ITEM_DIR", 'file', data))
+    key.set_contents_from_file.assert_called_once_with(data,
+                                      policy='public-read', rewind=True)
+
   def test_upload_s3_fail(self):
     '''verify False is returned if an image cannot be uploaded'''
     mock_get_s3_bucket = Mock()
+    key = mock_get_s3_bucket.return_value.new_key.return_value
+    key.set_contents_from_file.side_effect = S3ResponseError(403, 'Forbidden')
     with patch.object(helpers, 'get_s3_bucket', mock_get_s3_bucket):
-      self.assertFalse(helpers.upload_s3('directory', 'file', 'data'))
+      self.assertFalse(helpers.upload_s3("S3_UPLOAD_ITEM_DIR", 'file', 'data'))
+
+  def test_upload_s3_bug(self):
+    '''verify the errors that are not S3 ones are not hidden'''
+    mock_get_s3_bucket = Mock()
+    with patch.object(helpers, 'get_s3_bucket', mock_get_s3_bucket):
+      with self.assertRaises(KeyError):
+        helpers.upload_s3('directory', 'file', 'data')
 
   def test_delete_s3(self):
     '''verify True is returned if an image can be deleted'''
@@ -65,56 +117,60 @@ class CommonHelperTestCase(HelperTestCase):
 
   def test_delete_s3_fail(self):
     '''verify False is returned if an image can't be deleted'''
-    mock_get_s3_bucket = Mock(side_effect=Exception('boom!'))
+    mock_get_s3_bucket = Mock(side_effect=ReferenceError('connection refused'))
     with patch.object(helpers, 'get_s3_bucket', mock_get_s3_bucket):
       self.assertFalse(helpers.delete_s3("S3_UPLOAD_ITEM_DIR", 'file'))
 
 
 class AvatarHelperTestCase(HelperTestCase):
-  '''Test cases related with saving user avatar helper methods'''
+  '''Test cases related with downloading and deleting user avatars'''
 
-  @patch('requests.get')
+  @patch('requests.Session.get')
   def test_make_avatar_request(self, mock_get):
     '''test helpers.make_image_request with a legit url (aka local file)'''
     url = 'test_avatar.jpg'
-    mock_response = Mock()
+    mock_response = Mock(headers={})
     mock_response.return_value = HelperTestCase.local_get(url)
-    mock_response.content = HelperTestCase.local_content(
-                                                  mock_response.return_value)
+    content = HelperTestCase.local_content(mock_response.return_value)
+    mock_response.iter_content.return_value = [content[:100], content[100:]]
     # Assign our mock response as the result of our patched function
     mock_get.return_value = mock_response
-    self.assertTrue(helpers.make_image_request(url) is not None)
+    image = helpers.make_image_request(url)
+    self.assertEqual(image.read(), content)
+
+  @patch('requests.Session.get')
+  def test_make_avatar_request_too_big(self, mock_get):
+    '''verify the download stops when the image is bigger than
+    MAX_CONTENT_LENGTH, declared or not'''
+    chunk = 'x' * self.app.config['UPLOAD_CHUNK_SIZE']
+    chunks = self.app.config['MAX_CONTENT_LENGTH'] // len(chunk) + 1
+    mock_get.return_value = Mock(headers={})
+    mock_get.return_value.iter_content.return_value = [chunk] * chunks
+    self.assertTrue(helpers.make_image_request('avatar.jpg') is None)
+    mock_get.return_value = Mock(headers={'content-length': str(
+                                  self.app.config['MAX_CONTENT_LENGTH'] + 1)})
+    self.assertTrue(helpers.make_image_request('avatar.jpg') is None)
+    self.assertFalse(mock_get.return_value.iter_content.called)
+
+  @patch('requests.Session.get')
+  def test_make_avatar_request_error_status(self, mock_get):
+    '''verify an error response is not taken as the image'''
+    mock_get.return_value = Mock(headers={})
+    mock_get.return_value.raise_for_status.side_effect = \
+        requests.HTTPError('404 Client Error')
+    self.assertTrue(helpers.make_image_request('avatar.jpg') is None)
+    self.assertFalse(mock_get.return_value.iter_content.called)
+    self.assertTrue(mock_get.return_value.close.called)
+
+  def test_http_session_reused(self):
+    '''verify the downloads of a thread share the HTTP session'''
+    self.assertTrue(helpers.get_http_session() is helpers.get_http_session())
 
   def test_make_avatar_request_bad_url(self):
     '''test helpers.make_image_request with a non legit url'''
     url = None
     self.assertTrue(helpers.make_image_request(url) is None)
 
-  def test_save_avatar(self):
-    '''test filename returned when an image is provided'''
-    mock_image_req = Mock(return_value = 'fakeimagecontent')
-    mock_upload_s3 = Mock(return_value = True)
-    with patch.object(helpers, 'make_image_request', mock_image_req):
-      with patch.object(helpers, 'upload_s3', mock_upload_s3):
-        self.assertTrue(helpers.save_avatar('avatar.jpg') !=
-                        self.app.config["DEFAULT_AVATAR"])
-
-  def test_save_invalid_avatar(self):
-    '''test default filename is returned when no image is provided'''
-    mock_image_req = Mock(return_value=None)
-    with patch.object(helpers, 'make_image_request', mock_image_req):
-      self.assertTrue(helpers.save_avatar('something') ==
-                      self.app.config["DEFAULT_AVATAR"])
-
-  def test_save_avatar_problem(self):
-    '''test default_avatar is returned if upload to s3 fails'''
-    mock_image_req = Mock(return_value='fakeimagecontent')
-    mock_upload_s3 = Mock(return_value=False)
-    with patch.object(helpers, 'make_image_request', mock_image_req):
-      with patch.object(helpers, 'upload_s3', mock_upload_s3):
-        self.assertTrue(helpers.save_avatar('image.jpg') ==
-                        self.app.config["DEFAULT_AVATAR"])
-
   def test_delete_avatar(self):
     '''verify True is returned if a files was deleted from s3'''
     mock_delete_s3 = Mock(return_value=True)
@@ -131,31 +187,7 @@ class AvatarHelperTestCase(HelperTestCase):
 
 
 class ItemImageHelperTestCase(HelperTestCase):
-  '''Test cases related with saving item images helper methods'''
-
-  def test_save_item_image(self):
-    '''verify a filename with the same extension of the input file is
-    returned if it was stored in s3'''
-    mock_source_file = Mock()
-    mock_file = Mock(filename='image.jpg')
-    mock_source_file.data = mock_file
-    mock_upload_s3 = Mock(return_value=True)
-    with patch.object(helpers, 'upload_s3', mock_upload_s3):
-      self.assertTrue(helpers.save_item_image(mock_source_file).endswith('jpg'))
-
-  def test_save_item_no_image_provided(self):
-    '''verify default item image is provided if not source_file passed'''
-    self.assertTrue(helpers.save_item_image(None) ==
-                    self.app.config["DEFAULT_ITEM"])
-
-  def test_save_item_image_s3_problem(self):
-    '''verify None is returned if image was not stored in s3'''
-    mock_source_file = Mock()
-    mock_file = Mock(filename='image.jpg')
-    mock_source_file.data = mock_file
-    mock_upload_s3 = Mock(return_value=False)
-    with patch.object(helpers, 'upload_s3', mock_upload_s3):
-      self.assertTrue(helpers.save_item_image(mock_source_file) is None)
+  '''Test cases related with deleting item images helper methods'''
 
   def test_delete_item_image(self):
     '''verify True is returned if a files was deleted from s3'''
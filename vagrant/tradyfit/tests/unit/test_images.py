@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import os
+from io import BytesIO
+from mock import patch
+from PIL import Image
+from base import BasicTestCase
+from app.images import rendition_filename, make_renditions, encode, srcset, \
+RENDITIONS_NONE, RENDITIONS_SIZES, RENDITIONS_WEBP
+
+SIZES = (('thumb', 64), ('full', 256))
+AVATAR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'test_avatar.jpg')
+
+
+class ImagesTestCase(BasicTestCase):
+
+  def test_rendition_filename(self):
+    self.assertEqual(rendition_filename('abc.jpg', 'full'), 'abc.jpg')
+    self.assertEqual(rendition_filename('abc.jpg', 'thumb'), 'abc_thumb.jpg')
+    self.assertEqual(rendition_filename('abc.png', 'thumb', webp=True),
+                    'abc_thumb.webp')
+
+  def test_make_renditions(self):
+    '''verify the image is scaled down to each size but never up'''
+    with open(AVATAR, 'rb') as f:
+      files, renditions = make_renditions('abc.jpg', f, SIZES)
+    files = dict(files)
+    self.assertEqual(Image.open(files['abc_thumb.jpg']).size, (64, 64))
+    self.assertEqual(Image.open(files['abc.jpg']).size, (160, 160))
+    if renditions == RENDITIONS_WEBP:
+      self.assertEqual(Image.open(files['abc_thumb.webp']).format, 'WEBP')
+    else:
+      self.assertEqual(len(files), 2)
+
+  def test_make_renditions_one_at_a_time(self):
+    '''verify each rendition is encoded only when it's reached'''
+    with open(AVATAR, 'rb') as f:
+      files, renditions = make_renditions('abc.jpg', f, SIZES)
+    with patch('app.images.encode', wraps=encode) as mock_encode:
+      name, content = next(files)
+      self.assertEqual(name, 'abc_thumb.jpg')
+      self.assertEqual(mock_encode.call_count, 1)
+
+  def test_make_renditions_not_an_image(self):
+    '''verify data that can't be decoded is rejected'''
+    self.assertTrue(make_renditions('abc.jpg', BytesIO('contents'),
+                                    SIZES) is None)
+    #a truncated image
+    with open(AVATAR, 'rb') as f:
+      source = BytesIO(f.read()[:200])
+    self.assertTrue(make_renditions('abc.jpg', source, SIZES) is None)
+
+  def test_make_renditions_too_many_pixels(self):
+    '''verify images bigger than max_pixels aren't decoded'''
+    with open(AVATAR, 'rb') as f:
+      self.assertTrue(make_renditions('abc.jpg', f, SIZES,
+                                      max_pixels=160 * 159) is None)
+
+  def test_srcset(self):
+    url = lambda name: '/items/' + name
+    self.assertEqual(srcset(url, 'abc.jpg', SIZES, RENDITIONS_SIZES),
+                    '/items/abc_thumb.jpg 64w, /items/abc.jpg 256w')
+    self.assertEqual(srcset(url, 'abc.jpg', SIZES, RENDITIONS_NONE), '')
+    self.assertEqual(srcset(url, 'abc.jpg', SIZES, RENDITIONS_SIZES,
+                            webp=True), '')
@@ -1,11 +1,16 @@
 # -*- coding: utf-8 -*-
 import time
+from datetime import datetime
 from geoalchemy2.elements import WKTElement
 from mock import patch
+from flask.ext.sqlalchemy import get_debug_queries
+from werkzeug.exceptions import NotFound
 from base import BasicTestCase, UnitTestCase
-from app import db
-from app.models import Category, Item, User, load_user, Message, Country, State
+from app import db, last_seen_buffer, user_cache
+from app.models import Category, Item, User, load_user, Message, Country, \
+State
 from app.geolocation import Geolocation
+from app.last_seen import LastSeenBuffer
 
 
 class CategoryModelTestCase(BasicTestCase):
@@ -40,10 +45,21 @@ class UserModelTestCase(UnitTestCase):
 
   def test_username(self):
     u = self.create_user()
-    #the username already exists, append the next uid to the name
-    self.assertTrue(User.create_username(u.username) == u.username+str(u.id+1))
+    #the username already exists, append the next number to the name
+    self.assertTrue(User.create_username(u.username) == u.username + '2')
     #username doesn't exist, so it can be assigned
     self.assertTrue(User.create_username('jacky') == 'jacky')
+    #each number is given once
+    self.assertTrue(User.create_username('jacky') == 'jacky2')
+
+  def test_signup(self):
+    '''verify users signing up with the same email name get different
+    usernames and a second signup of the same user returns it'''
+    u = User.signup('1', 'john@example.com', 'John', 'male', 'a.jpg')
+    u1 = User.signup('2', 'john@example.org', 'John', 'male', 'b.jpg')
+    self.assertEqual((u.username, u1.username), ('john', 'john2'))
+    self.assertEqual(User.signup('1', 'john@example.com', 'John', 'male',
+                                'c.jpg'), u)
 
   def test_ping(self):
     u = self.create_user()
@@ -52,6 +68,25 @@ class UserModelTestCase(UnitTestCase):
     u.ping()
     self.assertTrue(u.last_seen > last_seen_before)
 
+  def test_ping_flush(self):
+    '''verify pings are written to the db in a batch when flushed'''
+    u = self.create_user()
+    u1 = self.create_user_location()
+    u.ping()
+    u1.ping()
+    last_seen = u.last_seen
+    self.assertEqual(last_seen_buffer.flush(), 2)
+    db.session.expire_all()
+    self.assertEqual(u.last_seen, last_seen)
+    self.assertEqual(last_seen_buffer.flush(), 0)
+
+  def test_ping_flush_no_app(self):
+    '''verify the pings are kept by a buffer with no app to flush them'''
+    buffer = LastSeenBuffer(flush_size=1)
+    buffer.add(1, datetime.utcnow())
+    self.assertEqual(buffer.flush(), 0)
+    self.assertEqual(len(buffer), 1)
+
   def test_get_user(self):
     u = self.create_user()
     self.assertEqual(User.get_user(u.email), u)
@@ -61,6 +96,70 @@ class UserModelTestCase(UnitTestCase):
     u = self.create_user()
     self.assertEqual(load_user(u.id), u)
 
+  def test_load_user_cached(self):
+    '''verify the second load is served from the users cache'''
+    user_id = self.create_user().id
+    db.session.remove()
+    self.assertEqual(load_user(user_id).username, 'lisa')
+    db.session.remove()
+    hits = user_cache.hits
+    u = load_user(user_id)
+    self.assertEqual(user_cache.hits, hits + 1)
+    self.assertEqual(u.username, 'lisa')
+    self.assertTrue(u in db.session)
+    self.assertTrue(load_user(999) is None)
+
+  def test_user_cache_invalidation(self):
+    '''verify the cached snapshot isn't served once the user changes'''
+    user_id = self.create_user().id
+    db.session.remove()
+    self.assertEqual(load_user(user_id).username, 'lisa')
+    db.session.remove()
+    u = User.query.get(user_id)
+    u.username = 'lisa1'
+    db.session.commit()
+    db.session.remove()
+    self.assertEqual(load_user(user_id).username, 'lisa1')
+
+  def test_load_user_cached_no_query(self):
+    '''verify a cache hit doesn't query the database'''
+    user_id = self.create_user().id
+    db.session.remove()
+    load_user(user_id)
+    db.session.remove()
+    start = len(get_debug_queries())
+    self.assertEqual(load_user(user_id).username, 'lisa')
+    self.assertEqual(len(get_debug_queries()), start)
+
+  def test_user_cache_unread_count(self):
+    '''verify a new message for the user drops its snapshot'''
+    sender = self.create_user('25', 'maggy@example.com', 'mag')
+    user_id = self.create_user().id
+    item = self.create_item(user_id)
+    db.session.remove()
+    self.assertEqual(load_user(user_id).unread_count, 0)
+    db.session.remove()
+    self.create_message(sender.id, user_id, item.id)
+    db.session.remove()
+    self.assertEqual(load_user(user_id).unread_count, 1)
+
+  def test_user_cache_other_process(self):
+    '''verify the changes made by another process, which don't touch this
+    process cache, are seen once the snapshot expires'''
+    user_id = self.create_user().id
+    db.session.remove()
+    self.assertEqual(load_user(user_id).username, 'lisa')
+    db.session.remove()
+    users = User.__table__
+    with db.engine.begin() as connection:
+      connection.execute(users.update().where(users.c.id == user_id).values(
+                        username='lisa1'))
+    self.assertEqual(load_user(user_id).username, 'lisa')
+    db.session.remove()
+    expired = time.time() + self.app.config['USER_CACHE_TIMEOUT'] + 1
+    with patch('time.time', return_value=expired):
+      self.assertEqual(load_user(user_id).username, 'lisa1')
+
   def test_get_avatar(self):
     u = self.create_user()
     avatar = self.app.config['S3_LOCATION'] + "/" + \
@@ -162,6 +261,56 @@ class MessageModelTestCase(UnitTestCase):
     self.assertTrue(len(sender.msgs_unread) == 0)
     self.assertTrue(sender.msgs_received.count() == 0)
 
+  def test_unread_count(self):
+    '''verify the receiver unread counter is updated when a message is
+    created, read and deleted'''
+    sender = self.create_user()
+    receiver = self.create_user('25', 'maggy@example.com', 'mag')
+    item = self.create_item(receiver.id)
+    msg = self.create_message(sender.id, receiver.id, item.id)
+    msg1 = self.create_message(sender.id, receiver.id, item.id)
+    self.assertEqual(receiver.unread_count, 2)
+    self.assertEqual(sender.unread_count, 0)
+    msg.unread = False
+    db.session.add(msg)
+    db.session.commit()
+    self.assertEqual(receiver.unread_count, 1)
+    db.session.delete(msg1)
+    db.session.commit()
+    self.assertEqual(receiver.unread_count, 0)
+
+  def test_message_counts(self):
+    sender = self.create_user()
+    receiver = self.create_user('25', 'maggy@example.com', 'mag')
+    item = self.create_item(receiver.id)
+    msg = self.create_message(sender.id, receiver.id, item.id)
+    self.create_message(sender.id, receiver.id, item.id)
+    self.create_message(receiver.id, sender.id, item.id)
+    msg.unread = False
+    db.session.commit()
+    self.assertEqual(receiver.message_counts(),
+                    {'unread': 1, 'sent': 1, 'received': 2})
+    self.assertEqual(sender.message_counts(),
+                    {'unread': 1, 'sent': 2, 'received': 1})
+    #the unread number is the navbar counter
+    receiver.unread_count = 5
+    db.session.commit()
+    self.assertEqual(receiver.message_counts()['unread'], 5)
+
+  def test_repair_unread_counts(self):
+    '''verify wrong counters are recomputed'''
+    sender = self.create_user()
+    receiver = self.create_user('25', 'maggy@example.com', 'mag')
+    item = self.create_item(receiver.id)
+    self.create_message(sender.id, receiver.id, item.id)
+    receiver.unread_count = 5
+    sender.unread_count = 1
+    db.session.commit()
+    self.assertEqual(User.repair_unread_counts(), 2)
+    self.assertEqual(receiver.unread_count, 1)
+    self.assertEqual(sender.unread_count, 0)
+    self.assertEqual(User.repair_unread_counts(), 0)
+
   def test_message_deleted_FK(self):
     '''create a message and verify that item/sender/receiver can be deleted'''
     sender = self.create_user()
@@ -200,6 +349,161 @@ class MessageModelTestCase(UnitTestCase):
                                       'timestamp': msg.timestamp})
 
 
+class ItemQueryTestCase(UnitTestCase):
+
+  def test_keyset_paginate_timestamp(self):
+    '''verify that walking the pages with the next cursor returns all the
+    items newest first without repetitions'''
+    u = self.create_user()
+    items = [self.create_item(u.id) for _ in range(5)]
+    page = Item.query.keyset_paginate(per_page=2)
+    seen = list(page.items)
+    while page.has_next:
+      page = Item.query.keyset_paginate(page.next_cursor, per_page=2)
+      seen.extend(page.items)
+    self.assertEqual(seen, list(reversed(items)))
+
+  def test_keyset_paginate_distance(self):
+    '''verify pages are ordered by distance to the user location'''
+    user_madrid = self.create_user()
+    item_madrid = self.create_item_location(user_madrid)
+    user_berlin = self.create_user_location()
+    item_berlin = self.create_item_location(user_berlin)
+    item_berlin1 = self.create_item_location(user_berlin)
+    user_loc = user_madrid.get_point_coordinates()
+    page = Item.query.keyset_paginate(per_page=2, user_loc=user_loc)
+    self.assertEqual(page.items, [item_madrid, item_berlin])
+    page = Item.query.keyset_paginate(page.next_cursor, 2, user_loc)
+    self.assertEqual(page.items, [item_berlin1])
+    self.assertFalse(page.has_next)
+
+  def test_keyset_paginate_distance_no_location(self):
+    '''verify the items without location come after the located ones and
+    the pages walk through them without repetitions'''
+    user_madrid = self.create_user()
+    item_madrid = self.create_item_location(user_madrid)
+    items = [self.create_item(user_madrid.id) for _ in range(3)]
+    user_loc = user_madrid.get_point_coordinates()
+    page = Item.query.keyset_paginate(per_page=2, user_loc=user_loc)
+    seen = list(page.items)
+    while page.has_next:
+      page = Item.query.keyset_paginate(page.next_cursor, 2, user_loc)
+      seen.extend(page.items)
+    self.assertEqual(seen, [item_madrid] + items)
+
+  def test_keyset_paginate_radius(self):
+    '''verify only the items at less than radius_km are returned'''
+    user_madrid = self.create_user()
+    item_madrid = self.create_item_location(user_madrid)
+    user_berlin = self.create_user_location()
+    self.create_item_location(user_berlin)
+    user_loc = user_madrid.get_point_coordinates()
+    page = Item.query.keyset_paginate(user_loc=user_loc, radius_km=50)
+    self.assertEqual(page.items, [item_madrid])
+    #Madrid-Berlin is about 1870 km
+    page = Item.query.keyset_paginate(user_loc=user_loc, radius_km=2000)
+    self.assertEqual(len(page.items), 2)
+
+  def test_nearest(self):
+    '''verify items are ordered by distance to the user'''
+    user_madrid = self.create_user()
+    user_berlin = self.create_user_location()
+    item_berlin = self.create_item_location(user_berlin)
+    item_madrid = self.create_item_location(user_madrid)
+    items = Item.query.nearest(user_berlin.get_point_coordinates()).all()
+    self.assertEqual(items, [item_berlin, item_madrid])
+
+  def test_keyset_paginate_invalid_cursor(self):
+    '''verify a tampered cursor or a cursor from other ordering is
+    rejected'''
+    u = self.create_user()
+    self.create_item(u.id)
+    self.create_item(u.id)
+    page = Item.query.keyset_paginate(per_page=1)
+    with self.assertRaises(NotFound):
+      Item.query.keyset_paginate(page.next_cursor + 'x', per_page=1)
+    with self.assertRaises(NotFound):
+      Item.query.keyset_paginate(page.next_cursor, 1,
+                                u.get_point_coordinates())
+    page = Item.query.keyset_paginate('bad', 1, error_out=False)
+    self.assertTrue(page.is_first)
+
+
+  def test_rank_search_name_weight(self):
+    '''verify an item matching the query on its name is ranked above a
+    newer one matching it only on the description'''
+    u = self.create_user()
+    item_name = self.create_item(u.id, 'blue bike', 'fast')
+    item_desc = self.create_item(u.id, 'helmet', 'for a blue bike')
+    self.create_item(u.id, 'ball', 'small and round')
+    items = Item.query.rank_search('blue bike')
+    self.assertEqual(items, [item_name, item_desc])
+
+  def test_rank_search_limit(self):
+    u = self.create_user()
+    for _ in range(3):
+      self.create_item(u.id, 'blue bike')
+    self.assertEqual(len(Item.query.rank_search('blue bike', limit=2)), 2)
+    self.assertEqual(Item.query.rank_search('-'), [])
+
+  def test_serialized(self):
+    '''verify the column serializer returns the same than Item.serialize'''
+    user_us = self.create_user_location('2', 'bart@example.com', 'bart',
+                  'Sausalito', 'CA', 'US', 37.85, -122.48)
+    item = self.create_item_location(self.create_user())
+    item1 = self.create_item_location(user_us)
+    items = list(Item.query.order_by(Item.timestamp.desc()).serialized())
+    self.assertEqual(items, [item1.serialize, item.serialize])
+
+  def test_batch_search(self):
+    '''verify the newest limit matches of each query are returned'''
+    u = self.create_user()
+    ball = self.create_item(u.id)
+    bike = self.create_item(u.id, 'blue bike')
+    bike1 = self.create_item(u.id, 'red bike')
+    results = Item.query.batch_search(['bike', 'ball', 'tennis'], limit=1)
+    self.assertEqual(results, {'bike': [bike1], 'ball': [ball],
+                              'tennis': []})
+    results = Item.query.batch_search(['bike'])
+    self.assertEqual(results['bike'], [bike1, bike])
+    results = Item.query.batch_search(['bike', 'ball'], serialized=True)
+    self.assertEqual(results, {'bike': [bike1.serialize, bike.serialize],
+                              'ball': [ball.serialize]})
+
+  def test_facets(self):
+    '''verify the matches of a search are counted by category, country,
+    US state and price bucket'''
+    user_madrid = self.create_user()
+    user_ca = self.create_user_location('2', 'bart@example.com', 'bart',
+                  'Sausalito', 'CA', 'US', 37.85, -122.48)
+    self.create_item_location(user_madrid, 'blue bike')
+    self.create_item_location(user_ca, 'red bike')
+    item = self.create_item_location(user_ca, 'bike shoes', category='soccer')
+    item.price = 300
+    db.session.add(item)
+    db.session.commit()
+    self.create_item_location(user_ca, 'ball')
+    facets = Item.query.search('bike').facets()
+    self.assertEqual(facets['category'], [{'value': 'cycling', 'count': 2},
+                                          {'value': 'soccer', 'count': 1}])
+    self.assertEqual(facets['country'], [{'value': 'US', 'count': 2},
+                                         {'value': 'ES', 'count': 1}])
+    self.assertEqual(facets['state'], [{'value': 'CA', 'count': 2}])
+    self.assertEqual(facets['price'], [{'value': '0-25', 'count': 2},
+                                       {'value': '250-500', 'count': 1}])
+
+  def test_facets_radius(self):
+    '''verify only the matches at less than radius_km are counted'''
+    user_madrid = self.create_user()
+    user_berlin = self.create_user_location()
+    self.create_item_location(user_madrid, 'blue bike')
+    self.create_item_location(user_berlin, 'red bike')
+    facets = Item.query.search('bike').facets(
+                        user_madrid.get_point_coordinates(), 50)
+    self.assertEqual(facets['country'], [{'value': 'ES', 'count': 1}])
+    self.assertEqual(facets['category'], [{'value': 'cycling', 'count': 1}])
+
+
 class CountryModelTestCase(UnitTestCase):
   def test_get_countries(self):
     self.assertTrue(type(Country.get_countries()) == dict)
@@ -207,7 +511,26 @@ class CountryModelTestCase(UnitTestCase):
   def test_get_country_name(self):
     self.assertTrue(Country.get_name('US') == 'United States')
 
+  def test_country_choices(self):
+    '''verify the choices are sorted by name and computed once'''
+    choices = Country.get_country_choices()
+    self.assertTrue(('US', 'United States') in choices)
+    self.assertEqual(list(choices), sorted(choices, key=lambda c: c[1]))
+    self.assertTrue(Country.get_country_choices() is choices)
+
 
 class StateModelTestCase(UnitTestCase):
   def test_us_state_name(self):
     self.assertTrue(State.get_us_name('CA') == 'California')
+
+  def test_us_state_choices(self):
+    choices = State.get_us_state_choices()
+    self.assertTrue(('CA', 'California') in choices)
+    self.assertTrue(State.get_us_state_choices() is choices)
+
+  def test_state_field_choices(self):
+    '''verify Not US goes first and the choices are computed once'''
+    choices = State.get_state_field_choices()
+    self.assertEqual(choices[0], ('NU', 'Not US'))
+    self.assertEqual(choices[1:], State.get_us_state_choices())
+    self.assertTrue(State.get_state_field_choices() is choices)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import time
+from mock import patch
+from base import UnitTestCase
+from app import db, search_cache
+from app.search import normalize_query, location_cell, search_page, \
+search_items, search_item_ids, search_facets
+
+
+class SearchCacheTestCase(UnitTestCase):
+
+  def test_normalize_query(self):
+    self.assertEqual(normalize_query('  Blue   BIKE '), 'blue bike')
+
+  def test_location_cell(self):
+    '''verify users close to each other share the same location cell'''
+    u = self.create_user()
+    u1 = self.create_user_location('2', 'bart@example.com', 'bart',
+                                  'Madrid', 'NU', 'ES', 40.4797, -3.5898)
+    self.assertEqual(location_cell(u), location_cell(u1))
+    self.assertTrue(location_cell(self.create_user_no_location()) is None)
+
+  def test_search_page_cached(self):
+    '''verify the second equivalent search is served from the cache'''
+    u = self.create_user()
+    item = self.create_item(u.id, 'blue bike')
+    page = search_page('blue bike')
+    hits = search_cache.hits
+    self.assertEqual(page.items, [item])
+    page = search_page('Blue  Bike')
+    self.assertEqual(page.items, [item])
+    self.assertEqual(search_cache.hits, hits + 1)
+
+  def test_search_facets_radius(self):
+    '''verify the facets count the same items as the nearby search page'''
+    u = self.create_user()
+    u1 = self.create_user_location()
+    self.create_item_location(u, 'blue bike')
+    self.create_item_location(u1, 'red bike')
+    facets = search_facets('bike', u, 50)
+    self.assertEqual(facets['country'], [{'value': 'ES', 'count': 1}])
+    self.assertEqual(len(search_page('bike', user=u, radius_km=50).items), 1)
+    facets = search_facets('bike', u)
+    self.assertEqual(len(facets['country']), 2)
+
+  def test_search_cache_invalidation(self):
+    '''verify updating the searched columns or deleting an item invalidates
+    the cached results, new items show up once they expire'''
+    u = self.create_user()
+    item = self.create_item(u.id, 'blue bike')
+    self.assertEqual(search_items('blue bike'), [item])
+    item1 = self.create_item(u.id, 'red bike', 'blue')
+    self.assertEqual(search_items('blue bike'), [item])
+    with patch('time.time', return_value=time.time() + 3600):
+      self.assertEqual(search_items('blue bike'), [item1, item])
+    item1.name = 'red ball'
+    db.session.add(item1)
+    db.session.commit()
+    self.assertEqual(search_items('blue bike'), [item])
+    db.session.delete(item)
+    db.session.commit()
+    self.assertEqual(search_items('blue bike'), [])
+
+  def test_search_cache_kept_on_image_update(self):
+    '''verify updates of columns the search doesn't depend on keep the
+    cached results'''
+    u = self.create_user()
+    item = self.create_item(u.id, 'blue bike')
+    self.assertEqual(search_items('blue bike'), [item])
+    item.image_url = 'bike.jpg'
+    db.session.add(item)
+    db.session.commit()
+    self.assertEqual(len(search_cache), 1)
+
+  def test_search_item_ids_limit(self):
+    '''verify the cached id lists are bounded by SEARCH_MAX_RESULTS'''
+    u = self.create_user()
+    for name in ('blue bike', 'red bike', 'bike shoes'):
+      self.create_item(u.id, name)
+    self.app.config['SEARCH_MAX_RESULTS'] = 2
+    self.assertEqual(len(search_item_ids('bike')), 2)
+    self.assertEqual(len(search_item_ids('bike', limit=10)), 2)
+
+  def test_search_cache_invalidated_on_commit(self):
+    '''verify the cached results are only dropped once the item change is
+    committed, a concurrent request could cache them again before'''
+    u = self.create_user()
+    item = self.create_item(u.id, 'blue bike')
+    self.assertEqual(search_items('blue bike'), [item])
+    item.name = 'red ball'
+    db.session.flush()
+    self.assertEqual(len(search_cache), 1)
+    db.session.rollback()
+    self.assertEqual(len(search_cache), 1)
+    item.name = 'red ball'
+    db.session.commit()
+    self.assertEqual(len(search_cache), 0)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from base import UnitTestCase
+from app import tile_cache
+from app.tiles import tile_bounds, tile_index, bbox_tiles, get_tile
+
+
+class TilesTestCase(UnitTestCase):
+
+  def test_tile_bounds(self):
+    west, south, east, north = tile_bounds(0, 0, 0)
+    self.assertEqual((west, east), (-180, 180))
+    self.assertAlmostEqual(north, 85.0511, places=4)
+    self.assertAlmostEqual(south, -85.0511, places=4)
+
+  def test_tile_index(self):
+    '''verify the tile containing a point contains its coordinates'''
+    x, y = tile_index(6, -3.5898299, 40.479732)
+    west, south, east, north = tile_bounds(6, x, y)
+    self.assertTrue(west <= -3.5898299 <= east)
+    self.assertTrue(south <= 40.479732 <= north)
+
+  def test_bbox_tiles(self):
+    self.assertEqual(bbox_tiles((-180, -85, 180, 85), 1),
+                    [(0, 0), (0, 1), (1, 0), (1, 1)])
+    self.assertTrue(bbox_tiles((-180, -85, 180, 85), 1, limit=3) is None)
+
+  def test_get_tile_edge(self):
+    '''verify an item on the edge between two tiles is counted once, in the
+    tile to its east'''
+    u = self.create_user_location('2', 'bart@example.com', 'bart', 'Edge',
+                                  'NU', 'CN', 40, 90)
+    self.create_item_location(u)
+    self.assertEqual(tile_bounds(2, 3, 1)[0], 90)
+    self.assertEqual(get_tile(2, 2, 1), [])
+    self.assertEqual(get_tile(2, 3, 1)[0]['count'], 1)
+
+  def test_get_tile_cells(self):
+    '''verify items in the same cell of the tile grid are one cluster and
+    items in different cells are not'''
+    u = self.create_user()
+    self.create_item_location(u)
+    self.create_item_location(u, 'ball')
+    u1 = self.create_user_location()
+    self.create_item_location(u1)
+    x, y = tile_index(4, -3.5898299, 40.479732)
+    self.assertEqual([c['count'] for c in get_tile(4, x, y)], [2])
+    self.assertEqual(sorted(c['count'] for c in get_tile(0, 0, 0)), [1, 2])
+
+  def test_get_tile_cached(self):
+    '''verify the tile is cached and invalidated when an item changes'''
+    u = self.create_user()
+    self.create_item_location(u)
+    self.assertEqual(get_tile(0, 0, 0)[0]['count'], 1)
+    hits = tile_cache.hits
+    get_tile(0, 0, 0)
+    self.assertEqual(tile_cache.hits, hits + 1)
+    self.create_item_location(u, 'ball')
+    self.assertEqual(get_tile(0, 0, 0)[0]['count'], 2)
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+import errno
+import os
+import requests
+from mock import Mock, patch
+from sqlalchemy import select, func
+from base import UnitTestCase
+from app import db, image_uploader
+from app.models import Item, User
+from app.uploads import AVATAR_LOCK
+from app.storage import get_storage
+
+AVATAR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'test_avatar.jpg')
+
+
+class ImageUploaderTestCase(UnitTestCase):
+
+  def spool_item(self, data=None, previous=None):
+    '''create an item with a pending image written to the spool, replacing
+    the previous one'''
+    if data is None:
+      with open(AVATAR, 'rb') as f:
+        data = f.read()
+    user = self.create_user()
+    item = self.create_item(user.id)
+    filename = 'spooled.jpg'
+    with open(image_uploader.spool_path(filename), 'wb') as f:
+      f.write(data)
+    item.image_url = filename
+    item.image_pending = True
+    item.image_previous = previous
+    db.session.commit()
+    return item.id, filename
+
+  def store_previous(self):
+    storage = get_storage()
+    storage.save('S3_UPLOAD_ITEM_DIR', 'previous.jpg', 'contents')
+    return storage.path('S3_UPLOAD_ITEM_DIR', 'previous.jpg')
+
+  def get_item(self, item_id):
+    db.session.expire_all()
+    return Item.query.get(item_id)
+
+  def test_process(self):
+    '''verify the spooled image is uploaded, the item is no longer pending
+    and the spooled file is removed'''
+    item_id, filename = self.spool_item()
+    self.assertTrue(image_uploader.process(item_id, filename))
+    self.assertFalse(self.get_item(item_id).image_pending)
+    self.assertTrue(os.path.exists(get_storage().path('S3_UPLOAD_ITEM_DIR',
+                                                      filename)))
+    self.assertFalse(os.path.exists(image_uploader.spool_path(filename)))
+
+  def test_process_not_an_image(self):
+    '''verify an image that can't be decoded isn't stored and the item gets
+    the default image'''
+    item_id, filename = self.spool_item('contents')
+    self.assertFalse(image_uploader.process(item_id, filename))
+    item = self.get_item(item_id)
+    self.assertFalse(item.image_pending)
+    self.assertEqual(item.image_url, self.app.config['DEFAULT_ITEM'])
+    self.assertFalse(os.path.exists(get_storage().path('S3_UPLOAD_ITEM_DIR',
+                                                        filename)))
+
+  @patch('app.storage.LocalStorage.save', side_effect=[False, True])
+  def test_process_retry(self, mock_save):
+    '''verify a failed upload is retried'''
+    item_id, filename = self.spool_item()
+    self.assertTrue(image_uploader.process(item_id, filename))
+    self.assertEqual(mock_save.call_count, 2)
+    self.assertFalse(self.get_item(item_id).image_pending)
+
+  @patch('app.storage.LocalStorage.save', return_value=False)
+  def test_process_fail(self, mock_save):
+    '''verify a new item gets the default image if its image can't be
+    uploaded'''
+    item_id, filename = self.spool_item()
+    self.assertFalse(image_uploader.process(item_id, filename))
+    item = self.get_item(item_id)
+    self.assertFalse(item.image_pending)
+    self.assertEqual(item.image_url, self.app.config['DEFAULT_ITEM'])
+
+  def test_process_replace(self):
+    '''verify the previous image is deleted once the new one is
+    uploaded'''
+    path = self.store_previous()
+    item_id, filename = self.spool_item(previous='previous.jpg')
+    self.assertTrue(image_uploader.process(item_id, filename))
+    item = self.get_item(item_id)
+    self.assertEqual(item.image_url, filename)
+    self.assertTrue(item.image_previous is None)
+    self.assertFalse(os.path.exists(path))
+
+  @patch('app.storage.LocalStorage.save', return_value=False)
+  def test_process_replace_fail(self, mock_save):
+    '''verify the item goes back to the previous image if the new one can't
+    be uploaded'''
+    path = self.store_previous()
+    item_id, filename = self.spool_item(previous='previous.jpg')
+    self.assertFalse(image_uploader.process(item_id, filename))
+    item = self.get_item(item_id)
+    self.assertFalse(item.image_pending)
+    self.assertEqual(item.image_url, 'previous.jpg')
+    self.assertTrue(os.path.exists(path))
+
+  def test_process_twice(self):
+    '''verify a job queued twice uploads the image once'''
+    item_id, filename = self.spool_item()
+    self.assertTrue(image_uploader.process(item_id, filename))
+    self.assertFalse(image_uploader.process(item_id, filename))
+    self.assertFalse(self.get_item(item_id).image_pending)
+
+  def test_process_claimed(self):
+    '''verify a spooled image claimed by another live process is left to
+    it, and one claimed by a process that exited is resumed'''
+    item_id, filename = self.spool_item()
+    path = image_uploader.spool_path(filename)
+    claimed = '{0}.{1}'.format(path, os.getppid())
+    os.rename(path, claimed)
+    self.assertEqual(image_uploader.resume(), 0)
+    self.assertFalse(image_uploader.process(item_id, filename))
+    self.assertTrue(self.get_item(item_id).image_pending)
+    with patch('os.kill', side_effect=OSError(errno.ESRCH, 'no process')):
+      self.assertEqual(image_uploader.resume(), 1)
+    self.assertFalse(self.get_item(item_id).image_pending)
+    self.assertFalse(os.path.exists(claimed))
+
+  def test_process_deleted_item(self):
+    '''verify the uploaded image is removed if the item was deleted before
+    the upload finished'''
+    item_id, filename = self.spool_item()
+    db.session.delete(Item.query.get(item_id))
+    db.session.commit()
+    self.assertTrue(image_uploader.process(item_id, filename))
+    self.assertFalse(os.path.exists(get_storage().path('S3_UPLOAD_ITEM_DIR',
+                                                        filename)))
+
+  @patch('app.models.delete_item_image', return_value=True)
+  def test_delete_pending_item(self, mock_delete):
+    '''verify deleting an item with a pending image removes the image it
+    was replacing, the pending one is left to the uploader'''
+    item_id, _ = self.spool_item(previous='previous.jpg')
+    self.app.testing = False
+    db.session.delete(Item.query.get(item_id))
+    db.session.commit()
+    mock_delete.assert_called_once_with('previous.jpg')
+
+  def test_workers(self):
+    '''verify the queued uploads are done by the worker threads'''
+    item_id, filename = self.spool_item()
+    image_uploader.workers = 2
+    try:
+      image_uploader.enqueue(item_id, filename)
+      image_uploader.join()
+    finally:
+      image_uploader.workers = 0
+    self.assertFalse(self.get_item(item_id).image_pending)
+
+
+class AvatarImportTestCase(UnitTestCase):
+  '''the Facebook avatar download is served from a local file and the
+  images are stored by the local storage instead of S3'''
+
+  def setUp(self):
+    super(AvatarImportTestCase, self).setUp()
+    with open(AVATAR, 'rb') as f:
+      content = f.read()
+    response = Mock(headers={'content-length': str(len(content))})
+    response.iter_content.return_value = [content[:1024], content[1024:]]
+    self.patcher = patch('requests.Session.get', return_value=response)
+    self.mock_get = self.patcher.start()
+
+  def tearDown(self):
+    self.patcher.stop()
+    super(AvatarImportTestCase, self).tearDown()
+
+  def create_new_user(self, avatar_source='http://fb/a.jpg'):
+    user = self.create_user()
+    user.avatar_url = self.app.config['DEFAULT_AVATAR']
+    user.avatar_source = avatar_source
+    db.session.commit()
+    return user.id
+
+  def get_user(self, user_id):
+    db.session.expire_all()
+    return User.query.get(user_id)
+
+  def stored_avatars(self):
+    path = get_storage().path('S3_UPLOAD_AVATAR_DIR', '')
+    return set(os.listdir(path)) if os.path.isdir(path) else set()
+
+  def test_import_avatar(self):
+    '''verify the renditions of the downloaded avatar are stored and set to
+    the user'''
+    user_id = self.create_new_user()
+    self.assertTrue(image_uploader.import_avatar(user_id, 'http://fb/a.jpg'))
+    user = self.get_user(user_id)
+    self.assertNotEqual(user.avatar_url, self.app.config['DEFAULT_AVATAR'])
+    self.assertTrue(user.avatar_renditions)
+    self.assertTrue(user.avatar_url in self.stored_avatars())
+    self.assertTrue(user.avatar_source is None)
+    self.assertEqual(self.mock_get.call_args[1]['timeout'],
+                    self.app.config['HTTP_TIMEOUT'])
+
+  def test_import_avatar_already_set(self):
+    '''verify the avatar of a user that doesn't have the default one is kept
+    and the imported files are removed'''
+    user_id = self.create_user().id
+    stored = self.stored_avatars()
+    self.assertFalse(image_uploader.import_avatar(user_id, 'http://fb/a.jpg'))
+    self.assertEqual(self.get_user(user_id).avatar_url, 'avatar.jpg')
+    self.assertEqual(self.stored_avatars(), stored)
+
+  def test_import_avatar_download_fail(self):
+    '''verify the user keeps the default avatar and the import stays
+    pending, to be resumed, if it can't be downloaded'''
+    user_id = self.create_new_user()
+    self.mock_get.side_effect = requests.Timeout('timeout')
+    self.assertFalse(image_uploader.import_avatar(user_id, 'http://fb/a.jpg'))
+    user = self.get_user(user_id)
+    self.assertEqual(user.avatar_url, self.app.config['DEFAULT_AVATAR'])
+    self.assertEqual(user.avatar_source, 'http://fb/a.jpg')
+
+  @patch('app.storage.LocalStorage.save', return_value=False)
+  def test_import_avatar_upload_fail(self, mock_save):
+    '''verify the user keeps the default avatar and the import stays
+    pending if the renditions can't be uploaded'''
+    user_id = self.create_new_user()
+    self.assertFalse(image_uploader.import_avatar(user_id, 'http://fb/a.jpg'))
+    user = self.get_user(user_id)
+    self.assertEqual(user.avatar_url, self.app.config['DEFAULT_AVATAR'])
+    self.assertEqual(user.avatar_source, 'http://fb/a.jpg')
+
+  def test_import_avatar_not_an_image(self):
+    '''verify the import is given up if the download is not an image'''
+    user_id = self.create_new_user()
+    self.mock_get.return_value.iter_content.return_value = ['not an image']
+    self.mock_get.return_value.headers = {}
+    self.assertFalse(image_uploader.import_avatar(user_id, 'http://fb/a.jpg'))
+    user = self.get_user(user_id)
+    self.assertEqual(user.avatar_url, self.app.config['DEFAULT_AVATAR'])
+    self.assertTrue(user.avatar_source is None)
+
+  def test_import_avatar_claimed(self):
+    '''verify an import claimed by another job is not downloaded again'''
+    user_id = self.create_new_user()
+    lock = (AVATAR_LOCK, user_id)
+    with db.engine.connect() as connection:
+      connection.execute(select([func.pg_advisory_lock(*lock)]))
+      try:
+        self.assertFalse(image_uploader.import_avatar(user_id,
+                                                      'http://fb/a.jpg'))
+      finally:
+        connection.execute(select([func.pg_advisory_unlock(*lock)]))
+    self.assertFalse(self.mock_get.called)
+    self.assertTrue(image_uploader.import_avatar(user_id, 'http://fb/a.jpg'))
+
+  def test_import_avatar_other_source(self):
+    '''verify an import whose url isn't the pending one of the user (e.g.
+    already imported by a concurrent job) doesn't change it'''
+    user_id = self.create_new_user(avatar_source=None)
+    stored = self.stored_avatars()
+    self.assertFalse(image_uploader.import_avatar(user_id, 'http://fb/a.jpg'))
+    self.assertEqual(self.get_user(user_id).avatar_url,
+                    self.app.config['DEFAULT_AVATAR'])
+    self.assertEqual(self.stored_avatars(), stored)
+    self.assertFalse(self.mock_get.called)
+
+  def test_resume(self):
+    '''verify the avatars still pending (e.g. the process exited before
+    importing them) are queued again'''
+    user_id = self.create_new_user()
+    self.create_new_user(avatar_source=None)
+    with patch.object(image_uploader, 'enqueue_avatar') as mock_enqueue:
+      self.assertEqual(image_uploader.resume(), 1)
+    mock_enqueue.assert_called_once_with(user_id, 'http://fb/a.jpg')
+
+  def test_workers(self):
+    '''verify the avatar is imported by the worker threads'''
+    user_id = self.create_new_user()
+    image_uploader.workers = 2
+    try:
+      image_uploader.enqueue_avatar(user_id, 'http://fb/a.jpg')
+      image_uploader.join()
+    finally:
+      image_uploader.workers = 0
+    self.assertNotEqual(self.get_user(user_id).avatar_url,
+                        self.app.config['DEFAULT_AVATAR'])